@@ -43,12 +43,41 @@
 #
 # =================================================================
 
+import csv
+import glob
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from woudc_formats import load, WOUDCFormatParserError
-from woudc_formats.util import setup_logger
+import zipfile
+from pyshadoz import SHADOZ
+import woudc_extcsv
+from woudc_formats import (convert_stream, dumps, load, shadoz_converter,
+                           ProfileColumn, ProfileTable,
+                           WOUDCFormatParserError)
+from woudc_formats.totalozone_mf import (MasterFileFilter, MasterFileReader,
+                                         TotalOzone_MasterFile,
+                                         diff_master_files, format_daily_rows)
+from woudc_formats.util import (ConfigIndex, get_config_value, setup_logger,
+                                get_NDACC_agency, get_NDACC_agencies,
+                                get_NDACC_station, StationMetadataProvider,
+                                StationMetadataError, StationRegistry,
+                                get_extcsvs, WOUDCextCSVReader,
+                                get_extcsv_value, get_extcsv_values)
+from woudc_formats import util
 import logging
 import re
 
+TOTALOZONE_DIR = os.path.abspath('tests/totalozone')
+
 
 class Test(unittest.TestCase):
     """Test suite for Writer"""
@@ -68,6 +97,102 @@ class Test(unittest.TestCase):
     def test_dump_file(self):
         """notification test"""
 
+    def test_shadoz_profile_rows(self):
+        """
+        SHADOZ column-wise PROFILE conversion tests
+        """
+        with open('tests/reunion_20141210_V05.dat') as ff:
+            s = SHADOZ(ff)
+        converter = shadoz_converter()
+        rows = list(converter.profile_table(s, '9000'))
+        self.assertEqual(len(rows), len(s.data))
+        self.assertEqual(rows, converter.profile_rows_by_row(s, '9000'))
+
+        # missing, bad and unusual values
+        data = s.data[:6]
+        press = s.get_data_index('Press')
+        data[1][press] = '******'
+        data[2][s.get_data_index('Alt', 'km')] = 9000.3
+        data[3][s.get_data_index('T Pump')] = -0.0001
+        data[4][s.get_data_index('GPSLat')] = '*****'
+        data[5][s.get_data_index('Temp')] = 12345678901.0005
+        s.data = data
+        rows = list(converter.profile_table(s, '9000'))
+        self.assertEqual(rows, converter.profile_rows_by_row(s, '9000'))
+        self.assertEqual([row[0] == '' for row in rows],
+                         [False] * 4 + [False, True])
+        self.assertEqual(rows[1][7], '')
+        self.assertEqual(rows[2][9], '-0.000')
+
+        # other text values are converted row by row
+        data[0][press] = '0998'
+        with self.assertRaises(ValueError):
+            converter.profile_table(s, '9000')
+
+    def test_profile_table(self):
+        """
+        PROFILE table column storage and text tests
+        """
+
+        rows = [['1013.2', '2.50', '', '-0', '', '', '0', '8.0', '7', 'n/a'],
+                ['1000.0', '2.05', '-12.3', '1.5', '', '', '5.5', '1e-05',
+                 '007', '']]
+        table = ProfileTable.from_rows(rows)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(list(table), rows)
+        self.assertEqual(list(table.rows(1)), rows[1:])
+        self.assertEqual(table[-1], rows[-1])
+        self.assertEqual([column.text is not None
+                          for column in table.columns],
+                         [False] * 7 + [True, True, True])
+        self.assertEqual(table.columns[0].values.tolist(), [1013.2, 1000.0])
+        self.assertEqual(table.columns[2].missing.tolist(), [True, False])
+
+        numbers = ProfileColumn.from_numbers([0.1 + 0.2, 5.0, -1e-7, 1e16])
+        self.assertEqual(numbers.format().tolist(),
+                         ['0.30000000000000004', '5.0', '-1e-07', '1e+16'])
+        self.assertEqual(ProfileColumn.from_numbers([3, -4]).format()
+                         .tolist(), ['3', '-4'])
+
+        with self.assertRaises(ValueError):
+            ProfileTable.from_rows([['1'] * 9])
+        with self.assertRaises(ValueError):
+            ProfileTable([ProfileColumn.blank(size)
+                          for size in [1] * 9 + [2]])
+        self.assertEqual(list(ProfileTable()), [])
+
+        table.CHUNK_SIZE = 1
+        self.assertEqual(list(table.rows()), rows)
+        self.assertEqual(list(table.subset(1)), rows[1:])
+        self.assertEqual(list(table.subset(0, -1).rows(-1)), rows[:1])
+
+    def test_add_payload(self):
+        """
+        Bulk payload insertion tests
+        """
+
+        rows = [['1013.2', '2.50', '', '', '', '', '0', '8.0', '7', ''],
+                ['1000.0', '2.05', '-12.3', '', '', '', '5', '9.5', '', '']]
+        table = ProfileTable.from_rows(rows)
+
+        by_row = woudc_extcsv.Writer(template=True)
+        by_row.add_data('PROFILE', ','.join(rows[0]),
+                        field=','.join(table.fields))
+        by_row.add_data('PROFILE', ','.join(rows[1]))
+        bulk = woudc_extcsv.Writer(template=True)
+        util.add_payload(bulk, 'PROFILE', table.fields,
+                         table.text_columns())
+        self.assertEqual(bulk.extcsv_ds, by_row.extcsv_ds)
+        self.assertEqual(woudc_extcsv.dumps(bulk),
+                         woudc_extcsv.dumps(by_row))
+
+        with self.assertRaises(ValueError):
+            util.add_payload(bulk, 'PROFILE', table.fields,
+                             table.text_columns(0, 0))
+        with self.assertRaises(ValueError):
+            util.add_payload(bulk, 'PROFILE', table.fields[1:],
+                             table.text_columns())
+
     def test_shadoz(self):
         """
         Tests for SHADOZ
@@ -231,6 +356,77 @@ class Test(unittest.TestCase):
         self.assertEqual(b.extcsv_ds["PLATFORM$1"]["Country"], ["ATA"])
         self.assertEqual(b.extcsv_ds["DATA_GENERATION$1"]["Agency"], ["BAS"])
 
+    def test_convert_stream(self):
+        """
+        Streaming conversion tests
+        """
+
+        bas_filename = 'tests/7_Vernadsky_2013-05-16.txt'
+        vaisala_filename = 'tests/Ozono000121_14SEG_SKBO.txt'
+        metadata = {'ID': '666', 'SA': 'Vaisala_SA',
+                    'country': 'Vaisala_Country'}
+
+        out = io.StringIO(newline='')
+        with open(bas_filename) as ff:
+            count = convert_stream('BAS', ff, out)
+        self.assertEqual(count, 298)
+        self.assertEqual(out.getvalue(), dumps(load('BAS', bas_filename)))
+
+        out = io.StringIO(newline='')
+        with open(vaisala_filename) as ff:
+            convert_stream('Vaisala', ff, out, 'Vaisala', 'Vaisala_Agency',
+                           metadata)
+        self.assertEqual(out.getvalue(),
+                         dumps(load('Vaisala', vaisala_filename, 'Vaisala',
+                                    'Vaisala_Agency', metadata)))
+
+        with self.assertRaises(RuntimeError):
+            convert_stream('unknown', io.StringIO(), io.StringIO())
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            output = os.path.join(tmpdir, 'out.csv')
+            subprocess.check_call([
+                sys.executable, '-c', 'from woudc_formats import cli; cli()',
+                '--format', 'BAS', '--inpath', bas_filename,
+                '--outpath', output, '--stream',
+                '--logfile', os.path.join(tmpdir, 'log.log'),
+                '--loglevel', 'ERROR'])
+            with open(output, newline='') as ff:
+                self.assertEqual(ff.read(),
+                                 dumps(load('BAS', bas_filename)))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_fixed_width_format(self):
+        """
+        Fixed-width column-spec engine tests
+        """
+
+        variants = [
+            util.FixedWidthVariant('a', 'A   B', [('x', 0, 3), ('y', 3, 6)]),
+            util.FixedWidthVariant('b', 'A  BB', [('x', 0, 3), ('y', 2, 8)])
+        ]
+        lines = ['Site: one\n', 'ignored\n', 'A   B\n', ' 1  22\n',
+                 '   \n', 'Site: two\n', 'A  BB\n', '12345678\n', '9']
+        fmt = util.FixedWidthFormat(variants, rules=[
+            ('Site', 'site', lambda line: line.split(':')[1].strip())])
+        metadata, sections = fmt.read(lines)
+        self.assertEqual(metadata, {'site': 'two'})
+        self.assertEqual([(variant.name, data) for variant, data in sections],
+                         [('a', [' 1  22\n']), ('b', ['12345678\n', '9'])])
+        columns = fmt.extract(sections)
+        self.assertEqual(columns['x'].tolist(), ['1', '123', '9'])
+        self.assertEqual(columns['y'].tolist(), ['22', '345678', ''])
+        self.assertEqual(fmt.extract([])['x'].tolist(), [])
+
+        fmt = util.FixedWidthFormat(variants, rules=[
+            ('Site', 'site', lambda line: line.split(':')[1].strip())],
+            exclusive=False, blank_rows=True)
+        metadata, sections = fmt.read(lines)
+        self.assertEqual(sections[0][1], [' 1  22\n', '   \n',
+                                          'Site: two\n'])
+
     def test_AMES(self):
         """
         Tests for AMES-2160
@@ -458,6 +654,771 @@ class Test(unittest.TestCase):
         self.assertEqual(Vai.extcsv_ds["PLATFORM$1"]["Country"], ["Vaisala_Country"])  # noqa
         self.assertEqual(Vai.extcsv_ds["DATA_GENERATION$1"]["Agency"], ["Vaisala_Agency"])  # noqa
 
+    def build_masterfile(self, directory=TOTALOZONE_DIR, heading='off',
+                         **kwargs):
+        """
+        Helper to run the master file builder in a scratch directory
+
+        :returns: tuple of (o3tot.dat content, processing log content)
+        """
+        products, log = self.build_masterfile_products(directory, heading,
+                                                       **kwargs)
+        return products['o3tot.zip']['o3tot.dat'], log
+
+    def build_masterfile_products(self, directory=TOTALOZONE_DIR,
+                                  heading='off', **kwargs):
+        """
+        Helper to run the master file builder in a scratch directory
+
+        :returns: tuple of (dict of output file name to content, or to
+                  dict of member name to content for zip files,
+                  processing log content)
+        """
+        cwd = os.getcwd()
+        outdir = tempfile.mkdtemp()
+        products = {}
+        try:
+            os.chdir(outdir)
+            MF = TotalOzone_MasterFile()
+            MF.update_totalOzone_master_file(directory, outdir, None,
+                                             'overwrite', heading, **kwargs)
+            for filepath in glob.glob(os.path.join(outdir, 'o3tot*')):
+                name = os.path.basename(filepath)
+                if name.endswith('.zip'):
+                    with zipfile.ZipFile(filepath) as z:
+                        products[name] = {member: z.read(member).decode()
+                                          for member in z.namelist()}
+                elif name.endswith('.gz'):
+                    with gzip.open(filepath) as ff:
+                        products[name] = ff.read().decode()
+                else:
+                    with open(filepath, newline='') as ff:
+                        products[name] = ff.read()
+            with open(glob.glob('totalOzone_processing_log_*')[0]) as ff:
+                log = ff.read()
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(outdir)
+        return products, log
+
+    def test_totalozone_masterfile(self):
+        """
+        TotalOzone Master File Tests
+        """
+        data, log = self.build_masterfile()
+        lines = data.split('\r\n')[:-1]
+
+        self.assertEqual(len(lines), 17)
+        self.assertTrue(all(len(line) == 29 for line in lines))
+        self.assertEqual(lines[0], '06520190101071590289    1  72')
+        self.assertEqual(lines[-3], '07720200101181990401    1   0')
+        self.assertIn('SUCCESS (2 DAILY rows)', log)
+        self.assertIn('DONE (0 DAILY rows) but with 1 errors', log)
+
+        data2, log2 = self.build_masterfile(jobs=3)
+        self.assertEqual(data, data2)
+        self.assertEqual(log, log2)
+
+    def test_totalozone_masterfile_manifest(self):
+        """
+        TotalOzone Master File incremental rebuild tests
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            directory = os.path.join(tmpdir, 'archive')
+            shutil.copytree(TOTALOZONE_DIR, directory)
+            manifest_file = os.path.join(tmpdir, 'manifest.json')
+
+            data, log = self.build_masterfile(directory,
+                                              manifest_file=manifest_file)
+            data2, log2 = self.build_masterfile(directory,
+                                                manifest_file=manifest_file)
+            self.assertEqual(data, data2)
+            self.assertEqual(log, log2)
+
+            # unchanged files are reassembled from the manifest
+            unchanged = os.path.join(directory, 'stn077', 'brewer', '2020',
+                                     '20200101.Brewer.MKIII.185.MSC.csv')
+            with open(manifest_file) as ff:
+                manifest = json.load(ff)
+            manifest['files'][unchanged]['lines'] = ['CACHED\r\n']
+            with open(manifest_file, 'w') as ff:
+                json.dump(manifest, ff)
+
+            # changed files are parsed again
+            changed = os.path.join(directory, 'stn065', 'brewer', '2019',
+                                   '20190201.Brewer.MKIV.072.DWD.csv')
+            with open(changed) as ff:
+                content = ff.read().replace('330.2', '331.25')
+            with open(changed, 'w') as ff:
+                ff.write(content)
+
+            data3, log3 = self.build_masterfile(directory,
+                                                manifest_file=manifest_file)
+            self.assertIn('CACHED\r\n', data3)
+            self.assertNotIn('07720200101181990401', data3)
+            self.assertIn('06520190201061690331', data3)
+            self.assertNotIn('06520190201061690330', data3)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_totalozone_masterfile_zip(self):
+        """
+        TotalOzone Master File from zip archive tests
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            archive = shutil.make_archive(os.path.join(tmpdir, 'archive'),
+                                          'zip', TOTALOZONE_DIR)
+            data, log = self.build_masterfile()
+            data2, log2 = self.build_masterfile(archive, jobs=2)
+            self.assertEqual(data, data2)
+            self.assertEqual(log.replace(TOTALOZONE_DIR, archive), log2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_totalozone_masterfile_outputs(self):
+        """
+        TotalOzone Master File multiple outputs in one pass tests
+        """
+        data, log = self.build_masterfile()
+        data_csv, log_csv = self.build_masterfile(heading='on')
+        products, log_multi = self.build_masterfile_products(
+            outputs=['fixed', 'csv', 'platform'])
+
+        self.assertEqual(sorted(products), ['o3tot.zip', 'o3tot_csv.zip',
+                                            'o3tot_platforms.zip'])
+        self.assertEqual(products['o3tot.zip'], {'o3tot.dat': data})
+        self.assertEqual(products['o3tot_csv.zip'], {'o3tot.csv': data_csv})
+        self.assertEqual(log_multi, log)
+
+        platforms = products['o3tot_platforms.zip']
+        self.assertEqual(sorted(platforms),
+                         ['o3tot_065.dat', 'o3tot_077.dat'])
+        for name, content in platforms.items():
+            lines = content.split('\r\n')[:-1]
+            self.assertTrue(lines)
+            self.assertTrue(all(line[:3] == name[6:9] for line in lines))
+        self.assertEqual(sorted(''.join(platforms.values()).split('\r\n')),
+                         sorted(data.split('\r\n')))
+
+        products, log_multi = self.build_masterfile_products(
+            outputs=['csv'], jobs=2)
+        self.assertEqual(products, {'o3tot_csv.zip': {'o3tot.csv': data_csv}})
+        self.assertEqual(log_multi, log_csv)
+
+        with self.assertRaises(ValueError):
+            self.build_masterfile_products(outputs=['nope'])
+
+    def test_totalozone_masterfile_compression(self):
+        """
+        TotalOzone Master File compression and extra copies tests
+        """
+        data, log = self.build_masterfile()
+        products, _ = self.build_masterfile_products(
+            compresslevel=1, extras=('plain', 'gzip'))
+        self.assertEqual(products, {'o3tot.zip': {'o3tot.dat': data},
+                                    'o3tot.dat': data,
+                                    'o3tot.dat.gz': data})
+
+        products, _ = self.build_masterfile_products(
+            outputs=['fixed', 'platform'], extras=('gzip',))
+        self.assertEqual(sorted(products),
+                         ['o3tot.dat.gz', 'o3tot.zip', 'o3tot_065.dat.gz',
+                          'o3tot_077.dat.gz', 'o3tot_platforms.zip'])
+        self.assertEqual(products['o3tot.dat.gz'], data)
+        self.assertEqual(products['o3tot_065.dat.gz'],
+                         products['o3tot_platforms.zip']['o3tot_065.dat'])
+
+    def test_totalozone_masterfile_filter(self):
+        """
+        TotalOzone Master File input selection tests
+        """
+        data, log = self.build_masterfile()
+        lines = data.splitlines(True)
+
+        file_filter = MasterFileFilter(platforms=['65'])
+        data2, log2 = self.build_masterfile(file_filter=file_filter)
+        self.assertEqual(data2, ''.join(line for line in lines
+                                        if line.startswith('065')))
+        self.assertNotIn('stn077', log2)
+        self.assertEqual((file_filter.selected, file_filter.skipped,
+                          file_filter.header_reads), (3, 0, 0))
+
+        file_filter = MasterFileFilter(instruments=['BREWER'],
+                                       start_date='2020-02-15')
+        data2, log2 = self.build_masterfile(file_filter=file_filter)
+        self.assertEqual(data2, ''.join(
+            line for line in lines
+            if line.startswith('0772020') and line[7:9] != '01'))
+        self.assertEqual(log2.count('PROCESSING:'), 2)
+        self.assertEqual(file_filter.header_reads, 0)
+
+        info = MasterFileFilter.classify(
+            'stn065/dobson/2019/20190101.Dobson.Beck.104.DWD.csv')
+        self.assertEqual(info, {'platform': '065', 'instrument': 'dobson',
+                                'first': '2019-01-01', 'last': '2019-01-31'})
+        self.assertEqual(MasterFileFilter.classify('incoming/o3.csv'), {})
+
+        # names which cannot be classified fall back to the header
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for name in ('stn077', 'stn065'):
+                src = glob.glob(os.path.join(TOTALOZONE_DIR, name, 'brewer',
+                                             '*', '*.csv'))[0]
+                shutil.copy(src, os.path.join(tmpdir, '%s.csv' % name[3:]))
+            file_filter = MasterFileFilter(platforms=['077'],
+                                           end_date='2020-12-31')
+            _, log2 = self.build_masterfile(tmpdir, file_filter=file_filter)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(log2.count('PROCESSING:'), 1)
+        self.assertIn('077.csv', log2)
+        self.assertEqual(file_filter.header_reads, 2)
+
+    def test_totalozone_masterfile_reader(self):
+        """
+        TotalOzone Master File index and query tests
+        """
+        data, _ = self.build_masterfile()
+        lines = data.splitlines(True)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(tmpdir, 'o3tot.dat')
+            with open(filepath, 'w', newline='') as ff:
+                ff.write(data)
+            with zipfile.ZipFile(os.path.join(tmpdir, 'o3tot.zip'), 'w') as z:
+                z.write(filepath, 'o3tot.dat')
+
+            for name in ('o3tot.dat', 'o3tot.zip'):
+                with MasterFileReader(os.path.join(tmpdir, name)) as reader:
+                    self.assertEqual(len(reader), len(lines))
+                    self.assertEqual(reader.platforms(), ['065', '077'])
+                    result = reader.query('65', '2019-01-02', '2019-02-03')
+                    expected = sorted(
+                        (line[3:11], number)
+                        for number, line in enumerate(lines)
+                        if line.startswith('065')
+                        if '20190102' <= line[3:11] <= '20190203')
+                    self.assertEqual(result['record'].tolist(),
+                                     [number for _, number in expected])
+                    self.assertTrue((result['platform'] == '065').all())
+                    self.assertEqual(
+                        reader.lines(result['record']),
+                        [lines[number] for _, number in expected])
+                    first = expected[0][1]
+                    self.assertEqual(result['year'][0], 2019)
+                    self.assertEqual(result['columno3'][0],
+                                     int(lines[first][17:20]))
+                    self.assertEqual(result['instrument_number'][0],
+                                     int(lines[first][25:29]))
+                    self.assertEqual(len(reader.query(77)['record']), 3)
+                    self.assertEqual(len(reader.query('999')['record']), 0)
+
+            with open(filepath, 'a') as ff:
+                ff.write('short\n')
+            with self.assertRaises(ValueError):
+                MasterFileReader(filepath)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_totalozone_masterfile_upsert(self):
+        """
+        TotalOzone Master File upsert tests
+        """
+        tmpdir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        try:
+            tree = os.path.join(tmpdir, 'tree')
+            shutil.copytree(TOTALOZONE_DIR, tree)
+            os.mkdir(os.path.join(tmpdir, 'out'))
+            os.chdir(tmpdir)
+            MF = TotalOzone_MasterFile()
+            MF.update_totalOzone_master_file(tree, 'out', None, 'overwrite',
+                                             'off')
+
+            # corrected value and an additional row
+            filepath = os.path.join(tree, 'stn065', 'brewer', '2019',
+                                    '20190101.Brewer.MKIV.072.DWD.csv')
+            with open(filepath, encoding='latin-1') as ff:
+                content = ff.read()
+            content = content.replace(
+                '2019-01-01,9,0,289.4', '2019-01-01,9,0,277.4').replace(
+                '2019-01-08,9,0,295.5,,0.4,9',
+                '2019-01-08,9,0,295.5,,0.4,9\n2019-01-09,9,0,299.0,,10,12')
+            with open(filepath, 'w', encoding='latin-1') as ff:
+                ff.write(content)
+
+            self.assertEqual(
+                MF.upsert_totalOzone_master_file(filepath, 'out'), (5, 6))
+            self.assertEqual(os.listdir('out'), ['o3tot.zip'])
+            with zipfile.ZipFile(os.path.join('out', 'o3tot.zip')) as z:
+                upserted = z.read('o3tot.dat')
+            self.assertIn(b'06520190101071590277', upserted)
+
+            os.mkdir('rebuilt')
+            MF.update_totalOzone_master_file(tree, 'rebuilt', None,
+                                             'overwrite', 'off')
+            with zipfile.ZipFile(os.path.join('rebuilt', 'o3tot.zip')) as z:
+                self.assertEqual(upserted, z.read('o3tot.dat'))
+
+            # resubmitting again leaves no duplicates
+            self.assertEqual(
+                MF.upsert_totalOzone_master_file(filepath, 'out',
+                                                 extras=('plain',)), (6, 6))
+            with open(os.path.join('out', 'o3tot.dat'), 'rb') as ff:
+                self.assertEqual(upserted, ff.read())
+
+            # dropped last row and re-keyed UTC_Begin leave no stale records
+            content = content.replace(
+                '\n2019-01-09,9,0,299.0,,10,12', '').replace(
+                '2019-01-01,9,0,277.4,1.2,7.2', '2019-01-01,9,0,277.4,1.2,6.2')
+            with open(filepath, 'w', encoding='latin-1') as ff:
+                ff.write(content)
+            self.assertEqual(
+                MF.upsert_totalOzone_master_file(filepath, 'out',
+                                                 extras=('plain',)), (6, 5))
+            shutil.rmtree('rebuilt')
+            os.mkdir('rebuilt')
+            MF.update_totalOzone_master_file(tree, 'rebuilt', None,
+                                             'overwrite', 'off')
+            with zipfile.ZipFile(os.path.join('rebuilt', 'o3tot.zip')) as z:
+                rebuilt = z.read('o3tot.dat')
+            self.assertNotIn(b'065201901090', rebuilt)
+            self.assertIn(b'06520190101061590277', rebuilt)
+            with open(os.path.join('out', 'o3tot.dat'), 'rb') as ff:
+                self.assertEqual(ff.read(), rebuilt)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmpdir)
+
+    def test_totalozone_masterfile_diff(self):
+        """
+        TotalOzone Master File diff tests
+        """
+        data, _ = self.build_masterfile()
+        lines = data.encode().splitlines(True)
+        changed = lines[1][:17] + b'299' + lines[1][20:]
+        added = b'07720200103171990399    1   0\r\n'
+        new_lines = [added] + lines[:1] + [changed] + lines[3:]
+        tmpdir = tempfile.mkdtemp()
+        try:
+            old = os.path.join(tmpdir, 'old.dat')
+            new = os.path.join(tmpdir, 'o3tot.zip')
+            delta = os.path.join(tmpdir, 'delta')
+            with open(old, 'wb') as ff:
+                ff.write(b''.join(lines))
+            with zipfile.ZipFile(new, 'w') as z:
+                z.writestr('o3tot.dat', b''.join(new_lines))
+
+            for run_size in (1000000, 2):
+                counts = diff_master_files(old, new, delta, run_size)
+                self.assertEqual(counts,
+                                 {'added': 1, 'removed': 1, 'changed': 1})
+                with open(delta, 'rb') as ff:
+                    self.assertEqual(ff.read(), b''.join([
+                        b'~' + lines[1][:29] + changed,
+                        b'-' + lines[2],
+                        b'+' + added]))
+
+            self.assertEqual(diff_master_files(old, old, delta),
+                             {'added': 0, 'removed': 0, 'changed': 0})
+            with open(delta, 'rb') as ff:
+                self.assertEqual(ff.read(), b'')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_totalozone_masterfile_shards(self):
+        """
+        Sharded TotalOzone Master File tests
+        """
+        data, log = self.build_masterfile()
+        package_dir = os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=package_dir)
+        tmpdir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        try:
+            os.chdir(tmpdir)
+            os.mkdir('parts')
+            os.mkdir('merged')
+            # shards run as separate processes
+            processes = [subprocess.Popen(
+                [sys.executable, '-c', 'from woudc_formats import cli; cli()',
+                 '--format', 'totalozone-masterfile',
+                 '--inpath', TOTALOZONE_DIR, '--outpath', 'parts',
+                 '--shard', '%d/3' % index, '--logfile', 'shard.log',
+                 '--loglevel', 'ERROR'],
+                env=env, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL) for index in range(3)]
+            self.assertEqual([process.wait() for process in processes],
+                             [0, 0, 0])
+            shard_files = sorted(glob.glob(os.path.join('parts', '*')))
+            self.assertEqual([os.path.basename(filepath)
+                              for filepath in shard_files],
+                             ['o3tot_shard_%d_of_3.jsonl' % index
+                              for index in range(3)])
+
+            MF = TotalOzone_MasterFile()
+            with self.assertRaises(ValueError):
+                MF.merge_totalOzone_master_file_shards(shard_files[1:],
+                                                       'merged')
+            MF.merge_totalOzone_master_file_shards(shard_files, 'merged')
+            with zipfile.ZipFile(os.path.join('merged', 'o3tot.zip')) as z:
+                self.assertEqual(z.read('o3tot.dat').decode(), data)
+            logs = glob.glob('totalOzone_processing_log_*')
+            self.assertEqual(len(logs), 4)
+            merged_log = [name for name in logs if 'shard' not in name][0]
+            with open(merged_log) as ff:
+                self.assertEqual(ff.read(), log)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmpdir)
+
+    def test_scan_directory(self):
+        """
+        Directory tree scanner tests
+        """
+        expected = []
+        for dirname, dirnames, filenames in os.walk(TOTALOZONE_DIR):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                filepath = os.path.join(dirname, filename)
+                expected.append((filepath, os.path.getsize(filepath),
+                                 os.path.getmtime(filepath), None))
+        for workers in (1, 4):
+            self.assertEqual(
+                list(util.scan_directory(TOTALOZONE_DIR, workers)), expected)
+
+        entries = list(util.scan_directory(
+            TOTALOZONE_DIR, 4, lambda relpath: relpath != 'stn065'))
+        self.assertEqual(entries, [entry for entry in expected
+                                   if 'stn065' not in entry[0]])
+
+        self.assertEqual(util.get_dir_stat(TOTALOZONE_DIR),
+                         [sum(entry[1] for entry in expected), len(expected)])
+        kept = [entry[1] for entry in expected if 'dobson' not in entry[0]]
+        self.assertEqual(util.get_dir_stat(TOTALOZONE_DIR, 'dobson'),
+                         [sum(kept), len(kept)])
+        self.assertEqual(list(util.scan_directory(
+            os.path.join(TOTALOZONE_DIR, 'missing'))), [])
+
+    def test_extcsv_reader_stream(self):
+        """
+        Single pass ext-CSV reader tests
+        """
+        filepath = os.path.join(TOTALOZONE_DIR, 'stn077', 'brewer', '2020',
+                                '20200301.Brewer.MKIII.185.MSC.csv')
+        reader = WOUDCextCSVReader(filepath)
+        self.assertEqual(reader.sections['PLATFORM']['ID'], '077')
+        self.assertIn(u'39\u00e9', reader.sections['DAILY']['_raw'])
+
+        with open(filepath, 'rb') as ff:
+            content = ff.read()
+        content = content.replace(b'\r\n', b'\n').replace(b'\n', b'\r')
+        # chunks smaller than a line, lone CR line terminators
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpdir, 'cr.csv'), 'wb') as ff:
+                ff.write(content)
+            reader2 = WOUDCextCSVReader(os.path.join(tmpdir, 'cr.csv'))
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(reader2.sections, reader.sections)
+        with open(filepath, 'rb') as ff:
+            reader3 = WOUDCextCSVReader(filepath, ff)
+        self.assertEqual(reader3.sections, reader.sections)
+        reader3.sections = {}
+        with open(filepath, 'rb') as ff:
+            reader3.read_stream(ff, chunk_size=7)
+        self.assertEqual(reader3.sections, reader.sections)
+
+        # ISO-8859-1 byte past the first chunk: whole stream re-read
+        with open(filepath, 'rb') as ff:
+            mixed = ff.read().replace(b'PLATFORM', b'PLATFORM\xc3\xa9', 1)
+        self.assertLess(mixed.index(b'\xc3\xa9'), 16)
+        self.assertGreater(mixed.index(b'\xe9'), 16)
+        reader3.sections = {}
+        reader3.read_stream(io.BytesIO(mixed), chunk_size=16)
+        self.assertIn(u'PLATFORM\u00c3\u00a9', reader3.sections)
+        self.assertEqual(reader3.sections['DAILY']['_raw'],
+                         reader.sections['DAILY']['_raw'])
+
+        # selective and lazy reads
+        reader4 = WOUDCextCSVReader(filepath, tables=['PLATFORM', 'DAILY'])
+        self.assertEqual(sorted(reader4.sections), ['DAILY', 'PLATFORM'])
+        self.assertFalse(dict.__contains__(reader4.sections['DAILY'], '_raw'))
+        self.assertEqual(reader4.sections['DAILY']['_raw'],
+                         reader.sections['DAILY']['_raw'])
+        reader5 = WOUDCextCSVReader(filepath, tables=['PLATFORM'],
+                                    early_exit=True)
+        self.assertEqual(reader5.sections, {'PLATFORM':
+                                            reader.sections['PLATFORM']})
+
+    def test_extcsv_payload_columns(self):
+        """
+        Columnar payload value tests
+        """
+        filepath = os.path.join(TOTALOZONE_DIR, 'stn065', 'brewer', '2019',
+                                '20190101.Brewer.MKIV.072.DWD.csv')
+        reader = WOUDCextCSVReader(filepath)
+        raw = reader.sections['DAILY']['_raw']
+        rows = [row for row in csv.reader(io.StringIO(raw))]
+        dates = [(row + [''])[0] for row in rows[1:]]
+        o3 = [(row + [''] * 4)[3] for row in rows[1:]]
+
+        self.assertEqual(get_extcsv_value(reader, 'DAILY', 'Date', True),
+                         dates)
+        self.assertEqual(get_extcsv_value(reader, 'DAILY', 'Nope', True),
+                         [])
+        self.assertEqual(get_extcsv_values(reader, 'DAILY',
+                                           ['Date', 'ColumnO3'], True),
+                         [dates, o3])
+        self.assertEqual(get_extcsv_values(reader, 'PLATFORM', ['ID']),
+                         ['065'])
+        self.assertIsNone(get_extcsv_value(reader, 'NOPE', 'Date', True))
+
+        # the cached columns follow changes to the table
+        reader.sections['DAILY']['_raw'] = 'Date,ColumnO3\r\nx,1\r\n'
+        self.assertEqual(get_extcsv_value(reader, 'DAILY', 'Date', True),
+                         ['x'])
+
+    def test_totalozone_daily_batch(self):
+        """
+        TotalOzone Master File bulk DAILY formatting tests
+        """
+        header = ['Date', 'WLCode', 'ObsCode', 'ColumnO3', 'StdDevO3',
+                  'UTC_Begin', 'UTC_End', 'UTC_Mean', 'nObs', 'mMu',
+                  'ColumnSO2']
+        col_map = {col: idx for idx, col in enumerate(header)}
+        rows = [
+            ['2019-01-01', '9', '0', '289.4', '', '7.2', '14.6', '', '25', '', ''],  # noqa
+            ['2019-01-02', '', '', '8.4', '', '', '', '4.5', '', '', ''],
+            ['2019-01-03', '9', '0', '301', '', '07:12:00', '', '', '', '', ''],  # noqa
+            ['2019-01-04', '9', '0', '301', '', '', '', '-1.7', '', '', ''],
+            ['2019-01-05', 'AD', '0', '301', '', '', '', '', '', '', ''],
+            ['2019-01-06', '9', '0', '1500', '', '', '', '', '', '', ''],
+            ['2019-01-07', '9', '0', '301', '', '', '', '', '12', '', ''],
+            # non-ASCII digits are left to the row by row path
+            ['2019-01-08', '9', '0', '\u0663\u0660\u0660', '', '', '', '',
+             '', '', ''],
+            ['2019-01-09', '9', '0', '301', '', '\u0667\u0667\u0667', '',
+             '', '', '', '']
+        ]
+        lines = format_daily_rows(rows, col_map, '065', 'Brewer', ' 1',
+                                  '  72')
+
+        self.assertEqual(lines[0], '06520190101071590289    1  72')
+        self.assertEqual(lines[1], '06520190102  0499  8    1  72')
+        self.assertEqual(lines[2:], [None] * 7)
+
+    def test_config_index(self):
+        """
+        Configuration index tests
+        """
+        self.assertEqual(get_config_value('Instrument Type ID', 'Brewer'),
+                         '1')
+        self.assertEqual(get_config_value('Instrument Type ID', 'brewer'),
+                         '1')
+        with self.assertRaises(Exception):
+            get_config_value('WLCode', 'AD')
+        with self.assertRaises(Exception):
+            get_config_value('No Such Section', 'Brewer')
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(tmpdir, 'test.cfg')
+            with open(filepath, 'w') as ff:
+                ff.write('[Section]\nKey: 1\n')
+            config = ConfigIndex(filepath, check_mtime=True)
+            self.assertEqual(config.get('Section', 'Key'), '1')
+            with open(filepath, 'w') as ff:
+                ff.write('[Section]\nKey: 2\n')
+            os.utime(filepath, (0, 0))
+            self.assertEqual(config.get('Section', 'Key'), '2')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_NDACC_lookup(self):
+        """
+        NDACC PI and station lookup tests
+        """
+        self.assertEqual(get_NDACC_agency('CLAUDE H.'), 'DWD')
+        self.assertEqual(get_NDACC_agency('Claude H'), 'DWD')
+        self.assertEqual(get_NDACC_agency('BARNES J. E.'), 'ESRL/GMD')
+        self.assertIsNone(get_NDACC_agency('CLAUDE'))
+        self.assertEqual(get_NDACC_station('ADDIS.ABABA'), ('9.000', '39.000'))
+        self.assertEqual(get_NDACC_station('Addis Ababa'), ('9.000', '39.000'))
+        self.assertEqual(get_NDACC_station('ALERT'), ('82.500', '297.700'))
+        self.assertIsNone(get_NDACC_station('ALER'))
+        self.assertEqual(get_NDACC_agencies(['CLAUDE H.', 'NOBODY']),
+                         {'CLAUDE H.': 'DWD', 'NOBODY': None})
+
+    def test_station_metadata_snapshot(self):
+        """
+        Station metadata snapshot and offline mode tests
+        """
+        metadata = {'type': 'FeatureCollection', 'features': [{
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [55.48, -21.06]},
+            'properties': {
+                'platform_type': 'STN', 'platform_id': '436',
+                'platform_name': 'Reunion', 'country_code': 'FRA',
+                'gaw_id': 'RUN', 'acronym': 'Univ.Reunion',
+                'contributor_name': 'Universite de la Reunion'}}]}
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache_file = os.path.join(tmpdir, 'metadata.json')
+            provider = StationMetadataProvider(cache_file, offline=True)
+            with self.assertRaises(StationMetadataError):
+                provider.get()
+
+            provider = StationMetadataProvider(cache_file, ttl=3600)
+            provider.fetch = lambda: metadata
+            self.assertEqual(provider.get(), metadata)
+            self.assertEqual(provider.get(), metadata)
+            self.assertTrue(os.path.exists(cache_file))
+
+            # fresh snapshot is reused without fetching
+            provider2 = StationMetadataProvider(cache_file, ttl=3600)
+            self.assertEqual(provider2.get(), metadata)
+            self.assertEqual(provider2.fetches, 0)
+
+            # expired snapshot is still used offline or when fetch fails
+            provider3 = StationMetadataProvider(cache_file, ttl=-1)
+            provider3.fetch = lambda: 1 / 0
+            self.assertEqual(provider3.get(), metadata)
+            provider3 = StationMetadataProvider(cache_file, ttl=-1,
+                                                offline=True)
+            self.assertEqual(provider3.get(), metadata)
+
+            saved = util.METADATA
+            util.METADATA = StationMetadataProvider(cache_file,
+                                                    offline=True)
+            try:
+                ecsv = load('SHADOZ', 'tests/reunion_20141210_V05.dat',
+                            'Reunion', 'Univ.Reunion')
+            finally:
+                util.METADATA = saved
+            self.assertEqual(ecsv.extcsv_ds['PLATFORM$1']['ID'], ['436'])
+            self.assertEqual(ecsv.extcsv_ds['PLATFORM$1']['GAW_ID'],
+                             ['RUN'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_station_registry(self):
+        """
+        Station registry lookup tests
+        """
+        def feature(platform_id, name, acronym, contributor):
+            return {'properties': {
+                'platform_id': platform_id, 'platform_name': name,
+                'acronym': acronym, 'contributor_name': contributor}}
+
+        registry = StationRegistry({'features': [
+            feature('001', 'Toronto', 'MSC', 'Environment Canada'),
+            feature('002', u'S\u00e3o Paulo', 'INPE', 'INPE Brazil'),
+            feature('003', 'Boulder', 'NOAA-GMD', 'NOAA'),
+            feature('004', 'Boulder', 'NOAA-CMDL', 'NOAA'),
+        ]})
+        self.assertEqual(registry.find('Toronto', 'MSC')['platform_id'],
+                         '001')
+        self.assertIsNone(registry.find('toronto', 'MSC'))
+        self.assertIsNone(registry.find('Toronto', 'NOAA'))
+        misread = u'S\u00e3o Paulo'.encode('utf-8').decode('latin1')
+        self.assertEqual(registry.find(misread, 'INPE')['platform_id'],
+                         '002')
+        self.assertEqual(len(registry.find_all('BOULDER')), 2)
+        self.assertEqual(
+            registry.find_by_agency('boulder', 'noaa-cmdl')['platform_id'],
+            '004')
+        # last match wins, as in the AMES parser's scan
+        self.assertEqual(
+            registry.find_by_agency('Boulder', 'NOAA')['platform_id'], '004')
+        self.assertIsNone(registry.find_by_agency('Boulder', 'MSC'))
+        self.assertEqual(len(registry.find_by_contributor('noaa')), 2)
+        self.assertEqual(registry.find_by_id('002')[0]['acronym'], 'INPE')
+
+    def test_get_extcsvs(self):
+        """
+        Concurrent Extended CSV fetch tests against a local server
+        """
+        extcsv = '\n'.join([
+            '#CONTENT', 'Class,Category,Level,Form',
+            'WOUDC,TotalOzone,1.0,1', '',
+            '#DATA_GENERATION', 'Date,Agency,Version,ScientificAuthority',
+            '2020-01-05,MSC,1.0,Test', '',
+            '#PLATFORM', 'Type,ID,Name,Country,GAW_ID',
+            'STN,077,Churchill,CAN,CHU', '',
+            '#INSTRUMENT', 'Name,Model,Number', 'Brewer,MKIII,185', '',
+            '#LOCATION', 'Latitude,Longitude,Height', '58.74,-94.07,35', '',
+            '#TIMESTAMP', 'UTCOffset,Date,Time', '+00:00:00,2020-01-01,', '',
+            '#DAILY', 'Date,WLCode,ObsCode,ColumnO3,UTC_Begin,UTC_End',
+            '2020-01-01,9,DS,401,18,19', '']).encode('utf-8')
+        requests_seen = {}
+        active = [0, 0]
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with lock:
+                    count = requests_seen.get(self.path, 0) + 1
+                    requests_seen[self.path] = count
+                    active[0] += 1
+                    active[1] = max(active)
+                time.sleep(0.02)
+                with lock:
+                    active[0] -= 1
+                if self.path == '/missing.csv':
+                    status, body = 404, b''
+                elif self.path.startswith('/flaky') and count < 3:
+                    status, body = 503, b''
+                elif self.path == '/bad.csv':
+                    status, body = 200, b'#DAILY\nnot an extcsv\n'
+                else:
+                    status, body = 200, extcsv
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            base = 'http://127.0.0.1:%d' % server.server_address[1]
+            urls = ['%s/good%d.csv' % (base, i) for i in range(8)]
+            urls += ['%s/%s.csv' % (base, name)
+                     for name in ('flaky', 'missing', 'bad')]
+            results = get_extcsvs(urls, workers=8, per_host=2, retries=3,
+                                  backoff=0.01)
+            self.assertEqual(list(results.keys()), urls)
+            for url in urls[:8] + [urls[8]]:
+                ecsv, error = results[url]
+                self.assertIsNone(error)
+                self.assertEqual(ecsv.sections['PLATFORM']['ID'], '077')
+            self.assertEqual(requests_seen['/flaky.csv'], 3)
+            self.assertIsNone(results[urls[9]][0])
+            self.assertIn('HTTP 404', results[urls[9]][1])
+            self.assertEqual(requests_seen['/missing.csv'], 1)
+            self.assertIsNone(results[urls[10]][0])
+            self.assertIn('Unable to parse', results[urls[10]][1])
+            self.assertLessEqual(active[1], 2)
+
+            url = '%s/flaky2.csv' % base
+            results = get_extcsvs([url], retries=0)
+            self.assertIsNone(results[url][0])
+            self.assertIn('HTTP 503', results[url][1])
+        finally:
+            server.shutdown()
+            server.server_close()
+
 
 # main
 if __name__ == '__main__':
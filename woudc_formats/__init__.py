@@ -43,20 +43,406 @@
 # =================================================================
 
 from abc import ABCMeta, abstractmethod
+import csv
 import logging
 import re
 import datetime
-from pywoudc import WoudcClient
 import woudc_extcsv
 from woudc_formats import util
 import ntpath
 from pyshadoz import SHADOZ
 import nappy
+import numpy as np
 
 __version__ = "0.3.0"
 
 LOGGER = logging.getLogger(__name__)
 
+# SHADOZ data fields (name, unit) of the PROFILE columns, in order,
+# without the unused column after WindDirection
+SHADOZ_PROFILE_FIELDS = (
+    ('Press', None),
+    ('O3', 'mPa'),
+    ('Temp', None),
+    ('W Spd', 'm/s'),
+    ('W Dir', None),
+    ('Time', 'sec'),
+    ('Alt', 'km'),
+    ('RH', '%'),
+    ('T Pump', None)
+)
+
+# Vaisala data columns (field, start, stop) before the ozone column
+VAISALA_COLUMNS = [
+    ('minutes', 0, 4),
+    ('seconds', 4, 7),
+    ('Pressure', 11, 18),
+    ('GPHeight', 20, 27),
+    ('Temperature', 31, 37),
+    ('RelativeHumidity', 40, 44)
+]
+
+# Vaisala variants, told apart by the units header line
+VAISALA_FORMAT = util.FixedWidthFormat([
+    util.FixedWidthVariant(
+        'ozone',
+        'min  s      hPa      gpm     deg C      %       C     C    C/km     m/sOzone [mPa]',  # noqa
+        VAISALA_COLUMNS + [('O3PartialPressure', 76, 80)]),
+    util.FixedWidthVariant(
+        'ozone and box temperature',
+        'min  s      hPa      gpm     deg C      %       C     C    C/km     m/sO3 [mPa] and Tb [C]',  # noqa
+        VAISALA_COLUMNS + [('O3PartialPressure', 74, 80)])
+], rules=[
+    ('Started at', 'date', lambda line: line.split('    ')[1].strip()),
+    ('Location', 'location',
+     lambda line: line[line.index(':') + 1:].strip()),
+    ('Special sensor serial number', 'instrument',
+     lambda line: line.split(':')[1].strip()),
+    ('Integrated Ozone', 'IntO3', lambda line: line.split(':')[1].strip()),
+    ('Residual Ozone', 'ResO3', lambda line: line.split(':')[1].strip())
+])
+
+
+def _bas_sent_date(line):
+    """
+    :param line: BAS 'Sent:' e-mail header line
+    :returns: date sent, as YYYY-MM-DD
+    """
+
+    number = line.index(":")
+    number2 = line.find(":", number + 1)
+    time = line[number + 1:number2 - 1].strip()
+    time = time.replace(",", "")
+    date_map = {'January': '01', 'February': '02', 'March': '03',
+                'April': '04', 'May': '05', 'June': '06',
+                'July': '07', 'August': '08', 'September': '09',
+                'October': '10', 'November': '11',
+                'December': '12'}
+    for item in date_map:
+        if item in time:
+            time = time.replace(item, date_map[item])
+            break
+    date_temp = time.split(' ')
+    return '%s-%s-%s' % (date_temp[2], date_temp[0], date_temp[1])
+
+
+# BAS daily data, e-mailed; blank lines end the data
+BAS_FORMAT = util.FixedWidthFormat([
+    util.FixedWidthVariant(
+        'daily',
+        ' MM DD  JJJJJ   XXX    SD   N   MU   HOUR  SPAN',
+        [('MM', 0, 4), ('DD', 4, 7), ('JJJJJ', 7, 14), ('XXX', 14, 20),
+         ('SD', 20, 26), ('N', 26, 30), ('MU', 30, 36), ('HOUR', 36, 42),
+         ('SPAN', 42, 48)])
+], rules=[
+    ('Halley', 'station', lambda line: 'Halley'),
+    ('Vernadsky', 'station', lambda line: 'Vernadsky'),
+    ('Sent', 'time', _bas_sent_date)
+], exclusive=False, blank_rows=True)
+
+# elementwise test for text values in object arrays
+_IS_TEXT = np.frompyfunc(lambda value: type(value) is str, 1, 1)
+
+# PROFILE table fields, in order
+PROFILE_FIELDS = (
+    'Pressure',
+    'O3PartialPressure',
+    'Temperature',
+    'WindSpeed',
+    'WindDirection',
+    'LevelCode',
+    'Duration',
+    'GPHeight',
+    'RelativeHumidity',
+    'SampleTemperature'
+)
+
+# decimal parts '.000' to '.999'
+_THOUSANDTHS = np.array(['.%03d' % value for value in range(1000)])
+
+
+def _format_decimals(values, decimals=3):
+    """
+    Formats floats as format(value, '.3f') would (or with other
+    decimals), with integer arithmetic for values whose rounding is
+    unambiguous
+
+    :param values: float64 array
+    :param decimals: number of decimals (default 3)
+    :returns: tuple of (text array, rounded values as floats)
+    """
+
+    if decimals > 9:
+        text = np.char.mod('%%.%df' % decimals, values)
+        return text, text.astype(np.float64)
+    scale = 10 ** decimals
+    with np.errstate(over='ignore', invalid='ignore'):
+        scaled = values * scale
+        units = np.rint(scaled)
+        exact = (np.abs(scaled - units) < 0.4) & (np.abs(scaled) < 1e12)
+    digits = np.where(exact, np.abs(units), 0).astype(np.int64)
+    text = (digits // scale).astype(str)
+    if decimals == 3:
+        text = np.char.add(text, _THOUSANDTHS[digits % 1000])
+    elif decimals > 0:
+        fractions = np.char.zfill((digits % scale).astype(str), decimals)
+        text = np.char.add(text, np.char.add('.', fractions))
+    negative = np.signbit(values)
+    text = np.where(negative, np.char.add('-', text), text)
+    rounded = np.where(negative, -1.0, 1.0) * (digits / scale)
+    if not exact.all():
+        inexact = np.flatnonzero(~exact)
+        others = np.char.mod('%%.%df' % decimals, values[inexact])
+        text = text.astype(np.result_type(text, others))
+        text[inexact] = others
+        rounded[inexact] = others.astype(np.float64)
+    return text, rounded
+
+
+class ProfileColumn(object):
+    """
+    One column of a PROFILE table
+
+    Values are kept as float64 with a mask of missing values and the
+    number of decimals each value is written with (-1 writes the value
+    as str(float) does).  Text that does not read back the same from
+    numbers is kept as text.
+    """
+
+    def __init__(self, values, missing=None, decimals=-1, text=None):
+        """
+        Initialize a PROFILE column
+
+        :param values: column values (floats)
+        :param missing: mask of missing values (default none missing)
+        :param decimals: decimals of each value or of all values
+                         (default -1, str(float))
+        :param text: column text, written instead of the values
+        """
+
+        self.values = np.asarray(values, dtype=np.float64)
+        if missing is None:
+            missing = np.zeros(self.values.shape, dtype=bool)
+        self.missing = np.asarray(missing, dtype=bool)
+        self.decimals = np.broadcast_to(np.asarray(decimals, dtype=np.int8),
+                                        self.values.shape)
+        self.text = text
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def blank(cls, size):
+        """
+        Creates a column of missing values
+
+        :param size: number of values
+        :returns: `ProfileColumn` object
+        """
+
+        return cls(np.full(size, np.nan), np.ones(size, dtype=bool))
+
+    @classmethod
+    def from_numbers(cls, values):
+        """
+        Creates a column of numbers written as str() writes them
+
+        :param values: list or array of ints or floats
+        :returns: `ProfileColumn` object
+        """
+
+        values = np.asarray(values)
+        if values.dtype.kind == 'f':
+            return cls(values)
+        if values.dtype.kind in 'iu' and \
+                (np.abs(values) <= 2 ** 53).all():
+            return cls(values, decimals=0)
+        return cls.from_text([str(value) for value in values])
+
+    @classmethod
+    def from_text(cls, texts):
+        """
+        Creates a column from text values, '' being missing
+
+        :param texts: list of text values
+        :returns: `ProfileColumn` object
+        """
+
+        text = np.array(texts, dtype=str).reshape(-1)
+        missing = text == ''
+        try:
+            values = np.where(missing, '0', text).astype(np.float64)
+        except ValueError:
+            return cls(np.full(len(text), np.nan), missing, text=text)
+        point = np.char.find(text, '.')
+        decimals = np.where(point < 0, 0, np.char.str_len(text) - point - 1)
+        if len(text) and decimals.max() > 127:
+            return cls(np.full(len(text), np.nan), missing, text=text)
+        values[missing] = np.nan
+        column = cls(values, missing, decimals)
+        if not np.array_equal(column.format(), text):
+            return cls(np.full(len(text), np.nan), missing, text=text)
+        return column
+
+    def subset(self, start=0, stop=None):
+        """
+        :param start: first value (default 0)
+        :param stop: value to stop before (default end of column)
+        :returns: `ProfileColumn` viewing the values from start to stop
+        """
+
+        index = slice(start, stop)
+        text = None
+        if self.text is not None:
+            text = self.text[index]
+        return ProfileColumn(self.values[index], self.missing[index],
+                             self.decimals[index], text)
+
+    def format(self, index=slice(None)):
+        """
+        Writes column values as text
+
+        :param index: slice of values to write (default all)
+        :returns: array of text values, '' for missing values
+        """
+
+        if self.text is not None:
+            return self.text[index]
+        values = self.values[index]
+        missing = self.missing[index]
+        decimals = self.decimals[index]
+
+        parts = []
+        for places in np.unique(decimals[~missing]):
+            selected = (decimals == places) & ~missing
+            if places < 0:
+                part = values[selected].astype(str)
+            else:
+                part = _format_decimals(values[selected], int(places))[0]
+            parts.append((selected, part))
+
+        text = np.zeros(values.shape, dtype=np.result_type(
+            'U1', *[part for selected, part in parts]))
+        for selected, part in parts:
+            text[selected] = part
+        return text
+
+    @property
+    def nbytes(self):
+        """
+        :returns: bytes held by the column arrays
+        """
+
+        nbytes = self.values.nbytes + self.missing.nbytes
+        if self.text is not None:
+            nbytes += self.text.nbytes
+        if self.decimals.strides[0]:
+            return nbytes + self.decimals.nbytes
+        return nbytes + self.decimals.itemsize
+
+
+class ProfileTable(object):
+    """
+    PROFILE payload of a converted flight, held column by column and
+    written as text only when rows are read
+    """
+
+    # rows written to text at a time by rows()
+    CHUNK_SIZE = 4096
+
+    def __init__(self, columns=None, fields=PROFILE_FIELDS):
+        """
+        Initialize a PROFILE table
+
+        :param columns: list of `ProfileColumn` objects, one per field
+                        (default empty columns)
+        :param fields: field names (default PROFILE_FIELDS)
+        """
+
+        self.fields = tuple(fields)
+        if columns is None:
+            columns = [ProfileColumn.blank(0) for field in self.fields]
+        if len(columns) != len(self.fields):
+            raise ValueError('%d columns for %d fields' %
+                             (len(columns), len(self.fields)))
+        if len(set(len(column) for column in columns)) > 1:
+            raise ValueError('Columns of unequal length')
+        self.columns = list(columns)
+
+    @classmethod
+    def from_rows(cls, rows, fields=PROFILE_FIELDS):
+        """
+        Creates a table from rows of text values
+
+        :param rows: list of rows (lists of text values)
+        :param fields: field names (default PROFILE_FIELDS)
+        :returns: `ProfileTable` object
+        """
+
+        rows = list(rows)
+        for row in rows:
+            if len(row) != len(fields):
+                raise ValueError('%d values for %d fields' %
+                                 (len(row), len(fields)))
+        return cls([ProfileColumn.from_text([row[index] for row in rows])
+                    for index in range(len(fields))], fields)
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __getitem__(self, index):
+        index = range(len(self))[index]
+        return [column.format(slice(index, index + 1))[0].item()
+                for column in self.columns]
+
+    def __iter__(self):
+        return self.rows()
+
+    def rows(self, start=0, stop=None):
+        """
+        Writes table rows as text
+
+        :param start: first row (default 0)
+        :param stop: row to stop before (default end of table)
+        :returns: generator of rows (lists of text values)
+        """
+
+        start, stop, step = slice(start, stop).indices(len(self))
+        for first in range(start, stop, self.CHUNK_SIZE):
+            last = min(first + self.CHUNK_SIZE, stop)
+            for row in zip(*self.text_columns(first, last)):
+                yield list(row)
+
+    def subset(self, start=0, stop=None):
+        """
+        :param start: first row (default 0)
+        :param stop: row to stop before (default end of table)
+        :returns: `ProfileTable` viewing the rows from start to stop
+        """
+
+        return ProfileTable([column.subset(start, stop)
+                             for column in self.columns], self.fields)
+
+    def text_columns(self, start=0, stop=None):
+        """
+        Writes table columns as text
+
+        :param start: first row (default 0)
+        :param stop: row to stop before (default end of table)
+        :returns: list of columns (lists of text values), one per field
+        """
+
+        return [column.format(slice(start, stop)).tolist()
+                for column in self.columns]
+
+    @property
+    def nbytes(self):
+        """
+        :returns: bytes held by the table columns
+        """
+
+        return sum(column.nbytes for column in self.columns)
+
 
 class converter(object):
     __metaclass__ = ABCMeta
@@ -76,7 +462,7 @@ class shadoz_converter(converter):
         """
         Create instance variables.
         """
-        self.data_truple = []
+        self.data_truple = ProfileTable()
         self.station_info = {}
         self.ori = []
         self.inv = []
@@ -89,7 +475,6 @@ class shadoz_converter(converter):
         Processing of data, collecting required information for WOUDC EXT-CSV.
         """
 
-        client = WoudcClient()
         LOGGER.info('Parsing file, collecting data from file.')
         bad_value = ''
         s = SHADOZ(file_content)
@@ -104,68 +489,7 @@ class shadoz_converter(converter):
         bad_value = str(s.metadata['Missing or bad values'])
 
         # get payload data
-        counter = 0
-        for row in s.get_data():
-            star_flag = False
-            if any(['*' in str(x) for x in row]):
-                star_flag = True
-            Press = row[s.get_data_index('Press')]
-            if (type(Press) is str and '*' in Press) or str(int(round(float(Press)))) == bad_value: # noqa
-                Press = ''
-            else:
-                Press = format(Press, '.3f')
-            O3PP = row[s.get_data_index('O3', 'mPa')]
-            if (type(O3PP) is str and '*' in O3PP) or str(int(round(float(O3PP)))) == bad_value: # noqa
-                O3PP = ''
-            else:
-                O3PP = format(O3PP, '.3f')
-            Temp = row[s.get_data_index('Temp')]
-            if (type(Temp) is str and '*' in Temp) or str(int(round(float(Temp)))) == bad_value: # noqa
-                Temp = ''
-            else:
-                Temp = format(Temp, '.3f')
-            WSPD = row[s.get_data_index('W Spd', 'm/s')]
-            if (type(WSPD) is str and '*' in WSPD) or str(int(round(float(WSPD)))) == bad_value: # noqa
-                WSPD = ''
-            else:
-                WSPD = format(WSPD, '.3f')
-            WDIR = row[s.get_data_index('W Dir')]
-            if (type(WDIR) is str and '*' in WDIR) or str(int(round(float(WDIR)))) == bad_value: # noqa
-                WDIR = ''
-            else:
-                WDIR = format(WDIR, '.3f')
-            Duration = str(row[s.get_data_index('Time', 'sec')])
-            if '*' in Duration or str(int(round(float(Duration)))) == bad_value: # noqa
-                Duration = ''
-            GPHeight = row[s.get_data_index('Alt', 'km')]
-            if (type(GPHeight) is str and '*' in GPHeight) or str(int(round(float(GPHeight)))) == bad_value: # noqa
-                GPHeight = ''
-            else:
-                GPHeight = str(float(format(GPHeight, '.3f')) * 1000)
-            RelativeHumidity = row[s.get_data_index('RH', '%')]
-            if (type(RelativeHumidity) is str and '*' in RelativeHumidity) or str(int(round(float(RelativeHumidity)))) == bad_value: # noqa
-                RelativeHumidity = ''
-            else:
-                RelativeHumidity = format(RelativeHumidity, '.3f')
-            SampleTemperature = row[s.get_data_index('T Pump')]
-            if (type(SampleTemperature) is str and '*' in SampleTemperature) or str(int(round(float(SampleTemperature)))) == bad_value: # noqa
-                SampleTemperature = ''
-            else:
-                SampleTemperature = format(SampleTemperature, '.3f')
-
-            if star_flag:
-                self.data_truple.insert(counter, [Press, O3PP, Temp, WSPD,
-                                                  WDIR, '',
-                                                  Duration, GPHeight,
-                                                  RelativeHumidity,
-                                                  SampleTemperature])
-            else:
-                self.data_truple.insert(counter, [Press, O3PP, Temp, WSPD,
-                                                  WDIR, '',
-                                                  Duration, GPHeight,
-                                                  RelativeHumidity,
-                                                  SampleTemperature])
-                counter += 1
+        self.data_truple = self.profile_table(s, bad_value)
 
         LOGGER.info('Parsing metadata information from file, resource.cfg, and pywoudc.')  # noqa
         # Getting Information from Config file for CONTENT table
@@ -314,7 +638,7 @@ class shadoz_converter(converter):
 
         try:
             LOGGER.info('Getting station metadata by pywoudc.')
-            station_metadata = client.get_station_metadata()
+            registry = util.get_station_registry()
         except Exception as err:
             msg = 'Unable to get metadata from pywoudc due to: %s' % str(err)
             LOGGER.error(msg)
@@ -334,30 +658,19 @@ class shadoz_converter(converter):
             if item in metadata_dic.keys():
                 temp_dict[item] = metadata_dic[item]
 
-        try:
-            station_ltn = station.encode('latin1').decode('utf-8')
-        except UnicodeError as err:
-            station_ltn = ''
-            msg = 'Failed to decode station as Latin1: treating as UTF-8.'
-            LOGGER.warning(err)
-            LOGGER.info(msg)
-
         try:
             LOGGER.info('Processing station metadata information.')
-            for row in station_metadata['features']:
-                properties = row['properties']
-                if all([properties['platform_name'] in [station, station_ltn],
-                        Agency == properties['acronym']]):
-                    # Match station record in WOUDC database
-                    LOGGER.info('Station found in Woudc_System, starting processing platform information.')  # noqa
-                    for ind in range(len(header_list)):
-                        item = header_list[ind]
-                        # Insert data into dictionary only when this
-                        # field is empty
-                        if temp_dict[item] == '':
-                            temp_dict[item] = properties[pywoudc_header_list[ind]]  # noqa
-                            LOGGER.info('Received %s value %s from Woudc_System.' % (item, properties[pywoudc_header_list[ind]])) # noqa
-                    break
+            properties = registry.find(station, Agency)
+            if properties is not None:
+                # Match station record in WOUDC database
+                LOGGER.info('Station found in Woudc_System, starting processing platform information.')  # noqa
+                for ind in range(len(header_list)):
+                    item = header_list[ind]
+                    # Insert data into dictionary only when this
+                    # field is empty
+                    if temp_dict[item] == '':
+                        temp_dict[item] = properties[pywoudc_header_list[ind]]  # noqa
+                        LOGGER.info('Received %s value %s from Woudc_System.' % (item, properties[pywoudc_header_list[ind]])) # noqa
             self.station_info['Platform'] = []
 
             for item in header_list:
@@ -416,8 +729,171 @@ class shadoz_converter(converter):
 
         return True, 'Parsing Done.'
 
-    def creater(self, filename):
+    def profile_table(self, s, bad_value):
+        """
+        Converts the SHADOZ data block into a PROFILE table as
+        whole-column array operations
+
+        Column indices are resolved once.  Missing ('*') and bad values
+        are masked, GPHeight is scaled from km to m and values are
+        written with three decimals.  Rows holding a '*' anywhere follow
+        the other rows, last first.  Data with other text values are
+        left to profile_rows_by_row.
+
+        :param s: SHADOZ object
+        :param bad_value: SHADOZ missing or bad value (text)
+        :returns: `ProfileTable` object
+        """
+
+        data = s.get_data()
+        if not data:
+            return ProfileTable()
+        try:
+            indices = [s.get_data_index(field, unit)
+                       for field, unit in SHADOZ_PROFILE_FIELDS]
+        except IndexError:
+            indices = [None]
+        if None in indices:
+            return ProfileTable.from_rows(
+                self.profile_rows_by_row(s, bad_value))
+
+        try:
+            table = np.array(data)
+        except (ValueError, OverflowError):
+            return ProfileTable.from_rows(
+                self.profile_rows_by_row(s, bad_value))
+        if table.ndim == 2 and table.dtype.kind in 'fi':
+            numbers = table.astype(np.float64)
+            stars = np.zeros(numbers.shape, dtype=bool)
+        else:
+            table = np.array(data, dtype=object)
+            if table.ndim != 2:
+                return ProfileTable.from_rows(
+                    self.profile_rows_by_row(s, bad_value))
+            text = _IS_TEXT(table).astype(bool)
+            stars = np.zeros(table.shape, dtype=bool)
+            stars[text] = np.char.find(table[text].astype(str), '*') >= 0
+            if (text & ~stars)[:, indices].any():
+                return ProfileTable.from_rows(
+                    self.profile_rows_by_row(s, bad_value))
+            numbers = np.where(text, 0, table).astype(np.float64)
+        if not np.isfinite(numbers[:, indices]).all():
+            return ProfileTable.from_rows(
+                self.profile_rows_by_row(s, bad_value))
+
+        bad_number = None
+        if re.match(r'^-?\d+$', bad_value) and \
+                str(int(bad_value)) == bad_value:
+            bad_number = int(bad_value)
+
+        star_rows = stars.any(axis=1)
+        order = np.concatenate([np.flatnonzero(~star_rows),
+                                np.flatnonzero(star_rows)[::-1]])
+
+        columns = []
+        for (field, unit), index in zip(SHADOZ_PROFILE_FIELDS, indices):
+            values = numbers[order, index]
+            missing = stars[order, index]
+            if bad_number is not None:
+                missing |= np.rint(values) == bad_number
+            if field == 'Time':
+                columns.append(ProfileColumn.from_text(
+                    np.where(missing, '',
+                             [str(data[row][index]) for row in order])))
+            elif field == 'Alt':
+                rounded = _format_decimals(values)[1]
+                columns.append(ProfileColumn(rounded * 1000, missing))
+            else:
+                columns.append(ProfileColumn(values, missing, 3))
+        columns.insert(5, ProfileColumn.blank(len(data)))
+        return ProfileTable(columns)
+
+    def profile_rows_by_row(self, s, bad_value):
+        """
+        Converts the SHADOZ data block into PROFILE rows one row at a time
+
+        :param s: SHADOZ object
+        :param bad_value: SHADOZ missing or bad value (text)
+        :returns: list of PROFILE rows (lists of text values)
         """
+
+        rows = []
+        counter = 0
+        for row in s.get_data():
+            star_flag = False
+            if any(['*' in str(x) for x in row]):
+                star_flag = True
+            Press = row[s.get_data_index('Press')]
+            if (type(Press) is str and '*' in Press) or str(int(round(float(Press)))) == bad_value: # noqa
+                Press = ''
+            else:
+                Press = format(Press, '.3f')
+            O3PP = row[s.get_data_index('O3', 'mPa')]
+            if (type(O3PP) is str and '*' in O3PP) or str(int(round(float(O3PP)))) == bad_value: # noqa
+                O3PP = ''
+            else:
+                O3PP = format(O3PP, '.3f')
+            Temp = row[s.get_data_index('Temp')]
+            if (type(Temp) is str and '*' in Temp) or str(int(round(float(Temp)))) == bad_value: # noqa
+                Temp = ''
+            else:
+                Temp = format(Temp, '.3f')
+            WSPD = row[s.get_data_index('W Spd', 'm/s')]
+            if (type(WSPD) is str and '*' in WSPD) or str(int(round(float(WSPD)))) == bad_value: # noqa
+                WSPD = ''
+            else:
+                WSPD = format(WSPD, '.3f')
+            WDIR = row[s.get_data_index('W Dir')]
+            if (type(WDIR) is str and '*' in WDIR) or str(int(round(float(WDIR)))) == bad_value: # noqa
+                WDIR = ''
+            else:
+                WDIR = format(WDIR, '.3f')
+            Duration = str(row[s.get_data_index('Time', 'sec')])
+            if '*' in Duration or str(int(round(float(Duration)))) == bad_value: # noqa
+                Duration = ''
+            GPHeight = row[s.get_data_index('Alt', 'km')]
+            if (type(GPHeight) is str and '*' in GPHeight) or str(int(round(float(GPHeight)))) == bad_value: # noqa
+                GPHeight = ''
+            else:
+                GPHeight = str(float(format(GPHeight, '.3f')) * 1000)
+            RelativeHumidity = row[s.get_data_index('RH', '%')]
+            if (type(RelativeHumidity) is str and '*' in RelativeHumidity) or str(int(round(float(RelativeHumidity)))) == bad_value: # noqa
+                RelativeHumidity = ''
+            else:
+                RelativeHumidity = format(RelativeHumidity, '.3f')
+            SampleTemperature = row[s.get_data_index('T Pump')]
+            if (type(SampleTemperature) is str and '*' in SampleTemperature) or str(int(round(float(SampleTemperature)))) == bad_value: # noqa
+                SampleTemperature = ''
+            else:
+                SampleTemperature = format(SampleTemperature, '.3f')
+
+            if star_flag:
+                rows.insert(counter, [Press, O3PP, Temp, WSPD,
+                                      WDIR, '',
+                                      Duration, GPHeight,
+                                      RelativeHumidity,
+                                      SampleTemperature])
+            else:
+                rows.insert(counter, [Press, O3PP, Temp, WSPD,
+                                      WDIR, '',
+                                      Duration, GPHeight,
+                                      RelativeHumidity,
+                                      SampleTemperature])
+                counter += 1
+
+        return rows
+
+    def payload_table(self):
+        """
+        :returns: `ProfileTable` of the PROFILE rows to write
+        """
+
+        return self.data_truple
+
+    def creater(self, filename, payload=True):
+        """
+        :param payload: add the payload rows (default True), or only
+                        the PROFILE fields
         :return ecsv: ext-csv object that is ready to be dumped out
 
         Creating ext-csv tables and insert table values
@@ -531,24 +1007,13 @@ class shadoz_converter(converter):
 
         LOGGER.info('Adding Profile Table(Payload).')
         try:
-            ecsv.add_data("PROFILE",
-                          ",".join(self.data_truple[0]),
-                          field="Pressure,O3PartialPressure,Temperature,"
-                          "WindSpeed,WindDirection,LevelCode,Duration,"
-                          "GPHeight,RelativeHumidity,SampleTemperature")
+            table = self.payload_table()
+            util.add_payload(ecsv, "PROFILE", table.fields,
+                             table.text_columns() if payload else None)
         except Exception as err:
             msg = 'Cannot add PROFILE table due to: %s ' % str(err)
             LOGGER.error(msg)
             return False, msg
-
-        first_flag = True
-        LOGGER.info('Insert payload value to Profile Table.')
-        for val in self.data_truple:
-            if first_flag:
-                first_flag = False
-            else:
-                ecsv.add_data("PROFILE",
-                              ",".join(val))
         return ecsv, 'Create EXT-CSV object Done.'
 
 
@@ -561,7 +1026,7 @@ class Vaisala_converter(converter):
         """
         Create instance variables.
         """
-        self.data_truple = []
+        self.data_truple = ProfileTable()
         self.station_info = {}
 
     def parser(self, file_content, station_name, agency_name, metadata_dic):
@@ -572,70 +1037,38 @@ class Vaisala_converter(converter):
         Processing of data, collecting required information for WOUDC EXT-CSV.
         """
 
-        metadata = {}
-        flag = 0
-        counter = 0
-
-        for line in file_content:
-            # Collecting information from Vaisala file
-            if line.strip() == '':
-                continue
-            elif 'Started at' in line:
-                metadata['date'] = line.split('    ')[1].strip()
-            elif 'Location' in line:
-                metadata['location'] = line[line.index(':') + 1:].strip()
-            elif 'Special sensor serial number' in line:
-                metadata['instrument'] = line.split(':')[1].strip()
-            elif 'Integrated Ozone' in line:
-                metadata['IntO3'] = line.split(':')[1].strip()
-            elif 'Residual Ozone' in line:
-                metadata['ResO3'] = line.split(':')[1].strip()
-            elif 'Time Pressure   Height  Temperature  RH    VirtT   DPD  LRate AscRate Ozone [mPa]' in line:  # noqa
-                header = [x.strip() for x in line.split(' ')]
-                header[len(header) - 2] = '%s%s' % (header[len(header) - 2], header[len(header) - 1])  # noqa
-                header.pop()
-            elif 'min  s      hPa      gpm     deg C      %       C     C    C/km     m/sOzone [mPa]' in line:  # noqa
-                flag = 1
-            elif 'min  s      hPa      gpm     deg C      %       C     C    C/km     m/sO3 [mPa] and Tb [C]' in line:  # noqa
-                flag = 2
-            elif flag == 1:
-                minutes = line[0:4].strip()
-                seconds = line[4:7].strip()
-                try:
-                    time = str(int(minutes) * 60 + int(seconds))
-                except Exception as err:
-                    msg = '''
-                    Cannot convert minutes + seconds to duration due to : %s,
-                    minutes: %s, second: %s
-                    ''' % (str(err), minutes, seconds)
-                    LOGGER.error(msg)
-                    return False, msg
-                cur_line = []
-                counter = counter + 1
-                # Pick and choose required information for payload
-                cur_line = [line[11:18].strip(), line[76:80].strip(),
-                            line[31:37].strip(), '', '', '', time,
-                            line[20:27].strip(), line[40:44].strip(), '']
-                self.data_truple.insert(counter, cur_line)
-            elif flag == 2:
-                minutes = line[0:4].strip()
-                seconds = line[4:7].strip()
+        # Collecting information and payload columns from Vaisala file
+        metadata, sections = VAISALA_FORMAT.read(file_content)
+        columns = VAISALA_FORMAT.extract(sections)
+        minutes = columns['minutes']
+        seconds = columns['seconds']
+        try:
+            time = minutes.astype(np.int64) * 60
+            time = (time + seconds.astype(np.int64)).astype(str)
+        except (ValueError, OverflowError):
+            time = []
+            for minute, second in zip(minutes.tolist(), seconds.tolist()):
                 try:
-                    time = str(int(minutes) * 60 + int(seconds))
+                    time.append(str(int(minute) * 60 + int(second)))
                 except Exception as err:
                     msg = '''
                     Cannot convert minutes + seconds to duration due to : %s,
                     minutes: %s, second: %s
-                    ''' % (str(err), minutes, seconds)
+                    ''' % (str(err), minute, second)
                     LOGGER.error(msg)
                     return False, msg
-                cur_line = []
-                counter = counter + 1
-                # Pick and choose required information for payload
-                cur_line = [line[11:18].strip(), line[74:80].strip(),
-                            line[31:37].strip(), '', '', '', time,
-                            line[20:27].strip(), line[40:44].strip(), '']
-                self.data_truple.insert(counter, cur_line)
+
+        # Pick and choose required information for payload
+        blank = ProfileColumn.blank(len(minutes))
+        self.data_truple = ProfileTable([
+            ProfileColumn.from_text(columns['Pressure']),
+            ProfileColumn.from_text(columns['O3PartialPressure']),
+            ProfileColumn.from_text(columns['Temperature']),
+            blank, blank, blank,
+            ProfileColumn.from_text(time),
+            ProfileColumn.from_text(columns['GPHeight']),
+            ProfileColumn.from_text(columns['RelativeHumidity']),
+            blank])
 
         LOGGER.info('Parsing metadata information from file, resource.cfg, and pywoudc.')  # noqa
         try:
@@ -801,8 +1234,18 @@ class Vaisala_converter(converter):
 
         return True, 'Parsing Done'
 
-    def creater(self, filename):
+    def payload_table(self):
+        """
+        :returns: `ProfileTable` of the PROFILE rows to write
+        """
+
+        # the last payload row is left out
+        return self.data_truple.subset(0, max(len(self.data_truple) - 1, 1))
+
+    def creater(self, filename, payload=True):
         """
+        :param payload: add the payload rows (default True), or only
+                        the PROFILE fields
         :return ecsv: ext-csv object that is ready to be dumped out
 
         Creating ext-csv tables and insert table values
@@ -897,23 +1340,13 @@ class Vaisala_converter(converter):
 
         try:
             LOGGER.info('Adding Profile Table(Payload).')
-            ecsv.add_data("PROFILE",
-                          ",".join(self.data_truple[0]),
-                          field="Pressure,O3PartialPressure,Temperature,"
-                          "WindSpeed,WindDirection,LevelCode,Duration,"
-                          "GPHeight,RelativeHumidity,SampleTemperature")
+            table = self.payload_table()
+            util.add_payload(ecsv, "PROFILE", table.fields,
+                             table.text_columns() if payload else None)
         except Exception as err:
             msg = 'Unable to add Profile table due to : %s' % str(err)
             LOGGER.error(msg)
             return False, msg
-
-        x = 1
-        LOGGER.info('Insert payload value to Profile Table.')
-        while x < len(self.data_truple) - 1:
-
-            ecsv.add_data("PROFILE",
-                          ",".join(self.data_truple[x]))
-            x = x + 1
         return ecsv, 'Create EXT-CSV object Done.'
 
 
@@ -932,51 +1365,13 @@ class BAS_converter(converter):
 
         Processing of data, collecting required information for WOUDC EXT-CSV.
         """
-        flag = 0
-        counter = 0
         # Collecting data from BAS file
-        for line in file_content:
-            if line == "":
-                continue
-            if "Halley" in line:
-                station = "Halley"
-
-            if "Vernadsky" in line:
-                station = "Vernadsky"
-
-            if "Sent" in line:
-                number = line.index(":")
-                number2 = line.find(":", number + 1)
-                time = line[number + 1:number2 - 1].strip()
-                time = time.replace(",", "")
-                date_map = {'January': '01', 'February': '02', 'March': '03',
-                            'April': '04', 'May': '05', 'June': '06',
-                            'July': '07', 'August': '08', 'September': '09',
-                            'October': '10', 'November': '11',
-                            'December': '12'}
-                for item in date_map:
-                    if item in time:
-                        time = time.replace(item, date_map[item])
-                        break
-                date_temp = time.split(' ')
-                time = '%s-%s-%s' % (date_temp[2], date_temp[0], date_temp[1])
-
-            if " MM DD  JJJJJ   XXX    SD   N   MU   HOUR  SPAN" in line:
-                flag = 1
-                continue
-
-            # Collecting payload data
-            if flag == 1:
-                self.data_truple.insert(counter, [line[:4].strip(),
-                                                  line[4:7].strip(),
-                                                  line[7:14].strip(),
-                                                  line[14:20].strip(),
-                                                  line[20:26].strip(),
-                                                  line[26:30].strip(),
-                                                  line[30:36].strip(),
-                                                  line[36:42].strip(),
-                                                  line[42:48].strip()])
-                counter = counter + 1
+        metadata, sections = BAS_FORMAT.read(file_content)
+        columns = BAS_FORMAT.extract(sections)
+        station = metadata.get('station')
+        time = metadata.get('time')
+        self.data_truple = [list(row) for row in zip(
+            *[columns[field].tolist() for field in BAS_FORMAT.fields])]
 
         self.station_info["Content"] = ["WOUDC", "TotalOzone", "1.0", "1"]
 
@@ -1041,25 +1436,36 @@ class BAS_converter(converter):
 
         return True, 'Parsing Done'
 
-    def creater(self):
+    def payload_table(self):
         """
+        :returns: `ProfileTable` of the daily rows to write
+        """
+
+        fields = ['Date', 'WLCode', 'ObsCode', 'ColumnO3', 'StdDevO3',
+                  'UTC_Begin', 'UTC_End', 'UTC_Mean', 'nOBs', 'mMu',
+                  'ColumnSO2']
+        dataoutput = []
+        for item in self.data_truple:
+
+            if item == ['', '', '', '', '', '', '', '', '']:
+                break
+            hour = float(item[7])
+            span = float(item[8])
+
+            dataoutput.append([item[1] + "/" + item[0] + "/" + str(round(float(item[2]) / 365.25 + 1900)), "", "", item[3], item[4], str(round(hour + 12, 2)), str(round(round(hour + 12, 2) + span / 60, 2)),  "", item[5], item[6], ""])  # noqa
+        return ProfileTable.from_rows(dataoutput, fields)
+
+    def creater(self, payload=True):
+        """
+        :param payload: add the payload rows (default True), or only
+                        the PROFILE fields
         :return ecsv: ext-csv object that is ready to be dumped out
 
         Creating ext-csv tables and insert table values
         """
-        counter = 0
-        dataoutput = []
 
         try:
-            for item in self.data_truple:
-
-                if item == ['', '', '', '', '', '', '', '', '']:
-                    break
-                hour = float(item[7])
-                span = float(item[8])
-
-                dataoutput.insert(counter, [item[1] + "/" + item[0] + "/" + str(round(float(item[2]) / 365.25 + 1900)), "", "", item[3], item[4], str(round(hour + 12, 2)), str(round(round(hour + 12, 2) + span / 60, 2)),  "", item[5], item[6], ""])  # noqa
-                counter = counter + 1
+            table = self.payload_table()
         except Exception as err:
             msg = 'Unable to process data payload due to : %s' % str(err)
             LOGGER.error(msg)
@@ -1113,19 +1519,13 @@ class BAS_converter(converter):
             return False, msg
 
         try:
-            ecsv.add_data("PROFILE", ",".join(dataoutput[0]),
-                          field="Date,WLCode,ObsCode,ColumnO3,StdDevO3,UTC_Begin,UTC_End,UTC_Mean,nOBs,mMu,ColumnSO2")  # noqa
-            x = 1
+            util.add_payload(ecsv, "PROFILE", table.fields,
+                             table.text_columns() if payload else None)
         except Exception as err:
             msg = 'Unable to add Profile table due to : %s' % str(err)
             LOGGER.error(msg)
             return False, msg
 
-        while x < len(dataoutput):
-
-            ecsv.add_data("PROFILE", ",".join(dataoutput[x]))
-            x = x + 1
-
         return ecsv, 'Create EXT-CSV object Done.'
 
 
@@ -1138,7 +1538,7 @@ class AMES_2160_converter(converter):
         """
         Create instance variables.
         """
-        self.data_truple = []
+        self.data_truple = ProfileTable()
         self.station_info = {}
         self.mname = ''
 
@@ -1154,8 +1554,6 @@ class AMES_2160_converter(converter):
             LOGGER.error(msg)
             return False, msg
 
-        client = WoudcClient()
-
         LOGGER.info('Parsing AMES-2160 file.')
 
         LOGGER.info('Determining AMES format.')
@@ -1220,27 +1618,23 @@ class AMES_2160_converter(converter):
                 pump_rate = str(f.A[f.ANAME.index('Inverse pump flow rate (s/100 ml)')][0]) # noqa
                 correction_factor = str(f.A[f.ANAME.index('Correction factor (COL2/COL1) (negative: not applied; positive: applied)')][0]) # noqa
 
-                Pressure_list = [str(x) for x in f.V[0][0]]
-                Duration_list = [str(x) for x in f.X[0][1]]
+                Pressure_list = f.V[0][0]
+                Duration_list = f.X[0][1]
                 SampleTemperature_list = f.V[10][0]
-                O3PP_list = [str(x) for x in f.V[4][0]]
-                WindDir_list = [str(x) for x in f.V[5][0]]
-                WindSpd_list = [str(x) for x in f.V[6][0]]
+                O3PP_list = f.V[4][0]
+                WindDir_list = f.V[5][0]
+                WindSpd_list = f.V[6][0]
 
                 Temperature_list = f.V[2][0]
 
                 # Check if temperature is in Kelvin
                 LOGGER.info('Checking temperature units.')
                 if units[temp_index] == 'K':
-                    Temperature_list = [str(x - 273.15) for x in Temperature_list] # noqa
-                else:
-                    Temperature_list = [str(x) for x in Temperature_list]
+                    Temperature_list = np.asarray(Temperature_list) - 273.15 # noqa
 
                 temp_index = headers.index('IntT')
                 if units[temp_index] == 'K':
-                    SampleTemperature_list = [str(x - 273.15) for x in SampleTemperature_list] # noqa
-                else:
-                    SampleTemperature_list = [str(x) for x in SampleTemperature_list] # noqa
+                    SampleTemperature_list = np.asarray(SampleTemperature_list) - 273.15 # noqa
             except Exception as err:
                 msg = 'Unable to gather data values due to : %s' % str(err)
                 LOGGER.error(msg)
@@ -1280,12 +1674,12 @@ class AMES_2160_converter(converter):
                 pump_rate = ''
                 correction_factor = str(f.A[f.ANAME.index('Correction factor (COL2A/COL1 or COL2B/COL1) (NOT APPLIED TO DATA)')][0]) # noqa
 
-                Pressure_list = [str(x) for x in f.X[0][1]]
-                Duration_list = [str(x) for x in f.V[0][0]]
+                Pressure_list = f.X[0][1]
+                Duration_list = f.V[0][0]
                 SampleTemperature_list = f.V[4][0]
-                O3PP_list = [str(x) for x in f.V[5][0]]
-                WindDir_list = [str(x) for x in f.V[6][0]]
-                WindSpd_list = [str(x) for x in f.V[7][0]]
+                O3PP_list = f.V[5][0]
+                WindDir_list = f.V[6][0]
+                WindSpd_list = f.V[7][0]
 
                 Temperature_list = f.V[2][0]
 
@@ -1296,14 +1690,10 @@ class AMES_2160_converter(converter):
                     if vals[0] == 'Temperature':
                         if len(vals) == 2:
                             if vals[-1].strip('()') == 'K':
-                                Temperature_list = [str(x - 273.15) for x in Temperature_list] # noqa
-                            else:
-                                Temperature_list = [str(x) for x in Temperature_list] # noqa
+                                Temperature_list = np.asarray(Temperature_list) - 273.15 # noqa
                         elif len(vals) == 5:
                             if vals[-1].strip('()') == 'K':
-                                SampleTemperature_list = [str(x - 273.15) for x in SampleTemperature_list] # noqa
-                            else:
-                                SampleTemperature_list = [str(x) for x in SampleTemperature_list] # noqa
+                                SampleTemperature_list = np.asarray(SampleTemperature_list) - 273.15 # noqa
             except Exception as err:
                 msg = 'Unable to gather data values due to : %s' % str(err)
                 LOGGER.error(msg)
@@ -1318,8 +1708,8 @@ class AMES_2160_converter(converter):
                                       '%02d' % f.getFileDates()[0][1],
                                       '%02d' % f.getFileDates()[0][2])
 
-        GPHeight_list = [str(x) for x in f.V[1][0]]
-        RelativeHumidity_list = [str(x) for x in f.V[3][0]]
+        GPHeight_list = f.V[1][0]
+        RelativeHumidity_list = f.V[3][0]
 
         LOGGER.info('Retrieving instrument information.')
         try:
@@ -1343,12 +1733,16 @@ class AMES_2160_converter(converter):
             LOGGER.warning(msg)
             inst_model = inst_number = 'UNKNOWN'
 
-        # Zip all data lists together
-        master_list = zip(Pressure_list, O3PP_list, Temperature_list,
-                          WindSpd_list, WindDir_list,
-                          [''] * len(Pressure_list), Duration_list,
-                          GPHeight_list, RelativeHumidity_list,
-                          SampleTemperature_list)
+        # Collect all data lists as PROFILE columns, cut to the shortest
+        columns = [Pressure_list, O3PP_list, Temperature_list,
+                   WindSpd_list, WindDir_list, None, Duration_list,
+                   GPHeight_list, RelativeHumidity_list,
+                   SampleTemperature_list]
+        size = min(len(values) for values in columns if values is not None)
+        profile = ProfileTable([
+            ProfileColumn.blank(size) if values is None
+            else ProfileColumn.from_numbers(values[:size])
+            for values in columns])
 
         try:
             LOGGER.info('Getting content table information from resource.cfg')
@@ -1363,7 +1757,7 @@ class AMES_2160_converter(converter):
 
         try:
             LOGGER.info('Getting station metadata from pywoudc.')
-            station_metadata = client.get_station_metadata(raw=False)
+            registry = util.get_station_registry()
         except Exception as err:
             msg = 'Unable to get station metadata from pywoudc due to: %s' % str(err)  # noqa
             LOGGER.error(msg)
@@ -1373,20 +1767,9 @@ class AMES_2160_converter(converter):
             # processing station metadata from pywoudc, there might be
             # multiple record found for one station under different agency.
             # Therefore, Agency is required to process station metadata
-            # Any variable or code relate to geometry is used to access
-            # Geometry information returned by pywoudc, not used anymore,
-            # but can be un-commentted to make it work
-            properties_list = []
-            # geometry_list = []
-            counter = 0
             LOGGER.info('Parsing station metadata.')
-            for row in station_metadata['features']:
-                properties = row['properties']
-                # geometry = row['geometry']['coordinates']
-                if platform_name.lower() == properties['platform_name'].lower(): # noqa
-                    properties_list.append(properties)
-                    # geometry_list.append(geometry)
-                    counter = counter + 1
+            properties_list = registry.find_all(platform_name)
+            counter = len(properties_list)
             if counter == 0:
                 LOGGER.warning('Unable to find station: %s, start lookup process.' % platform_name)  # noqa
                 try:
@@ -1403,19 +1786,14 @@ class AMES_2160_converter(converter):
                 Type = properties_list[0]['platform_type']
                 Country = properties_list[0]['country_code']
                 GAW = properties_list[0]['gaw_id']
-                # Lat = str(geometry_list[0][1])
-                # Long = str(geometry_list[0][0])
             else:
-                length = 0
-                for item in properties_list:
-                    if item['acronym'].lower() == agency_name.lower() or item['contributor_name'].lower() == agency_name.lower():  # noqa
-                        ID = item['platform_id']
-                        Type = item['platform_type']
-                        Country = item['country_code']
-                        GAW = item['gaw_id']
-                        # Lat = str(geometry_list[length][1])
-                        # Long = str(geometry_list[length][0])
-                    length = length + 1
+                item = registry.find_by_agency(platform_name, agency_name)
+                if item is None:
+                    raise ValueError('no record of %s under agency %s' % (platform_name, agency_name))  # noqa
+                ID = item['platform_id']
+                Type = item['platform_type']
+                Country = item['country_code']
+                GAW = item['gaw_id']
 
             self.station_info['Platform'] = [Type, ID, platform_name,
                                              Country, GAW]
@@ -1475,13 +1853,21 @@ class AMES_2160_converter(converter):
             LOGGER.error(msg)
             return False, msg
 
-        for sub_list in master_list:
-            self.data_truple.append(sub_list)
+        self.data_truple = profile
 
         return True, 'Parsing Done'
 
-    def creater(self, filename):
+    def payload_table(self):
+        """
+        :returns: `ProfileTable` of the PROFILE rows to write
+        """
+
+        return self.data_truple
+
+    def creater(self, filename, payload=True):
         """
+        :param payload: add the payload rows (default True), or only
+                        the PROFILE fields
         :return ecsv: EXT-CSV object that contains all tables that
         are required for WOUDC EXT-CSV.
 
@@ -1567,21 +1953,13 @@ class AMES_2160_converter(converter):
             return False, msg
         try:
             LOGGER.info('Adding Profile Table.')
-            ecsv.add_data("PROFILE",
-                          ",".join(self.data_truple[0]),
-                          field="Pressure,O3PartialPressure,Temperature,"
-                                "WindSpeed,WindDirection,LevelCode,Duration,"
-                                "GPHeight,RelativeHumidity,SampleTemperature")
+            table = self.payload_table()
+            util.add_payload(ecsv, "PROFILE", table.fields,
+                             table.text_columns() if payload else None)
         except Exception as err:
             msg = 'Unable to add Profile table due to : %s' % str(err)
             LOGGER.error(msg)
             return False, msg
-        x = 1
-        LOGGER.info('Inserting payload value.')
-        while x < len(self.data_truple):
-            ecsv.add_data("PROFILE",
-                          ",".join(self.data_truple[x]))
-            x = x + 1
 
         return ecsv, 'Create EXT-CSV object Done.'
 
@@ -1777,11 +2155,93 @@ def dumps(ecsv):
         raise WOUDCFormatDumpError(msg)
 
 
+def convert_stream(InFormat, in_fh, out_fh, station_name=None, agency_name=None, metadata_dict=None, filename=None):  # noqa
+    """
+    :param InFormat: Input file format: SHADOZ, AMES-2160, BAS, Vaisala
+    :param in_fh: opened input file (AMES-2160 requires a file on disk)
+    :param out_fh: output text file, opened with newline=''
+    :param station_name: WOUDC station name
+    :param agency_name: WOUDC agency name
+    :param metadata_dict: directly inputed station metadata
+    :param filename: source file name written in comments
+                     (default name of in_fh)
+    :returns: number of payload rows written
+
+    Converts the input file and writes the same ext-csv text as dump()
+    to out_fh.  Metadata tables are written first, then the payload
+    rows are piped from the parsed PROFILE table a chunk at a time,
+    without copying them into the ext-csv object or into one string.
+    """
+
+    if not bool(metadata_dict):
+        metadata_dict = {}
+    if filename is None:
+        filename = ntpath.basename(getattr(in_fh, 'name', 'N/A'))
+    if InFormat.lower() == 'vaisala':
+        LOGGER.info('Initiatlizing Vaisala converter...')
+        converter = Vaisala_converter()
+        status, msg = converter.parser(in_fh, station_name, agency_name, metadata_dict)  # noqa
+    elif InFormat.lower() == 'shadoz':
+        LOGGER.info('Initiatlizing SHADOZ converter...')
+        converter = shadoz_converter()
+        status, msg = converter.parser(in_fh, station_name, agency_name, metadata_dict)  # noqa
+    elif InFormat.lower() == 'bas':
+        LOGGER.info('Initiatlizing BAS converter...')
+        converter = BAS_converter()
+        status, msg = converter.parser(in_fh)
+    elif InFormat.lower() == 'ames-2160':
+        LOGGER.info('Initiatlizing AMES-2160 converter...')
+        converter = AMES_2160_converter()
+        status, msg = converter.parser(in_fh, agency_name, metadata_dict)
+    else:
+        LOGGER.error('Unsupported format: %s' % InFormat)
+        raise RuntimeError('Unsupported format: %s' % InFormat)
+    if status is False:
+        LOGGER.error(msg)
+        raise WOUDCFormatParserError(msg)
+
+    if InFormat.lower() == 'bas':
+        ecsv, msg2 = converter.creater(payload=False)
+    else:
+        ecsv, msg2 = converter.creater(filename, payload=False)
+    if ecsv is False:
+        LOGGER.error(msg2)
+        raise WOUDCFormatCreateExtCsvError(msg2)
+    table = converter.payload_table()
+    if len(table) == 0:
+        msg2 = 'No payload rows to write'
+        LOGGER.error(msg2)
+        raise WOUDCFormatCreateExtCsvError(msg2)
+
+    # PROFILE is the last table, so its rows end the text
+    text = dumps(ecsv)
+    count = 0
+    try:
+        LOGGER.info('Stream ext-csv table to output file.')
+        out_fh.write(text)
+        csv_writer = csv.writer(out_fh)
+        for row in table.rows():
+            # trailing blank values are left out, as in serialize()
+            while len(row) > 1 and row[-1] == '':
+                row.pop()
+            csv_writer.writerow(row)
+            count += 1
+    except Exception as err:
+        msg = 'Unable to stream ext-csv table to output file due to: %s' % str(err)  # noqa
+        LOGGER.error(msg)
+        raise WOUDCFormatDumpError(msg)
+    return count
+
+
 def cli():
     """command line interface to core functions"""
+    import glob
     import json
+    import os
     import argparse
-    from woudc_formats.totalozone_mf import TotalOzone_MasterFile
+    from woudc_formats.totalozone_mf import (MasterFileFilter,
+                                             TotalOzone_MasterFile,
+                                             diff_master_files)
 
     LOGGER = logging.getLogger(__name__)
 
@@ -1854,6 +2314,134 @@ def cli():
         required=False
     )
 
+    PARSER.add_argument(
+        '--jobs',
+        help='number of worker processes (totalozone-masterfile only)',
+        type=int,
+        default=1,
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--scan-workers',
+        help='number of threads listing input directories (totalozone-masterfile only)',  # noqa
+        type=int,
+        default=8,
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--manifest',
+        help='manifest file for incremental rebuilds (totalozone-masterfile only)',  # noqa
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--outputs',
+        help='comma separated products written in one pass: fixed, csv, platform (totalozone-masterfile only)',  # noqa
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--compression-level',
+        help='zip/gzip compression level 0-9 (totalozone-masterfile only)',
+        type=int,
+        choices=range(10),
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--plain',
+        help='also keep uncompressed data files (totalozone-masterfile only)',  # noqa
+        action='store_true',
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--gzip',
+        help='also write gzip compressed data files (totalozone-masterfile only)',  # noqa
+        action='store_true',
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--upsert',
+        help='replace the records of one re-processed ext-CSV file (INPATH) in the master file in OUTPATH (totalozone-masterfile only)',  # noqa
+        action='store_true',
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--shard',
+        help='process partition I of N (I/N, I from 0) of the input files into a shard file in OUTPATH (totalozone-masterfile only)',  # noqa
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--merge-shards',
+        help='combine the shard files in INPATH (directory or comma separated files) into the master file in OUTPATH (totalozone-masterfile only)',  # noqa
+        action='store_true',
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--diff',
+        help='previous master file (o3tot.dat or o3tot.zip) to compare with INPATH, writing the delta to OUTPATH (totalozone-masterfile only)',  # noqa
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--platforms',
+        help='comma separated platform ids to select (totalozone-masterfile only)',  # noqa
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--instruments',
+        help='comma separated instrument names to select (totalozone-masterfile only)',  # noqa
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--start-date',
+        help='first date YYYY-MM-DD to select (totalozone-masterfile only)',
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--end-date',
+        help='last date YYYY-MM-DD to select (totalozone-masterfile only)',
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--metadata-cache',
+        help='on-disk snapshot of WOUDC station metadata',
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--metadata-ttl',
+        help='seconds before the station metadata snapshot is refetched',
+        type=int,
+        default=86400,
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--offline',
+        help='use the station metadata snapshot only, never the network',
+        action='store_true',
+        required=False
+    )
+
+    PARSER.add_argument(
+        '--stream',
+        help='write the metadata tables, then stream the payload rows to --outpath',  # noqa
+        action='store_true',
+        required=False
+    )
+
     ARGS = PARSER.parse_args()
     if ARGS.station:
         station_name = ARGS.station
@@ -1874,6 +2462,8 @@ def cli():
     # setup logging
     if ARGS.loglevel and ARGS.logfile:
         util.setup_logger(ARGS.logfile, ARGS.loglevel)
+    util.configure_metadata(ARGS.metadata_cache, ARGS.metadata_ttl,
+                            ARGS.offline)
 
     """
     if ARGS.format == 'totalozone-masterfile':
@@ -1927,7 +2517,40 @@ def cli():
         LOGGER.info('Running totalozone masterfile process...')
         MF = TotalOzone_MasterFile()
         output = ARGS.outpath
-        MF.update_totalOzone_master_file(input, output, None, 'overwrite', 'off')  # noqa
+        outputs = None
+        if ARGS.outputs:
+            outputs = [item.strip() for item in ARGS.outputs.split(',')]
+        extras = [name for name in ('plain', 'gzip') if getattr(ARGS, name)]
+        file_filter = None
+        if any([ARGS.platforms, ARGS.instruments, ARGS.start_date,
+                ARGS.end_date]):
+            platforms = instruments = None
+            if ARGS.platforms:
+                platforms = [item.strip() for item in ARGS.platforms.split(',')]  # noqa
+            if ARGS.instruments:
+                instruments = [item.strip() for item in ARGS.instruments.split(',')]  # noqa
+            file_filter = MasterFileFilter(platforms, instruments,
+                                           ARGS.start_date, ARGS.end_date)
+        shard = None
+        if ARGS.shard:
+            shard = tuple(int(value) for value in ARGS.shard.split('/'))
+        if ARGS.diff:
+            diff_master_files(ARGS.diff, input, output)
+        elif ARGS.merge_shards:
+            if os.path.isdir(input):
+                shard_files = sorted(glob.glob(os.path.join(input, 'o3tot_shard_*_of_*.jsonl')))  # noqa
+            else:
+                shard_files = [item.strip() for item in input.split(',')]
+            MF.merge_totalOzone_master_file_shards(shard_files, output, compresslevel=ARGS.compression_level, extras=extras)  # noqa
+        elif ARGS.upsert:
+            MF.upsert_totalOzone_master_file(input, output, ARGS.compression_level, extras)  # noqa
+        else:
+            MF.update_totalOzone_master_file(input, output, None, 'overwrite', 'off', jobs=ARGS.jobs, manifest_file=ARGS.manifest, outputs=outputs, compresslevel=ARGS.compression_level, extras=extras, file_filter=file_filter, scan_workers=ARGS.scan_workers, shard=shard)  # noqa
+    elif ARGS.stream:
+        with open(ARGS.inpath) as in_fh, \
+                open(output_path, 'w', newline='') as out_fh:
+            convert_stream(ARGS.format, in_fh, out_fh, station_name,
+                           agency_name, metadata_dict)
     else:
         ecsv = load(ARGS.format, ARGS.inpath, station_name,
                     agency_name, metadata_dict)
@@ -43,428 +43,1981 @@
 #
 # =================================================================
 
+import calendar
+from concurrent.futures import ProcessPoolExecutor
 import csv
+import gzip
+import hashlib
+import heapq
+import json
 from datetime import datetime
 import logging
+import mmap
 import os
 import re
 import shutil
-from io import StringIO
 import tempfile
+from functools import partial
+from io import StringIO, TextIOWrapper
+from itertools import groupby, islice, repeat
 import time
 import zipfile
 
+import numpy as np
+
 from woudc_formats import util
 
 LOGGER = logging.getLogger(__name__)
 
+# ext-CSV tables read by the master file builder
+TABLES = ('PLATFORM', 'INSTRUMENT', 'DAILY')
+
+# master file products: data file name, zip file name
+PRODUCTS = {
+    'fixed': ('o3tot.dat', 'o3tot.zip'),
+    'csv': ('o3tot.csv', 'o3tot_csv.zip'),
+    'platform': (None, 'o3tot_platforms.zip')
+}
+
+PLATFORM_FILENAME = 'o3tot_%s.dat'
+
+# shard file of a partition (index, count) of a sharded run
+SHARD_FILENAME = 'o3tot_shard_%d_of_%d.jsonl'
+
+# operation codes of master file diff lines
+DIFF_OPS = {'added': b'+', 'removed': b'-', 'changed': b'~'}
+
+# ext-CSV tables read to classify a file whose name cannot be classified
+HEADER_TABLES = ('PLATFORM', 'INSTRUMENT', 'TIMESTAMP')
+
+# WOUDC archive layout: stnNNN/<instrument>/<year>/<ext-CSV filename>
+STATION_DIRECTORY = re.compile(r'^stn(\d+)$', re.IGNORECASE)
+YEAR_DIRECTORY = re.compile(r'^(\d{4})$')
+# YYYYMM01.Instrument.Model.Number.Agency.csv, see util.print_extCSV
+EXTCSV_FILENAME = re.compile(
+    r'^(\d{4})(\d{2})\d{2}\.([^.]+)\.[^.]+\.[^.]+\.[^.]+\.csv$',
+    re.IGNORECASE)
+
+HEADING_ROW = 'Platform_ID,Year,Month,Day,Start_Hour,Finish_Hour,Wavelength_Pair,Observation_Type,Total_Column_Ozone_Amount,Ozone_Std_Error,Instrument_Type,Instrument_Number\r\n'  # noqa
+
+_ARCHIVES = {}
+
 
 class TotalOzone_MasterFile(object):
 
     def __init__(self):
         pass
 
-    def update_totalOzone_master_file(self, directory, master_file, date, mode, heading):  # noqa
-        """Updates Total Ozone Master File"""
+    def update_totalOzone_master_file(self, directory, master_file, date, mode, heading, jobs=1, manifest_file=None, outputs=None, compresslevel=None, extras=(), file_filter=None, scan_workers=util.SCAN_WORKERS, shard=None):  # noqa
+        """
+        Updates Total Ozone Master File
+
+        :param jobs: number of worker processes used to parse input files.
+                     Output and processing log are identical to a serial run.
+        :param manifest_file: path to a manifest caching each input file's
+                              output; only new or changed files are parsed
+        :param outputs: products to write in one pass, any of 'fixed'
+                        (o3tot.zip), 'csv' (o3tot_csv.zip, with heading
+                        row) and 'platform' (o3tot_platforms.zip, one
+                        fixed-width file per platform); by default the
+                        single product selected by heading (o3tot.zip)
+        :param compresslevel: zip/gzip compression level (0-9)
+        :param extras: also keep each data file uncompressed ('plain')
+                       and/or write it gzip compressed ('gzip')
+        :param file_filter: MasterFileFilter selecting the input files by
+                            platform, instrument and date range
+        :param scan_workers: number of threads listing input directories
+        :param shard: tuple of (index, count): only process the input
+                      files of partition index (0 to count - 1, see
+                      shard_index) and write their log and output to a
+                      shard file in master_file, for
+                      merge_totalOzone_master_file_shards
+        """
         # Initialization
-        write_output = 1
         current_time = (datetime.now()).strftime("%Y_%m_%d")
-        log_file = open('totalOzone_processing_log_%s' % current_time, 'w')  # noqa
-        data_file = None
-        global tmp_filename
-        tmp_filename = os.path.join(master_file, 'o3tot.dat')
-        if mode == 'overwrite':
-            data_file = open(tmp_filename, 'w+')
+        log_filename = 'totalOzone_processing_log_%s' % current_time
+        if shard is not None:
+            log_filename += '_shard_%d_of_%d' % tuple(shard)
+        log_file = open(log_filename, 'w')
+        formats = None
+        if outputs is not None:
+            formats = tuple(outputs)
+            unknown = set(formats) - set(PRODUCTS)
+            if unknown:
+                log_file.close()
+                raise ValueError('Unknown master file outputs: %s' % ', '.join(sorted(unknown)))  # noqa
+        if shard is not None:
+            data_file = MasterFileShard(
+                os.path.join(master_file, SHARD_FILENAME % tuple(shard)),
+                shard, heading, formats)
         else:
-            data_file = open(tmp_filename, 'a+')
-        if heading == 'on':
-            data_file.write('Platform_ID,Year,Month,Day,Start_Hour,Finish_Hour,Wavelength_Pair,Observation_Type,Total_Column_Ozone_Amount,Ozone_Std_Error,Instrument_Type,Instrument_Number\r\n')  # noqa
+            data_file = MasterFileOutput(master_file, mode, heading, formats,
+                                         compresslevel, extras)
 
         # external ftp file
         global output_file
         output_file = 'Summaries/TotalOzone/Daily_Summary/o3tot.zip'  # noqa
 
-        # extract zipfile
-        zip_flag = False
-        path = directory
+        # zip archives are read member by member, without extraction
+        archive = None
         if zipfile.is_zipfile(directory):
-            zip_flag = True
-            tmpdir = tempfile.mkdtemp()
-            z = zipfile.ZipFile(directory)
-            z.extractall(path=tmpdir)
-            path = tmpdir
+            archive = directory
+            entries = archive_entries(directory, file_filter)
+        else:
+            entries = directory_entries(directory, file_filter,
+                                        scan_workers)
+
+        manifest = None
+        if manifest_file is not None:
+            manifest = MasterFileManifest(
+                manifest_file, heading if formats is None else '+'.join(formats))  # noqa
 
         # traverse the given directory
-        for dirname, dirnames, filenames in os.walk(path):
-            dirnames.sort()
-            filenames.sort()
-            for filename in filenames:
-                filepath = os.path.join(dirname, filename)
-                num_errors = 0
+        tasks = []
+        for filepath, member, size, mtime, error in entries:
+            if member is not None:
+                relpath = member
+            else:
+                relpath = os.path.relpath(filepath, directory).replace(os.sep, '/')  # noqa
+            if shard is not None and shard_index(relpath, shard[1]) != shard[0]:  # noqa
+                continue
+            if error is not None:
+                LOGGER.error(error)
+                tasks.append((filepath, member, None, None, error, relpath))
+                continue
+            file_last_modified_date = time.strftime("%Y-%m-%d", time.localtime(mtime))  # noqa
+            # date comparison
+            if date is not None and file_last_modified_date > date:
+                continue
+            if file_filter is not None:
+                if not file_filter.accept(relpath, filepath, archive, member):  # noqa
+                    continue
+            cached = None
+            if manifest is not None:
+                cached = manifest.lookup(
+                    filepath, size, mtime,
+                    partial(source_digest, filepath, archive, member))
+            tasks.append((filepath, member, (size, mtime),
+                          file_last_modified_date, cached, relpath))
+
+        # only new or changed files are parsed
+        pending = [task for task in tasks
+                   if task[2] is not None and task[4] is None]
+        filepaths = [task[0] for task in pending]
+        members = [task[1] for task in pending]
+        if jobs is not None and jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            chunksize = max(1, len(pending) // (jobs * 4))
+            results = executor.map(process_file, filepaths, repeat(heading),
+                                   repeat(archive), members, repeat(formats),
+                                   chunksize=chunksize)
+        else:
+            executor = None
+            results = map(process_file, filepaths, repeat(heading),
+                          repeat(archive), members, repeat(formats))
+
+        # results arrive in walk order regardless of the number of workers
+        try:
+            for filepath, member, stat, file_last_modified_date, cached, relpath in tasks:  # noqa
+                if stat is None:
+                    log_text = f"ERROR: Unable to process file: {filepath}\r\n{cached}\r\n{summary_line(filepath, 0, 1)}"  # noqa
+                    log_file.write(log_text)
+                    if shard is not None:
+                        data_file.store(relpath, log_text, None)
+                    continue
+                processing_line = f'PROCESSING: {filepath}        last modified date: {file_last_modified_date}\r\n'  # noqa
+                log_file.write(processing_line)
+                if cached is not None:
+                    log_text, data_lines = cached
+                else:
+                    log_text, data_lines = next(results)
+                    if manifest is not None:
+                        manifest.store(
+                            filepath, stat[0], stat[1], log_text, data_lines,
+                            source_digest(filepath, archive, member))
+                log_file.write(log_text)
+                if shard is not None:
+                    data_file.store(relpath, processing_line + log_text,
+                                    data_lines)
+                else:
+                    data_file.write(data_lines)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            close_archives()
+
+        if manifest is not None:
+            manifest.save()
+        if file_filter is not None:
+            LOGGER.info('Filter: {} files selected, {} skipped, {} header reads'.format(file_filter.selected, file_filter.skipped, file_filter.header_reads))  # noqa
+
+        # data files close, zip and remove
+        data_file.close()
+
+        # log file close
+        log_file.close()
+        LOGGER.info('log file is located here: {}'.format(os.path.abspath(log_filename)))  # noqa
+
+    def merge_totalOzone_master_file_shards(self, shard_files, master_file, mode='overwrite', compresslevel=None, extras=()):  # noqa
+        """
+        Combines the shard files of a sharded Total Ozone Master File
+        run into the products and processing log of a single run
+
+        Each shard file lists its input files in walk order, so the
+        shards are merged on the walk order of their paths.
+
+        :param shard_files: paths to the shard files of every partition
+        :param master_file: output directory
+        :param mode: 'overwrite', else data files are appended to
+        :param compresslevel: zip/gzip compression level (0-9)
+        :param extras: also keep each data file uncompressed ('plain')
+                       and/or write it gzip compressed ('gzip')
+        """
+        shards = [MasterFileShard.load(filepath) for filepath in shard_files]
+        headers = [header for header, _ in shards]
+        count = headers[0]['shard'][1] if headers else 0
+        if sorted(header['shard'][0] for header in headers) != list(range(count)):  # noqa
+            raise ValueError('Shard files do not cover {} partitions exactly'.format(count))  # noqa
+        for header in headers:
+            if header['shard'][1] != count or \
+                    header['heading'] != headers[0]['heading'] or \
+                    header['formats'] != headers[0]['formats']:
+                raise ValueError('Shard files of different runs: {}'.format(', '.join(shard_files)))  # noqa
+        heading = headers[0]['heading']
+        formats = headers[0]['formats']
+        if formats is not None:
+            formats = tuple(formats)
+
+        current_time = (datetime.now()).strftime("%Y_%m_%d")
+        log_filename = 'totalOzone_processing_log_%s' % current_time
+        data_file = MasterFileOutput(master_file, mode, heading, formats,
+                                     compresslevel, extras)
+        with open(log_filename, 'w') as log_file:
+            entries = heapq.merge(
+                *[entries for _, entries in shards],
+                key=lambda entry: walk_order_key(entry['path']))
+            for entry in entries:
+                log_file.write(entry['log'])
+                if entry['lines'] is not None:
+                    data_file.write(entry['lines'])
+        data_file.close()
+        LOGGER.info('log file is located here: {}'.format(os.path.abspath(log_filename)))  # noqa
+
+    def upsert_totalOzone_master_file(self, filepath, master_file, compresslevel=None, extras=()):  # noqa
+        """
+        Replaces the records of one re-processed ext-CSV file in an
+        existing fixed-width Total Ozone Master File
+
+        The block of records a full rebuild takes from the file (same
+        platform and instrument, dated from the file's date up to the
+        next file of the instrument) is replaced by the file's output,
+        see source_dates and upsert_records.  o3tot.zip is then rebuilt
+        from o3tot.dat.
+
+        :param filepath: path to the re-processed ext-CSV file
+        :param master_file: directory of o3tot.zip (and o3tot.dat, kept
+                            by a previous run with extras 'plain')
+        :param compresslevel: zip/gzip compression level (0-9)
+        :param extras: keep o3tot.dat uncompressed ('plain') and/or
+                       write o3tot.dat.gz ('gzip')
+        :returns: tuple of (number of records removed, number written)
+        """
+        current_time = (datetime.now()).strftime("%Y_%m_%d")
+        data_path = os.path.join(master_file, 'o3tot.dat')
+        zip_path = os.path.join(master_file, 'o3tot.zip')
+        extracted = False
+        if not os.path.exists(data_path):
+            with zipfile.ZipFile(zip_path) as archive:
+                archive.extract('o3tot.dat', master_file)
+            extracted = True
+
+        log_text, data_lines = process_file(filepath)
+        with open('totalOzone_processing_log_%s' % current_time, 'w') as log_file:  # noqa
+            log_file.write(f'PROCESSING: {filepath}        upsert\r\n')  # noqa
+            log_file.write(log_text)
+        start, end = source_dates(filepath)
+        removed, written = upsert_records(data_path, data_lines, start, end)
+        LOGGER.info('Upsert of {}: {} records removed, {} written'.format(filepath, removed, written))  # noqa
+
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED,
+                             compresslevel=compresslevel) as archive:
+            archive.write(data_path, 'o3tot.dat')
+        if 'gzip' in extras:
+            kwargs = {}
+            if compresslevel is not None:
+                kwargs['compresslevel'] = compresslevel
+            with open(data_path, 'rb') as ff, gzip.open('%s.gz' % data_path, 'wb', **kwargs) as gz:  # noqa
+                shutil.copyfileobj(ff, gz)
+        if extracted and 'plain' not in extras:
+            os.remove(data_path)
+        return removed, written
+
+    @staticmethod
+    def normalize_csv_row(row, expected_length):
+        """
+        Ensure row has the expected number of elements.
+        Pads with empty strings if too short, truncates if too long.
+        """
+        if len(row) < expected_length:
+            row.extend([''] * (expected_length - len(row)))
+        elif len(row) > expected_length:
+            row = row[:expected_length]
+        return row
+
+
+def process_file(filepath, heading=None, archive=None, member=None,
+                 formats=None):
+    """
+    Processes one ext-CSV file into Total Ozone Master File lines
+
+    Each file is processed independently of every other file, which
+    allows files to be dispatched to a pool of worker processes.
+
+    :param filepath: path to ext-CSV file
+    :param heading: 'on' for comma separated output, else fixed-width
+    :param archive: path to zip archive to read member from
+    :param member: archive member name of the ext-CSV file
+    :param formats: output formats to produce in one pass ('fixed',
+                    'csv', 'platform'), instead of the one chosen by
+                    heading; the processing log is the fixed-width one
+                    whenever 'fixed' or 'platform' is among them
+    :returns: tuple of (processing log text following the PROCESSING
+              line, list of output lines), or with formats, tuple of
+              (processing log text, dict of output lines by format,
+              with the 'platform' lines keyed by platform id)
+    """
+
+    if formats is None:
+        fixed = heading != 'on'
+        comma = not fixed
+    else:
+        fixed = 'fixed' in formats or 'platform' in formats
+        comma = 'csv' in formats
+    log = []
+    output = []
+    csv_output = []
+    platform_id = '   '
+    num_errors = 0
+    num_daily_rows_written = 0
+    write_output = 1
+    inst_name = None
+    try:
+        if archive is not None:
+            with open_archive(archive).open(member) as stream:
+                extCSV = util.WOUDCextCSVReader(filepath, stream,
+                                                tables=TABLES)
+        else:
+            extCSV = util.WOUDCextCSVReader(filepath, tables=TABLES)
+
+        # store data into variables
+        platform_id = '   '
+        if 'PLATFORM' in extCSV.sections:
+            p_id = extCSV.sections['PLATFORM']['ID']
+            if p_id is not None and len(p_id) != 0:
+                platform_id = p_id.zfill(3)  # Zero-pad to 3 characters # noqa
+        else:
+            log.append(f'ERROR#E01:Could not find PLATFORM in input file: {filepath}. Data ignored\r\n')  # noqa
+            num_errors += 1
+
+        inst_type_id = '  '
+        inst_number = '   0'
+        if 'INSTRUMENT' in extCSV.sections:
+            inst_name = extCSV.sections['INSTRUMENT']['Name']
+            inst_model = extCSV.sections['INSTRUMENT']['Model']
+            if inst_name is not None and len(inst_name) != 0 and inst_name:  # noqa
+                try:
+                    inst_type_id  = util.get_config_value('Instrument Type ID', inst_name)  # noqa
+                    if inst_model == 'Japanese':
+                        inst_type_id  = util.get_config_value('Instrument Type ID', inst_model+' '+inst_name)  # noqa
+                    if len(inst_type_id) == 1:
+                        inst_type_id = ' %s' % inst_type_id
+                except Exception as err:
+                    log.append('ERROR#E02: There is no instrument type id for \'%s\' in file %s. Data ignored\r\n' % (inst_name,filepath))  # noqa
+                    num_errors += 1
+                    LOGGER.warning('ERROR E02: Invalid instrument type caused by {}'.format(err))  # noqa
+                    # write_output = 0
+            i_num = extCSV.sections['INSTRUMENT']['Number']
+            if i_num is not None and len(i_num) != 0:
+                inst_number = i_num
+                inst_number = re.sub("^0{1,2}", "", inst_number)  # noqa
+                if len(inst_number) == 1:
+                    inst_number = '   %s' % inst_number
+                if len(inst_number) == 2:
+                    inst_number = '  %s' % inst_number
+                if len(inst_number) == 3:
+                    inst_number = ' %s' % inst_number
+                if i_num.lower() == 'na':
+                    inst_number = '   0'
+            inst_number = str(int(inst_number)).rjust(4)
+        else:
+            log.append('ERROR#E03:Could not find INSTRUMENT in input file: %s. Data ignored\r\n' % filepath)  # noqa
+            num_errors += 1
+
+        if 'DAILY' in extCSV.sections:
+            data = StringIO((extCSV.sections['DAILY']['_raw']).strip())  # noqa
+            num_daily_rows_written = 0
+            if data is not None:
                 try:
-                    # print filename
-                    file_last_modified_date = time.strftime ("%Y-%m-%d",time.localtime(os.path.getmtime(filepath)))  # noqa
-                    # date comparison
-                    if date is not None and file_last_modified_date <= date:  # noqa
-                        log_file.write(f'PROCESSING: {filepath}        last modified date: {file_last_modified_date}\r\n')  # noqa
-                        extCSV = util.WOUDCextCSVReader(filepath)  # noqa
-                    if date is not None and file_last_modified_date > date:
+                    data_rows = csv.reader(data)
+                    header_row = next(data_rows)
+                    expected_columns = len(header_row)
+
+                    # Create a mapping of column names to indices for robustness
+                    col_map = {col.strip(): idx for idx, col in enumerate(header_row)}
+                except StopIteration:
+                    log.append(f"ERROR#E04:Error reading DAILY block in file {filepath}. Data omitted\r\n")  # noqa
+                    num_errors += 1
+                    write_output = 0
+                    pass
+                rows = []
+                for row in data_rows:
+                    # Skip empty rows (double spacing issue)
+                    if not row or all(cell == '' for cell in row):
                         continue
-                    if date is None:
-                        log_file.write(f'PROCESSING: {filepath}        last modified date: {file_last_modified_date}\r\n')  # noqa
-                        extCSV = util.WOUDCextCSVReader(filepath)  # noqa
-
-                    # store data into variables
-                    platform_id = '   '
-                    if 'PLATFORM' in extCSV.sections:
-                        p_id = extCSV.sections['PLATFORM']['ID']
-                        if p_id is not None and len(p_id) != 0:
-                            platform_id = p_id.zfill(3)  # Zero-pad to 3 characters # noqa
+
+                    # Normalize row length to match header
+                    rows.append(TotalOzone_MasterFile.normalize_csv_row(row, expected_columns))  # noqa
+
+                # common rows are formatted in bulk, the rest row by row
+                batch_lines = [None] * len(rows)
+                batch_csv_lines = batch_lines
+                if rows:
+                    batch_lines, batch_csv_lines = format_daily_rows(
+                        rows, col_map, platform_id, inst_name,
+                        inst_type_id, inst_number, with_csv=True)
+
+                for row, batch_line, batch_csv_line in zip(rows, batch_lines, batch_csv_lines):  # noqa
+                    if batch_line is not None:
+                        if fixed:
+                            output.append(f"{batch_line}\r\n")
+                            num_daily_rows_written += 1
+                        if comma:
+                            csv_output.append(f"{batch_csv_line}\r\n")
+                        continue
+
+                    # Initialize expected variables
+                    year = '    '
+                    month = '  '
+                    day = '  '
+                    UTC_Begin = '  '
+                    UTC_End = '  '
+                    WLCode = ' '
+                    ObsCode = ' '
+                    ozone_std_error = '   '
+                    ColumnO3 = '   '
+                    UTC_Mean = '  '
+                    nObs = ' '
+
+                    # Column map to each index
+                    date_idx = col_map.get('Date', 0)
+                    wlcode_idx = col_map.get('WLCode', 1)
+                    obscode_idx = col_map.get('ObsCode', 2)
+                    columno3_idx = col_map.get('ColumnO3', 3)
+                    utc_begin_idx = col_map.get('UTC_Begin', 5)
+                    utc_end_idx = col_map.get('UTC_End', 6)
+                    utc_mean_idx = col_map.get('UTC_Mean', 7)
+                    nobs_idx = col_map.get('nObs', 8)
+
+                    # Check for rows with only date (like "2020-01-01" with no data)
+                    if len(row[0]) != 0 and "*" not in row[0]:
+                        try:
+                            year = row[date_idx].split('-')[0]
+                            month = row[date_idx].split('-')[1].zfill(2)
+                            day = row[date_idx].split('-')[2].zfill(2)
+                        except (IndexError, ValueError):
+                            log.append(
+                                f"ERROR#E12:Invalid date format: {row[date_idx]} in row {row}. "
+                                "Data ignored\r\n"
+                            )
+                            num_errors += 1
+                            continue
+
+                        # Check if this is a data-less row (only has date)
+                        has_data = any(row[i].strip() for i in range(1, len(row)))
+                        if not has_data:
+                            log.append(
+                                f"WARNING:Row with date {row[date_idx]} has no data. Data ignored\r\n"
+                            )
+                            continue
                     else:
-                        log_file.write(f'ERROR#E01:Could not find PLATFORM in input file: {filepath}. Data ignored\r\n')  # noqa
-                        num_errors += 1
+                        # Skip rows without valid dates
+                        continue
 
-                    inst_type_id = '  '
-                    inst_number = '   0'
-                    if 'INSTRUMENT' in extCSV.sections:
-                        inst_name = extCSV.sections['INSTRUMENT']['Name']
-                        inst_model = extCSV.sections['INSTRUMENT']['Model']
-                        if inst_name is not None and len(inst_name) != 0 and inst_name:  # noqa
+                    # WLCode processing
+                    if wlcode_idx < len(row) and len(row[wlcode_idx]) != 0:  # noqa
+                        WLCode = row[wlcode_idx]
+                        # Strip leading zeros if WLCode is numeric and more than one character long
+                        if len(WLCode) > 1 and WLCode.isdigit():
+                            WLCode = str(int(WLCode))  # Strip leading zeros
+
+                        if len(WLCode) > 1:
                             try:
-                                inst_type_id  = util.get_config_value('Instrument Type ID', inst_name)  # noqa
-                                if inst_model == 'Japanese':
-                                    inst_type_id  = util.get_config_value('Instrument Type ID', inst_model+' '+inst_name)  # noqa
-                                if len(inst_type_id) == 1:
-                                    inst_type_id = ' %s' % inst_type_id
+                                WLCode = util.get_config_value('WLCode', WLCode)
                             except Exception as err:
-                                log_file.write('ERROR#E02: There is no instrument type id for \'%s\' in file %s. Data ignored\r\n' % (inst_name,filepath))  # noqa
+                                log.append(f"ERROR#E05:There is no one-character WLCode code for '{WLCode}' in row {row}. Data ignored\r\n")
                                 num_errors += 1
-                                LOGGER.warning('ERROR E02: Invalid instrument type caused by {}'.format(err))  # noqa
+                                LOGGER.error('E05: Invalid WLCode caused by {}'.format(err))
+                                WLCode = ' '  # set as empty instead of omitting row
                                 # write_output = 0
-                        i_num = extCSV.sections['INSTRUMENT']['Number']
-                        if i_num is not None and len(i_num) != 0:
-                            inst_number = i_num
-                            inst_number = re.sub("^0{1,2}", "", inst_number)  # noqa
-                            if len(inst_number) == 1:
-                                inst_number = '   %s' % inst_number
-                            if len(inst_number) == 2:
-                                inst_number = '  %s' % inst_number
-                            if len(inst_number) == 3:
-                                inst_number = ' %s' % inst_number
-                            if i_num.lower() == 'na':
-                                inst_number = '   0'
-                        inst_number = str(int(inst_number)).rjust(4)
                     else:
-                        log_file.write('ERROR#E03:Could not find INSTRUMENT in input file: %s. Data ignored\r\n' % filepath)  # noqa
-                        num_errors += 1
+                        # Default WLCode based on instrument
+                        if inst_name == 'Dobson':
+                            WLCode = util.get_config_value(
+                                'WLCode', 'Dobson')
+                        elif inst_name == 'Brewer':
+                            WLCode = util.get_config_value(
+                                'WLCode', 'Brewer')
+                        elif inst_name == 'Filter':
+                            WLCode = util.get_config_value(
+                                'WLCode', 'Filter')
+                        elif inst_name == 'Microtops':
+                            WLCode = util.get_config_value(
+                                'WLCode', 'Microtops')
 
-                    if 'DAILY' in extCSV.sections:
-                        data = StringIO((extCSV.sections['DAILY']['_raw']).strip())  # noqa
-                        num_daily_rows_written = 0
-                        if data is not None:
+                    # ObsCode processing
+                    if obscode_idx < len(row) and len(row[obscode_idx]) != 0:  # noqa
+                        ObsCode = row[obscode_idx]
+                        if not ObsCode.isdigit() or len(ObsCode) != 1:  # noqa
                             try:
-                                data_rows = csv.reader(data)
-                                header_row = next(data_rows)
-                                expected_columns = len(header_row)
-
-                                # Create a mapping of column names to indices for robustness
-                                col_map = {col.strip(): idx for idx, col in enumerate(header_row)}
-                            except StopIteration:
-                                log_file.write(f"ERROR#E04:Error reading DAILY block in file {filepath}. Data omitted\r\n")  # noqa
+                                ObsCode = util.get_config_value('Obs Code', ObsCode)
+                            except Exception as err:
+                                log.append(f"ERROR#E06:There is no obs code for \'{ObsCode}\' in row {row}. Data ignored\r\n")
+                                num_errors += 1
+                                LOGGER.error('E06: Missing observation code caused by {}'.format(err))
+                                ObsCode = ' '  # set as empty instead of omitting row
+                                # write_output = 0
+                    else:
+                        ObsCode = '9'
+
+                    # ColumnO3 processing
+                    if columno3_idx < len(row) and len(row[columno3_idx]) != 0 and row[columno3_idx] != '0.0' and row[columno3_idx] != '0' and "-" not in row[columno3_idx]:  # noqa
+                        try:
+                            ColumnO3 = '%.0f' % round(float(re.findall("[0-9]*.[0-9]*", row[columno3_idx])[0]), 0)
+                            if ColumnO3 == '0':
+                                log.append(f"ERROR#E07:ColumnO3 value is {row[columno3_idx]}. Data row omitted\r\n")  # noqa
                                 num_errors += 1
                                 write_output = 0
-                                pass
-                            for row in data_rows:
-                                # Skip empty rows (double spacing issue)
-                                if not row or all(cell == '' for cell in row):
-                                    continue
-
-                                # Normalize row length to match header
-                                row = self.normalize_csv_row(row, expected_columns)
-
-                                # Initialize expected variables
-                                year = '    '
-                                month = '  '
-                                day = '  '
-                                UTC_Begin = '  '
-                                UTC_End = '  '
-                                WLCode = ' '
-                                ObsCode = ' '
-                                ozone_std_error = '   '
-                                ColumnO3 = '   '
-                                UTC_Mean = '  '
-                                nObs = ' '
-
-                                # Column map to each index
-                                date_idx = col_map.get('Date', 0)
-                                wlcode_idx = col_map.get('WLCode', 1)
-                                obscode_idx = col_map.get('ObsCode', 2)
-                                columno3_idx = col_map.get('ColumnO3', 3)
-                                utc_begin_idx = col_map.get('UTC_Begin', 5)
-                                utc_end_idx = col_map.get('UTC_End', 6)
-                                utc_mean_idx = col_map.get('UTC_Mean', 7)
-                                nobs_idx = col_map.get('nObs', 8)
-
-                                # Check for rows with only date (like "2020-01-01" with no data)
-                                if len(row[0]) != 0 and "*" not in row[0]:
-                                    try:
-                                        year = row[date_idx].split('-')[0]
-                                        month = row[date_idx].split('-')[1].zfill(2)
-                                        day = row[date_idx].split('-')[2].zfill(2)
-                                    except (IndexError, ValueError):
-                                        log_file.write(
-                                            f"ERROR#E12:Invalid date format: {row[date_idx]} in row {row}. "
-                                            "Data ignored\r\n"
-                                        )
-                                        num_errors += 1
-                                        continue
-
-                                    # Check if this is a data-less row (only has date)
-                                    has_data = any(row[i].strip() for i in range(1, len(row)))
-                                    if not has_data:
-                                        log_file.write(
-                                            f"WARNING:Row with date {row[date_idx]} has no data. Data ignored\r\n"
-                                        )
-                                        continue
-                                else:
-                                    # Skip rows without valid dates
-                                    continue
-
-                                # WLCode processing
-                                if wlcode_idx < len(row) and len(row[wlcode_idx]) != 0:  # noqa
-                                    WLCode = row[wlcode_idx]
-                                    # Strip leading zeros if WLCode is numeric and more than one character long
-                                    if len(WLCode) > 1 and WLCode.isdigit():
-                                        WLCode = str(int(WLCode))  # Strip leading zeros
-
-                                    if len(WLCode) > 1:
-                                        try:
-                                            WLCode = util.get_config_value('WLCode', WLCode)
-                                        except Exception as err:
-                                            log_file.write(f"ERROR#E05:There is no one-character WLCode code for '{WLCode}' in row {row}. Data ignored\r\n")
-                                            num_errors += 1
-                                            LOGGER.error('E05: Invalid WLCode caused by {}'.format(err))
-                                            WLCode = ' '  # set as empty instead of omitting row
-                                            # write_output = 0
-                                else:
-                                    # Default WLCode based on instrument
-                                    if inst_name == 'Dobson':
-                                        WLCode = util.get_config_value(
-                                            'WLCode', 'Dobson')
-                                    elif inst_name == 'Brewer':
-                                        WLCode = util.get_config_value(
-                                            'WLCode', 'Brewer')
-                                    elif inst_name == 'Filter':
-                                        WLCode = util.get_config_value(
-                                            'WLCode', 'Filter')
-                                    elif inst_name == 'Microtops':
-                                        WLCode = util.get_config_value(
-                                            'WLCode', 'Microtops')
-
-                                # ObsCode processing
-                                if obscode_idx < len(row) and len(row[obscode_idx]) != 0:  # noqa
-                                    ObsCode = row[obscode_idx]
-                                    if not ObsCode.isdigit() or len(ObsCode) != 1:  # noqa
-                                        try:
-                                            ObsCode = util.get_config_value('Obs Code', ObsCode)
-                                        except Exception as err:
-                                            log_file.write(f"ERROR#E06:There is no obs code for \'{ObsCode}\' in row {row}. Data ignored\r\n")
-                                            num_errors += 1
-                                            LOGGER.error('E06: Missing observation code caused by {}'.format(err))
-                                            ObsCode = ' '  # set as empty instead of omitting row
-                                            # write_output = 0
-                                else:
-                                    ObsCode = '9'
-
-                                # ColumnO3 processing
-                                if columno3_idx < len(row) and len(row[columno3_idx]) != 0 and row[columno3_idx] != '0.0' and row[columno3_idx] != '0' and "-" not in row[columno3_idx]:  # noqa
-                                    try:
-                                        ColumnO3 = '%.0f' % round(float(re.findall("[0-9]*.[0-9]*", row[columno3_idx])[0]), 0)
-                                        if ColumnO3 == '0':
-                                            log_file.write(f"ERROR#E07:ColumnO3 value is {row[columno3_idx]}. Data row omitted\r\n")  # noqa
-                                            num_errors += 1
-                                            write_output = 0
-                                    except Exception as err:
-                                        log_file.write(f"ERROR#E07:Could not round ColumnO3 value of: {row[columno3_idx]} in row {row}. Data row omitted\r\n")  # noqa
-                                        num_errors += 1
-                                        LOGGER.error('E07: Invalid ColumnO3 value. {}'.format(err))
-                                        write_output = 0
-                                    if len(ColumnO3) == 1:
-                                        ColumnO3 = '  %s' % ColumnO3
-                                    elif len(ColumnO3) == 2:
-                                        ColumnO3 = ' %s' % ColumnO3
-                                    # invalid if DU over 1000
-                                    elif (int(ColumnO3) >= 1000):
-                                        log_file.write(f"ERROR#E07:ColumnO3 value is questionably large: \'{ColumnO3}\' in row {row}. Data row omitted\r\n")
-                                        num_errors += 1
-                                        write_output = 0
+                        except Exception as err:
+                            log.append(f"ERROR#E07:Could not round ColumnO3 value of: {row[columno3_idx]} in row {row}. Data row omitted\r\n")  # noqa
+                            num_errors += 1
+                            LOGGER.error('E07: Invalid ColumnO3 value. {}'.format(err))
+                            write_output = 0
+                        if len(ColumnO3) == 1:
+                            ColumnO3 = '  %s' % ColumnO3
+                        elif len(ColumnO3) == 2:
+                            ColumnO3 = ' %s' % ColumnO3
+                        # invalid if DU over 1000
+                        elif (int(ColumnO3) >= 1000):
+                            log.append(f"ERROR#E07:ColumnO3 value is questionably large: \'{ColumnO3}\' in row {row}. Data row omitted\r\n")
+                            num_errors += 1
+                            write_output = 0
+                    else:
+                        LOGGER.debug(f"ColumnO3 value of {row[columno3_idx]} is invalid (empty, 0 or negative). Data ignored.")  # noqa
+                        write_output = 0
+
+                    # UTC_Begin processing
+                    if utc_begin_idx < len(row) and len(row[utc_begin_idx]) != 0:  # noqa
+                        UTC_Begin = row[utc_begin_idx]
+                        # rare case match if in HH:MM:SS format
+                        hhmmss_pattern = re.match(r'^(\d{2}):(\d{2}):(\d{2})$', UTC_Begin)
+                        if hhmmss_pattern:
+                            # take just the hour part
+                            UTC_Begin = hhmmss_pattern.group(1)
+                        elif len(re.findall("[0-9]*", UTC_Begin)[0]) > 2:  # noqa
+                            UTC_Begin = UTC_Begin[:2]
+                        elif "-" in UTC_Begin:
+                            if -1.5 >= float(UTC_Begin):
+                                UTC_Begin = '-0'
+                            else:
+                                UTC_Begin = '00'
+                        else:
+                            try:
+                                UTC_Begin = '%.0f' % round(float(UTC_Begin), 0)
+                                if int(UTC_Begin) in range(10):
+                                    UTC_Begin = '0%s' % UTC_Begin
+                            except Exception as err:
+                                log.append(f"ERROR#E08:Could not round UTC_Begin value of: {UTC_Begin} in row {row}. Data row omitted\r\n")
+                                num_errors += 1
+                                LOGGER.error('E08: Invalid UTC_Begin value. {}'.format(err))
+                                write_output = 0
+
+                    # UTC_End processing
+                    if utc_end_idx < len(row) and len(row[utc_end_idx]) != 0:  # noqa
+                        UTC_End = row[utc_end_idx]
+                        # rare case match if in HH:MM:SS format
+                        hhmmss_pattern = re.match(r'^(\d{2}):(\d{2}):(\d{2})$', UTC_End)
+                        if hhmmss_pattern:
+                            # take just the hour part
+                            UTC_End = hhmmss_pattern.group(1)
+                        if len(re.findall("[0-9]*", UTC_End)[0]) > 2:  # noqa
+                            UTC_End = UTC_End[:2]
+                        elif "-" in UTC_End:
+                            if -1.5 >= float(UTC_End):
+                                UTC_End = '-0'
+                            else:
+                                UTC_End = '00'
+                        else:
+                            try:
+                                UTC_End = '%.0f' % round(float(UTC_End), 0)
+                                if int(UTC_End) in range(10):
+                                    UTC_End = '0%s' % UTC_End
+                            except Exception as err:
+                                log.append(f"ERROR#E09:Could not round UTC_End value of: {UTC_End} in row {row}. Data row omitted\r\n")
+                                num_errors += 1
+                                LOGGER.error('E09: Invalid UTC_End value. {}'.format(err))
+                                write_output = 0
+
+                    # UTC_Mean processing (and fallback for UTC_End)
+                    if utc_mean_idx < len(row) and len(row[utc_mean_idx]) != 0:  # noqa
+                        UTC_Mean = row[utc_mean_idx]
+                        # rare case match if in HH:MM:SS format
+                        hhmmss_pattern = re.match(r'^(\d{2}):(\d{2}):(\d{2})$', UTC_Mean)
+                        if hhmmss_pattern:
+                            # take just the hour part
+                            UTC_End = hhmmss_pattern.group(1)
+                        elif utc_end_idx >= len(row) or len(row[utc_end_idx]) == 0:  # noqa
+                            UTC_End = UTC_Mean
+                            if "-" in UTC_End:
+                                if float(UTC_End) <= -1.5 and float(UTC_End) > -2:  # noqa
+                                    UTC_End = '-0'
+                                elif float(UTC_End) <= -1 and float(UTC_End) > -2:  # noqa
+                                    UTC_End = '00'
+                                elif float(UTC_End) >= -1:  # noqa
+                                    UTC_End = '00'
+                                elif float(UTC_End) <= -2 and float(UTC_End) >= -10:  # noqa
+                                    UTC_End = '-0'
+                                elif float(UTC_End) < -10 and float(UTC_End) >= -10.5:  # noqa
+                                    UTC_End = '-0'
                                 else:
-                                    LOGGER.debug(f"ColumnO3 value of {row[columno3_idx]} is invalid (empty, 0 or negative). Data ignored.")  # noqa
+                                    UTC_End = '-1'
+                            else:
+                                try:
+                                    UTC_End =  '%.0f' % round (float(UTC_End), 0)  # noqa
+                                    if int(UTC_End) in range(10):  # noqa
+                                        UTC_End = '0%s' % UTC_End  # noqa
+                                except Exception as err:
+                                    log.append(f"ERROR#E09:Could not round UTC_End value of: {UTC_End} in row {row}. Data row omitted\r\n")  # noqa
+                                    num_errors += 1
+                                    LOGGER.error('E09: Invalid UTC_End value. {}'.format(err))  # noqa
                                     write_output = 0
 
-                                # UTC_Begin processing
-                                if utc_begin_idx < len(row) and len(row[utc_begin_idx]) != 0:  # noqa
-                                    UTC_Begin = row[utc_begin_idx]
-                                    # rare case match if in HH:MM:SS format
-                                    hhmmss_pattern = re.match(r'^(\d{2}):(\d{2}):(\d{2})$', UTC_Begin)
-                                    if hhmmss_pattern:
-                                        # take just the hour part
-                                        UTC_Begin = hhmmss_pattern.group(1)
-                                    elif len(re.findall("[0-9]*", UTC_Begin)[0]) > 2:  # noqa
-                                        UTC_Begin = UTC_Begin[:2]
-                                    elif "-" in UTC_Begin:
-                                        if -1.5 >= float(UTC_Begin):
-                                            UTC_Begin = '-0'
-                                        else:
-                                            UTC_Begin = '00'
-                                    else:
-                                        try:
-                                            UTC_Begin = '%.0f' % round(float(UTC_Begin), 0)
-                                            if int(UTC_Begin) in range(10):
-                                                UTC_Begin = '0%s' % UTC_Begin
-                                        except Exception as err:
-                                            log_file.write(f"ERROR#E08:Could not round UTC_Begin value of: {UTC_Begin} in row {row}. Data row omitted\r\n")
-                                            num_errors += 1
-                                            LOGGER.error('E08: Invalid UTC_Begin value. {}'.format(err))
-                                            write_output = 0
-
-                                # UTC_End processing
-                                if utc_end_idx < len(row) and len(row[utc_end_idx]) != 0:  # noqa
-                                    UTC_End = row[utc_end_idx]
-                                    # rare case match if in HH:MM:SS format
-                                    hhmmss_pattern = re.match(r'^(\d{2}):(\d{2}):(\d{2})$', UTC_End)
-                                    if hhmmss_pattern:
-                                        # take just the hour part
-                                        UTC_End = hhmmss_pattern.group(1)
-                                    if len(re.findall("[0-9]*", UTC_End)[0]) > 2:  # noqa
-                                        UTC_End = UTC_End[:2]
-                                    elif "-" in UTC_End:
-                                        if -1.5 >= float(UTC_End):
-                                            UTC_End = '-0'
-                                        else:
-                                            UTC_End = '00'
-                                    else:
-                                        try:
-                                            UTC_End = '%.0f' % round(float(UTC_End), 0)
-                                            if int(UTC_End) in range(10):
-                                                UTC_End = '0%s' % UTC_End
-                                        except Exception as err:
-                                            log_file.write(f"ERROR#E09:Could not round UTC_End value of: {UTC_End} in row {row}. Data row omitted\r\n")
-                                            num_errors += 1
-                                            LOGGER.error('E09: Invalid UTC_End value. {}'.format(err))
-                                            write_output = 0
-
-                                # UTC_Mean processing (and fallback for UTC_End)
-                                if utc_mean_idx < len(row) and len(row[utc_mean_idx]) != 0:  # noqa
-                                    UTC_Mean = row[utc_mean_idx]
-                                    # rare case match if in HH:MM:SS format
-                                    hhmmss_pattern = re.match(r'^(\d{2}):(\d{2}):(\d{2})$', UTC_Mean)
-                                    if hhmmss_pattern:
-                                        # take just the hour part
-                                        UTC_End = hhmmss_pattern.group(1)
-                                    elif utc_end_idx >= len(row) or len(row[utc_end_idx]) == 0:  # noqa
-                                        UTC_End = UTC_Mean
-                                        if "-" in UTC_End:
-                                            if float(UTC_End) <= -1.5 and float(UTC_End) > -2:  # noqa
-                                                UTC_End = '-0'
-                                            elif float(UTC_End) <= -1 and float(UTC_End) > -2:  # noqa
-                                                UTC_End = '00'
-                                            elif float(UTC_End) >= -1:  # noqa
-                                                UTC_End = '00'
-                                            elif float(UTC_End) <= -2 and float(UTC_End) >= -10:  # noqa
-                                                UTC_End = '-0'
-                                            elif float(UTC_End) < -10 and float(UTC_End) >= -10.5:  # noqa
-                                                UTC_End = '-0'
-                                            else:
-                                                UTC_End = '-1'
-                                        else:
-                                            try:
-                                                UTC_End =  '%.0f' % round (float(UTC_End), 0)  # noqa
-                                                if int(UTC_End) in range(10):  # noqa
-                                                    UTC_End = '0%s' % UTC_End  # noqa
-                                            except Exception as err:
-                                                log_file.write(f"ERROR#E09:Could not round UTC_End value of: {UTC_End} in row {row}. Data row omitted\r\n")  # noqa
-                                                num_errors += 1
-                                                LOGGER.error('E09: Invalid UTC_End value. {}'.format(err))  # noqa
-                                                write_output = 0
-
-                                # nObs processing
-                                if nobs_idx < len(row) and len(row[nobs_idx]) != 0 and row[nobs_idx] != '-':
-                                    nObs = row[nobs_idx]
-                                    if len(nObs) > 2 and "-" not in nObs:
-                                        nObs = nObs[:2]
-                                    if len(row[6]) == 0 and len(row[7]) == 0 and nObs != '00' and row[8] != '0' and row[8] != '-1' and row[8] != '-2' and row[8] != '-3':  # noqa
-                                        UTC_End = nObs
-                                        if int(UTC_End) < -3 and int(UTC_End) >= -10:  # noqa
-                                            UTC_End = '-0'
-                                        if int(UTC_End) == -11:
-                                            UTC_End = '-1'
-                                        if len(UTC_End) == 1:
-                                            UTC_End = '0%s' % UTC_End  # noqa
-
-                                # Build output string
-                                if heading == 'off' or heading is None:
-                                    output_line = '%s%s%s%s%s%s%s%s%s%s%s%s' % (platform_id, year, month, day, UTC_Begin, UTC_End, WLCode, ObsCode, ColumnO3, ozone_std_error, inst_type_id, inst_number)
-                                else:
-                                    output_line_header = '%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s' % (platform_id, year, month, day, UTC_Begin, UTC_End, WLCode, ObsCode, ColumnO3, ozone_std_error, inst_type_id, inst_number)
-
-                                if write_output == 1 and ColumnO3 != '   ' and (heading == 'off' or heading is None):
-                                    if len(output_line) == 29:
-                                        data_file.write(f"{output_line}\r\n")
-                                        num_daily_rows_written += 1
-                                    else:
-                                        if len(output_line) > 29:
-                                            log_file.write(f"ERROR#E10:This output line: \'{output_line}\' exceeds 29 characters from row {row}. Data row omitted\r\n")
-                                        else:
-                                            log_file.write(f"ERROR#E11:This output line: \'{output_line}\' is less than 29 characters from row {row}. Data row omitted\r\n")
-                                        num_errors += 1
-
-                                if heading == 'on':
-                                    data_file.write(f"{output_line_header}\r\n")
-
-                                if write_output == 0:
-                                    LOGGER.debug(f"Output line was not written to master file for row {row} from file {filepath}\r\n")
-
-                                write_output = 1
-                    else:
-                        log_file.write(f"ERROR#E12:Could not find DAILY in input file: {filepath}. Data omitted\r\n")  # noqa
-                        num_errors += 1
-                except Exception as err:
-                    LOGGER.error(err)
-                    log_file.write(f"ERROR: Unable to process file: {filepath}\r\n{err}\r\n")  # noqa
-                    num_errors += 1
+                    # nObs processing
+                    if nobs_idx < len(row) and len(row[nobs_idx]) != 0 and row[nobs_idx] != '-':
+                        nObs = row[nobs_idx]
+                        if len(nObs) > 2 and "-" not in nObs:
+                            nObs = nObs[:2]
+                        if len(row[6]) == 0 and len(row[7]) == 0 and nObs != '00' and row[8] != '0' and row[8] != '-1' and row[8] != '-2' and row[8] != '-3':  # noqa
+                            UTC_End = nObs
+                            if int(UTC_End) < -3 and int(UTC_End) >= -10:  # noqa
+                                UTC_End = '-0'
+                            if int(UTC_End) == -11:
+                                UTC_End = '-1'
+                            if len(UTC_End) == 1:
+                                UTC_End = '0%s' % UTC_End  # noqa
+
+                    # Build output string
+                    if fixed:
+                        output_line = '%s%s%s%s%s%s%s%s%s%s%s%s' % (platform_id, year, month, day, UTC_Begin, UTC_End, WLCode, ObsCode, ColumnO3, ozone_std_error, inst_type_id, inst_number)
+                    if comma:
+                        output_line_header = '%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s' % (platform_id, year, month, day, UTC_Begin, UTC_End, WLCode, ObsCode, ColumnO3, ozone_std_error, inst_type_id, inst_number)
+
+                    if write_output == 1 and ColumnO3 != '   ' and fixed:
+                        if len(output_line) == 29:
+                            output.append(f"{output_line}\r\n")
+                            num_daily_rows_written += 1
+                        else:
+                            if len(output_line) > 29:
+                                log.append(f"ERROR#E10:This output line: \'{output_line}\' exceeds 29 characters from row {row}. Data row omitted\r\n")
+                            else:
+                                log.append(f"ERROR#E11:This output line: \'{output_line}\' is less than 29 characters from row {row}. Data row omitted\r\n")
+                            num_errors += 1
+
+                    if comma:
+                        csv_output.append(f"{output_line_header}\r\n")
+
+                    if write_output == 0:
+                        LOGGER.debug(f"Output line was not written to master file for row {row} from file {filepath}\r\n")
+
+                    write_output = 1
+        else:
+            log.append(f"ERROR#E12:Could not find DAILY in input file: {filepath}. Data omitted\r\n")  # noqa
+            num_errors += 1
+    except Exception as err:
+        LOGGER.error(err)
+        log.append(f"ERROR: Unable to process file: {filepath}\r\n{err}\r\n")  # noqa
+        num_errors += 1
+
+    log.append(summary_line(filepath, num_daily_rows_written, num_errors))
+
+    if formats is None:
+        return ''.join(log), output if fixed else csv_output
+    outputs = {}
+    for name in formats:
+        if name == 'fixed':
+            outputs[name] = output
+        elif name == 'csv':
+            outputs[name] = csv_output
+        elif name == 'platform':
+            outputs[name] = {platform_id.strip() or 'unknown': output}
+    return ''.join(log), outputs
+
+
+def _ascii_digits(values):
+    """
+    Mask of non-empty strings of ASCII digits only (np.char.isdigit also
+    accepts other Unicode digits)
+    """
+
+    nonempty = np.char.str_len(values) > 0
+    return nonempty & (np.char.strip(values, '0123456789') == '')
+
+
+def _plain_decimals(values):
+    """
+    Mask of non-negative plain decimal strings (e.g. '12', '7.25', '.5')
+    together with their parsed values (0 where masked out)
+    """
+
+    mask = _ascii_digits(np.char.replace(values, '.', '', count=1))
+    numbers = np.where(mask, values, '0').astype(np.float64)
+    return mask, numbers
+
+
+def _hours(values, truncate=True):
+    """
+    Vectorised UTC hour normalisation of plain decimal hours, matching the
+    row by row logic: values with more than two integer digits are
+    truncated to their first two characters, others are rounded and
+    zero-padded to two digits.
+
+    :returns: tuple of (formatted hours, mask of values handled)
+    """
+
+    mask, numbers = _plain_decimals(values)
+    rounded = np.rint(numbers).astype(np.int64)
+    formatted = np.char.zfill(rounded.astype(str), 2)
+    mask &= rounded < 100
+    if truncate:
+        dot = np.char.find(values, '.')
+        int_digits = np.where(dot < 0, np.char.str_len(values), dot)
+        long_ = int_digits > 2
+        formatted = np.where(long_, values.astype('<U2'), formatted)
+        mask |= long_ & _ascii_digits(
+            np.char.replace(values, '.', '', count=1))
+    return formatted, mask
+
+
+def format_daily_rows(rows, col_map, platform_id, inst_name, inst_type_id,
+                      inst_number, with_csv=False):
+    """
+    Formats the common case of DAILY rows into fixed-width master file
+    lines as vectorised column operations
+
+    Rows needing special handling (HH:MM:SS or negative times, the nObs
+    fallback, code lookups in resource.cfg, values raising errors or
+    warnings) are left to the row by row logic of process_file.
+
+    :param rows: DAILY rows, normalized to the header length
+    :param col_map: mapping of DAILY column names to indices
+    :param platform_id: formatted platform id
+    :param inst_name: instrument name
+    :param inst_type_id: formatted instrument type id
+    :param inst_number: formatted instrument number
+    :param with_csv: also return the comma separated lines
+    :returns: list of master file lines (`None` for rows not handled),
+              or tuple of fixed-width and comma separated lists if
+              with_csv
+    """
+
+    try:
+        table = np.array(rows, dtype=str)
+        if table.ndim != 2:
+            return [None] * len(rows)
+        num_columns = table.shape[1]
+        empty = np.full(len(rows), '', dtype=table.dtype)
+
+        def column(name, default):
+            idx = col_map.get(name, default)
+            return table[:, idx] if idx < num_columns else empty
+
+        first = table[:, 0]
+        date = column('Date', 0)
+        wlcode = column('WLCode', 1)
+        obscode = column('ObsCode', 2)
+        columno3 = column('ColumnO3', 3)
+        utc_begin = column('UTC_Begin', 5)
+        utc_end = column('UTC_End', 6)
+        utc_mean = column('UTC_Mean', 7)
+        nobs = column('nObs', 8)
+
+        # date
+        simple = (first != '') & (np.char.find(first, '*') < 0)
+        simple &= np.char.count(date, '-') == 2
+        year, _, rest = np.char.partition(date, '-').T
+        month, _, day = np.char.partition(rest, '-').T
+        month = np.char.zfill(month, 2)
+        day = np.char.zfill(day, 2)
+
+        # WLCode: single character or instrument default
+        default_wlcode = ' '
+        if inst_name in ['Dobson', 'Brewer', 'Filter', 'Microtops']:
+            default_wlcode = util.get_config_value('WLCode', inst_name)
+        wlcode_len = np.char.str_len(wlcode)
+        simple &= wlcode_len <= 1
+        wlcode = np.where(wlcode_len == 0, default_wlcode, wlcode)
+
+        # ObsCode: single digit or default
+        obscode_len = np.char.str_len(obscode)
+        simple &= (obscode_len == 0) | (
+            (obscode_len == 1) & np.char.isdigit(obscode))
+        obscode = np.where(obscode_len == 0, '9', obscode)
+
+        # ColumnO3: rounded to whole DU, between 1 and 999
+        o3_mask, o3_numbers = _plain_decimals(columno3)
+        o3_rounded = np.rint(o3_numbers).astype(np.int64)
+        simple &= o3_mask & (columno3 != '0') & (columno3 != '0.0')
+        simple &= (o3_rounded >= 1) & (o3_rounded <= 999)
+        columno3 = np.char.rjust(o3_rounded.astype(str), 3)
+
+        # UTC_Begin
+        begin, begin_mask = _hours(utc_begin)
+        begin_empty = utc_begin == ''
+        simple &= begin_empty | begin_mask
+        begin = np.where(begin_empty, '  ', begin)
+
+        # UTC_End, falling back to UTC_Mean when empty
+        end, end_mask = _hours(utc_end)
+        mean, mean_mask = _hours(utc_mean, truncate=False)
+        end_empty = utc_end == ''
+        mean_empty = utc_mean == ''
+        simple &= np.char.find(utc_mean, ':') < 0
+        simple &= np.where(end_empty, mean_empty | mean_mask, end_mask)
+        end = np.where(end_empty, np.where(mean_empty, '  ', mean), end)
+
+        # nObs replaces UTC_End in rare cases, leave those row by row
+        nobs_set = (nobs != '') & (nobs != '-')
+        if num_columns > 8:
+            nobs2 = np.where(
+                (np.char.str_len(nobs) > 2) & (np.char.find(nobs, '-') < 0),
+                nobs.astype('<U2'), nobs)
+            replaced = nobs_set & (table[:, 6] == '') & (table[:, 7] == '')
+            replaced &= nobs2 != '00'
+            replaced &= ~np.isin(table[:, 8], ['0', '-1', '-2', '-3'])
+            simple &= ~replaced
+        else:
+            simple &= ~nobs_set
+
+        fields = [month, day, begin, end, wlcode, obscode, columno3]
+        lines = np.char.add(platform_id, year)
+        for field in fields:
+            lines = np.char.add(lines, field)
+        lines = np.char.add(lines, '   %s%s' % (inst_type_id, inst_number))
+        simple &= np.char.str_len(lines) == 29
+        if with_csv:
+            csv_lines = np.char.add('%s,' % platform_id, year)
+            for field in fields:
+                csv_lines = np.char.add(np.char.add(csv_lines, ','), field)
+            csv_lines = np.char.add(
+                csv_lines, ',   ,%s,%s' % (inst_type_id, inst_number))
+    except Exception as err:
+        LOGGER.debug('Bulk DAILY formatting not possible: {}'.format(err))
+        if with_csv:
+            return [None] * len(rows), [None] * len(rows)
+        return [None] * len(rows)
+
+    if with_csv:
+        return (np.where(simple, lines, None).tolist(),
+                np.where(simple, csv_lines, None).tolist())
+    return np.where(simple, lines, None).tolist()
+
+
+def summary_line(filepath, num_daily_rows_written, num_errors):
+    """closing processing log line of a file"""
+
+    if (num_errors > 0):
+        return f"DONE ({num_daily_rows_written} DAILY rows) but with {num_errors} errors: {filepath}\r\n\r\n"  # noqa
+    else:
+        return f"SUCCESS ({num_daily_rows_written} DAILY rows): {filepath}\r\n\r\n"  # noqa
+
+
+def file_digest(filepath, blocksize=1048576):
+    """SHA-256 hex digest of a file's content"""
+
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as ff:
+        for block in iter(lambda: ff.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def source_digest(filepath, archive=None, member=None):
+    """SHA-256 hex digest of an input file or zip archive member"""
+
+    if archive is None:
+        return file_digest(filepath)
+    return hashlib.sha256(open_archive(archive).read(member)).hexdigest()
+
+
+def walk_order_key(name):
+    """
+    Sort key placing archive member names in os.walk order, i.e. the
+    files of a directory before the content of its subdirectories
+    """
+
+    parts = name.split('/')
+    return [(1, part) for part in parts[:-1]] + [(0, parts[-1])]
+
+
+def directory_entries(path, file_filter=None, workers=util.SCAN_WORKERS):
+    """
+    Lists the files of a directory tree in sorted os.walk order
+
+    :param path: top directory
+    :param file_filter: MasterFileFilter whose excluded directories are
+                        not descended into
+    :param workers: number of threads listing directories
+    :returns: generator of (filepath, member, size, mtime, error) tuples
+    """
+
+    accept_directory = None
+    if file_filter is not None:
+        accept_directory = file_filter.accept_directory
+    for filepath, size, mtime, error in util.scan_directory(
+            path, workers, accept_directory):
+        yield filepath, None, size, mtime, error
+
+
+def archive_entries(path, file_filter=None):
+    """
+    Lists the files of a zip archive in the order os.walk would visit
+    them once extracted
+
+    :param path: path to zip archive
+    :param file_filter: MasterFileFilter whose excluded directories are
+                        left out
+    :returns: generator of (filepath, member, size, mtime, error) tuples
+    """
+
+    infos = [info for info in open_archive(path).infolist()
+             if not info.is_dir()]
+    if file_filter is not None:
+        infos = [info for info in infos if file_filter.accept_directory(
+            os.path.dirname(info.filename))]
+    infos.sort(key=lambda info: walk_order_key(info.filename))
+    for info in infos:
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        yield (os.path.join(path, info.filename), info.filename,
+               info.file_size, mtime, None)
+
+
+def open_archive(path):
+    """
+    Opens a zip archive once per process
+
+    Handles are not shared with forked worker processes, whose reads
+    would otherwise move the parent's file offset.
+    """
+
+    key = (os.getpid(), path)
+    if key not in _ARCHIVES:
+        _ARCHIVES[key] = zipfile.ZipFile(path)
+    return _ARCHIVES[key]
+
+
+def close_archives():
+    """Closes zip archives opened by this process"""
+
+    pid = os.getpid()
+    for key in [key for key in _ARCHIVES if key[0] == pid]:
+        _ARCHIVES.pop(key).close()
+
+
+def month_range(year, month):
+    """
+    :returns: tuple of first and last day (YYYY-MM-DD) of a month
+    """
+
+    last_day = calendar.monthrange(int(year), int(month))[1]
+    return ('%s-%s-01' % (year, month),
+            '%s-%s-%02d' % (year, month, last_day))
+
+
+class MasterFileFilter(object):
+    """
+    Selects Total Ozone Master File input files by platform, instrument
+    and date range
+
+    Files are classified from their path in the WOUDC archive layout
+    (stnNNN/<instrument>/<year>/YYYYMM01.Instrument.Model.Number.Agency.csv),
+    so whole station, instrument and year directories are skipped during
+    the walk.  Only a file whose path leaves a filtered attribute unknown
+    is opened, and then only its PLATFORM, INSTRUMENT and TIMESTAMP
+    tables are read.
+
+    The date of a file name (or of the TIMESTAMP table) is taken as the
+    month of the file's observations: a file is selected when that month
+    overlaps the date range.
+    """
+
+    def __init__(self, platforms=None, instruments=None, start_date=None,
+                 end_date=None):
+        """
+        :param platforms: platform ids to select (e.g. '065', 77)
+        :param instruments: instrument names to select, case insensitive
+        :param start_date: first date to select (YYYY-MM-DD)
+        :param end_date: last date to select (YYYY-MM-DD)
+        """
+
+        self.platforms = None
+        if platforms is not None:
+            self.platforms = set(str(platform).strip().zfill(3)
+                                 for platform in platforms)
+        self.instruments = None
+        if instruments is not None:
+            self.instruments = set(instrument.strip().lower()
+                                   for instrument in instruments)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.selected = 0
+        self.skipped = 0
+        self.header_reads = 0
+
+    @staticmethod
+    def classify(relpath, directory=False):
+        """
+        Classify a file or directory from its path
+
+        :param relpath: path relative to the top of the archive
+        :param directory: relpath is a directory
+        :returns: dict of the attributes found: 'platform', 'instrument'
+                  (lower case), 'first' and 'last' date (YYYY-MM-DD)
+        """
+
+        parts = [part for part in re.split(r'[\\/]', relpath)
+                 if part not in ('', '.')]
+        filename = None
+        if not directory and parts:
+            filename = parts.pop()
+
+        info = {}
+        station_index = None
+        for index, part in enumerate(parts):
+            station = STATION_DIRECTORY.match(part)
+            year = YEAR_DIRECTORY.match(part)
+            if station is not None:
+                info['platform'] = station.group(1).zfill(3)
+                station_index = index
+            elif station_index is not None and index == station_index + 1:
+                info['instrument'] = part.lower()
+            elif year is not None:
+                info['first'] = '%s-01-01' % year.group(1)
+                info['last'] = '%s-12-31' % year.group(1)
+
+        if filename is not None:
+            name = EXTCSV_FILENAME.match(filename)
+            if name is not None and 1 <= int(name.group(2)) <= 12:
+                info['first'], info['last'] = month_range(name.group(1),
+                                                          name.group(2))
+                info['instrument'] = name.group(3).lower()
+        return info
+
+    def match(self, info):
+        """
+        Test attributes against the filters
 
-                if (num_errors > 0):
-                    log_file.write(f"DONE ({num_daily_rows_written} DAILY rows) but with {num_errors} errors: {filepath}\r\n\r\n")
+        :param info: dict of attributes as returned by classify
+        :returns: `True` if selected, `False` if not, `None` if an
+                  attribute needed to decide is unknown
+        """
+
+        checks = []
+        if self.platforms is not None:
+            platform = info.get('platform')
+            checks.append(None if platform is None
+                          else platform in self.platforms)
+        if self.instruments is not None:
+            instrument = info.get('instrument')
+            checks.append(None if instrument is None
+                          else instrument in self.instruments)
+        if self.start_date is not None or self.end_date is not None:
+            if info.get('first') is None:
+                checks.append(None)
+            else:
+                after_start = self.start_date is None \
+                    or info['last'] >= self.start_date
+                before_end = self.end_date is None \
+                    or info['first'] <= self.end_date
+                checks.append(after_start and before_end)
+        if False in checks:
+            return False
+        if None in checks:
+            return None
+        return True
+
+    def accept_directory(self, relpath):
+        """
+        :param relpath: directory path relative to the top of the archive
+        :returns: `False` if no file below the directory can be selected
+        """
+
+        return self.match(self.classify(relpath, directory=True)) is not False
+
+    def accept(self, relpath, filepath, archive=None, member=None):
+        """
+        Decide whether an input file is selected, reading its header only
+        when its path cannot be classified
+
+        :param relpath: file path relative to the top of the archive
+        :param filepath: path to ext-CSV file
+        :param archive: path to zip archive to read member from
+        :param member: archive member name of the ext-CSV file
+        :returns: `True` if the file is selected (or unreadable, leaving
+                  the error to processing), else `False`
+        """
+
+        info = self.classify(relpath)
+        selected = self.match(info)
+        if selected is None:
+            header = self.read_header(filepath, archive, member)
+            header.update(info)
+            selected = self.match(header)
+        if selected is False:
+            self.skipped += 1
+            return False
+        self.selected += 1
+        return True
+
+    def read_header(self, filepath, archive=None, member=None):
+        """
+        Classify a file from its PLATFORM, INSTRUMENT and TIMESTAMP tables
+
+        :param filepath: path to ext-CSV file
+        :param archive: path to zip archive to read member from
+        :param member: archive member name of the ext-CSV file
+        :returns: dict of the attributes found, see classify
+        """
+
+        self.header_reads += 1
+        try:
+            if archive is not None:
+                with open_archive(archive).open(member) as stream:
+                    extcsv = util.WOUDCextCSVReader(
+                        filepath, stream, tables=HEADER_TABLES,
+                        early_exit=True)
+            else:
+                extcsv = util.WOUDCextCSVReader(
+                    filepath, tables=HEADER_TABLES, early_exit=True)
+        except Exception as err:
+            LOGGER.warning('Unable to read header of {}: {}'.format(filepath, err))  # noqa
+            return {}
+
+        info = {}
+        sections = extcsv.sections
+        platform_id = sections.get('PLATFORM', {}).get('ID')
+        if platform_id:
+            info['platform'] = platform_id.strip().zfill(3)
+        inst_name = sections.get('INSTRUMENT', {}).get('Name')
+        if inst_name:
+            info['instrument'] = inst_name.strip().lower()
+        date = sections.get('TIMESTAMP', {}).get('Date') or ''
+        date = re.match(r'^(\d{4})-(\d{2})-\d{2}', date.strip())
+        if date is not None and 1 <= int(date.group(2)) <= 12:
+            info['first'], info['last'] = month_range(date.group(1),
+                                                      date.group(2))
+        return info
+
+
+class MasterFileOutput(object):
+    """
+    Output products of one Total Ozone Master File run
+
+    When overwriting, lines are streamed straight into the deflate
+    stream of their zip file entry (and into any uncompressed or gzip
+    copy).  When appending, and for the per-platform product whose
+    members are written interleaved, lines go to data files that are
+    compressed when the run closes.
+    """
+
+    def __init__(self, directory, mode, heading=None, formats=None,
+                 compresslevel=None, extras=()):
+        """
+        Open output streams
+
+        :param directory: output directory
+        :param mode: 'overwrite', else data files are appended to
+        :param heading: 'on' to start comma separated output with a
+                        heading row (single product runs)
+        :param formats: products to write (see PRODUCTS), None for the
+                        single product selected by heading, written as
+                        o3tot.dat in o3tot.zip
+        :param compresslevel: deflate/gzip compression level (0-9),
+                              None for the library defaults
+        :param extras: additional copies of every data file: 'plain'
+                       (kept uncompressed) and/or 'gzip' (.gz)
+        """
+        self.directory = directory
+        self.stream = mode == 'overwrite'
+        self.file_mode = 'w+' if self.stream else 'a+'
+        self.formats = formats
+        self.compresslevel = compresslevel
+        self.extras = extras
+        self.sinks = {}
+        self.archives = []
+        self.data_files = []
+        self.gzipped = set()
+        self.zips = []
+        self.platform_members = None
+
+        if formats is None:
+            self.open('o3tot.dat', 'o3tot.zip', heading == 'on')
+        else:
+            for name in formats:
+                filename, zip_filename = PRODUCTS[name]
+                if filename is None:
+                    self.platform_members = []
+                    self.zips.append((zip_filename, self.platform_members))
                 else:
-                    log_file.write(f"SUCCESS ({num_daily_rows_written} DAILY rows): {filepath}\r\n\r\n")
+                    self.open(filename, zip_filename, name == 'csv')
 
-        # data file close
-        data_file.close()
+    def open(self, filename, zip_filename=None, heading=False):
+        """
+        Open the output streams of a data file
 
-        # zip data file
-        out_zip = zipfile.ZipFile(os.path.join(master_file, 'o3tot.zip'), 'w',
-                                  zipfile.ZIP_DEFLATED)
-        out_zip.write(tmp_filename, 'o3tot.dat')
-        out_zip.close()
+        :param filename: data file name, also its name in the zip file
+        :param zip_filename: zip file name, None when the data file is
+                             a member of a zip file built on close
+        :param heading: start with the comma separated heading row
+        """
+        path = os.path.join(self.directory, filename)
+        sinks = []
+        if self.stream and zip_filename is not None:
+            archive = zipfile.ZipFile(
+                os.path.join(self.directory, zip_filename), 'w',
+                zipfile.ZIP_DEFLATED, compresslevel=self.compresslevel)
+            self.archives.append(archive)
+            sinks.append(TextIOWrapper(archive.open(filename, 'w'),
+                                       newline=''))
+            if 'plain' in self.extras:
+                sinks.append(open(path, 'w'))
+            if 'gzip' in self.extras:
+                sinks.append(self.open_gzip(path, 'wt'))
+                self.gzipped.add(filename)
+        else:
+            sinks.append(open(path, self.file_mode))
+            self.data_files.append(filename)
+            if zip_filename is not None:
+                self.zips.append((zip_filename, [filename]))
+        if heading:
+            for sink in sinks:
+                sink.write(HEADING_ROW)
+        self.sinks[filename] = sinks
 
-        os.remove(tmp_filename)
+    def open_gzip(self, path, mode):
+        """
+        :param path: path of the uncompressed data file
+        :param mode: 'wt' (text) or 'wb' (binary)
+        :returns: stream writing path.gz
+        """
+        kwargs = {}
+        if mode == 'wt':
+            kwargs['newline'] = ''
+        if self.compresslevel is not None:
+            kwargs['compresslevel'] = self.compresslevel
+        return gzip.open('%s.gz' % path, mode, **kwargs)
 
-        if zip_flag:
-            shutil.rmtree(tmpdir)
+    def write(self, lines):
+        """
+        Write the output of one input file
 
-        # log file close
-        log_file.close()
-        LOGGER.info('log file is located here: {}'.format(os.path.abspath('totalOzone_processing_log_{}'.format(current_time))))  # noqa
+        :param lines: list of lines, or dict of lines by format as
+                      returned by process_file with formats
+        """
+        if self.formats is None:
+            for sink in self.sinks['o3tot.dat']:
+                sink.writelines(lines)
+            return
+        for name in self.formats:
+            if name == 'platform':
+                for platform_id, platform_lines in lines[name].items():
+                    filename = PLATFORM_FILENAME % platform_id
+                    if filename not in self.sinks:
+                        self.open(filename)
+                        self.platform_members.append(filename)
+                    for sink in self.sinks[filename]:
+                        sink.writelines(platform_lines)
+            else:
+                for sink in self.sinks[PRODUCTS[name][0]]:
+                    sink.writelines(lines[name])
+
+    def close(self):
+        """Close output streams, compress and remove data files"""
+        for sinks in self.sinks.values():
+            for sink in sinks:
+                sink.close()
+        for archive in self.archives:
+            archive.close()
+
+        for zip_filename, members in self.zips:
+            out_zip = zipfile.ZipFile(
+                os.path.join(self.directory, zip_filename), 'w',
+                zipfile.ZIP_DEFLATED, compresslevel=self.compresslevel)
+            for member in sorted(members):
+                out_zip.write(os.path.join(self.directory, member), member)
+            out_zip.close()
+
+        for filename in self.data_files:
+            path = os.path.join(self.directory, filename)
+            if 'gzip' in self.extras and filename not in self.gzipped:
+                with open(path, 'rb') as ff, self.open_gzip(path, 'wb') as gz:  # noqa
+                    shutil.copyfileobj(ff, gz)
+            if 'plain' not in self.extras:
+                os.remove(path)
+
+
+def shard_index(relpath, count):
+    """
+    Deterministic partition of an input file in a sharded run
+
+    :param relpath: input file path relative to the top of the archive,
+                    with '/' separators
+    :param count: number of partitions
+    :returns: partition index, 0 to count - 1
+    """
+
+    digest = hashlib.sha1(relpath.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % count
+
+
+class MasterFileShard(object):
+    """
+    Output of one partition of a sharded Total Ozone Master File run
+
+    A JSON lines file: a header with the partition and output layout,
+    then one entry per input file in walk order with its relative path,
+    processing log text and output lines.
+    """
+
+    def __init__(self, filepath, shard, heading=None, formats=None):
+        """
+        Open shard file (written under a temporary name until closed)
+
+        :param filepath: path to shard file
+        :param shard: tuple of (index, count)
+        :param heading: master file heading mode of the run
+        :param formats: products of the run, see PRODUCTS
+        """
+
+        self.filepath = filepath
+        self.tmp_filepath = '{}.tmp'.format(filepath)
+        self.stream = open(self.tmp_filepath, 'w', encoding='utf-8')
+        self.stream.write(json.dumps({
+            'shard': list(shard),
+            'heading': heading,
+            'formats': None if formats is None else list(formats)
+        }) + '\n')
+
+    def store(self, relpath, log_text, lines):
+        """
+        Record one input file
+
+        :param relpath: input file path relative to the top of the archive
+        :param log_text: processing log text of the file
+        :param lines: output lines, as given to MasterFileOutput.write,
+                      or `None` when the file could not be read
+        """
+
+        self.stream.write(json.dumps({
+            'path': relpath,
+            'log': log_text,
+            'lines': lines
+        }) + '\n')
+
+    def close(self):
+        """Close shard file"""
+
+        self.stream.close()
+        os.replace(self.tmp_filepath, self.filepath)
 
     @staticmethod
-    def normalize_csv_row(row, expected_length):
+    def load(filepath):
         """
-        Ensure row has the expected number of elements.
-        Pads with empty strings if too short, truncates if too long.
+        Read a shard file
+
+        :param filepath: path to shard file
+        :returns: tuple of (header dict, generator of entry dicts)
         """
-        if len(row) < expected_length:
-            row.extend([''] * (expected_length - len(row)))
-        elif len(row) > expected_length:
-            row = row[:expected_length]
-        return row
+
+        stream = open(filepath, encoding='utf-8')
+        try:
+            header = json.loads(stream.readline())
+        except ValueError:
+            stream.close()
+            raise ValueError('{} is not a master file shard'.format(filepath))  # noqa
+
+        def entries():
+            with stream:
+                for line in stream:
+                    yield json.loads(line)
+
+        return header, entries()
+
+
+class MasterFileManifest(object):
+    """
+    Persistent per-file cache of processed Total Ozone Master File output
+
+    Entries are keyed by input file path and record the file's size,
+    mtime and SHA-256 digest together with its processing log block and
+    formatted output lines.  A file whose size and mtime are unchanged
+    is reused as is; a file whose mtime changed but whose content hash
+    did not is reused as well.  The whole manifest is discarded when the
+    output layout (heading) or resource.cfg changes.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filepath, heading=None):
+        """
+        Load manifest from disk if present and still valid
+
+        :param filepath: path to manifest (JSON) file
+        :param heading: master file heading mode of this run
+        """
+
+        self.filepath = filepath
+        self.header = {
+            'version': self.VERSION,
+            'heading': heading,
+            'config': file_digest(util.get_config_filepath())
+        }
+        self.entries = {}
+        self.current = {}
+        self.hits = 0
+
+        if os.path.exists(filepath):
+            try:
+                with open(filepath, encoding='utf-8') as ff:
+                    content = json.load(ff)
+                if content.get('header') == self.header:
+                    self.entries = content['files']
+                else:
+                    LOGGER.info('Manifest {} is stale, ignoring'.format(filepath))  # noqa
+            except (ValueError, KeyError) as err:
+                LOGGER.warning('Unable to read manifest {}: {}'.format(filepath, err))  # noqa
+
+    def lookup(self, filepath, size, mtime, digest=None):
+        """
+        Find a reusable entry for an input file
+
+        :param filepath: path to ext-CSV file
+        :param size: file size in bytes
+        :param mtime: file modification time
+        :param digest: callable returning the file's SHA-256 hex digest,
+                       only called when the mtime changed
+        :returns: tuple of (log text, output lines), or `None`
+        """
+
+        entry = self.entries.get(filepath)
+        if entry is None or entry['size'] != size:
+            return None
+        if entry['mtime'] != mtime:
+            if digest is None:
+                digest = partial(file_digest, filepath)
+            if digest() != entry['sha256']:
+                return None
+            entry['mtime'] = mtime
+
+        self.current[filepath] = entry
+        self.hits += 1
+        return entry['log'], entry['lines']
+
+    def store(self, filepath, size, mtime, log_text, lines, digest=None):
+        """
+        Record processing output of an input file
+
+        :param filepath: path to ext-CSV file
+        :param size: file size in bytes
+        :param mtime: file modification time
+        :param log_text: processing log text of the file
+        :param lines: formatted output lines of the file
+        :param digest: SHA-256 hex digest of the file (computed if `None`)
+        """
+
+        if digest is None:
+            digest = file_digest(filepath)
+
+        self.current[filepath] = {
+            'size': size,
+            'mtime': mtime,
+            'sha256': digest,
+            'log': log_text,
+            'lines': lines
+        }
+
+    def save(self):
+        """Write manifest to disk, keeping only files seen in this run"""
+
+        tmp_filepath = '{}.tmp'.format(self.filepath)
+        with open(tmp_filepath, 'w', encoding='utf-8') as ff:
+            json.dump({'header': self.header, 'files': self.current}, ff)
+        os.replace(tmp_filepath, self.filepath)
+        LOGGER.info('Manifest saved: {} files, {} reused'.format(len(self.current), self.hits))  # noqa
+
+
+class MasterFileReader(object):
+    """
+    Random access reader of a fixed-width Total Ozone Master File
+
+    o3tot.dat is memory-mapped (or read out of o3tot.zip) and viewed as
+    an array of 29 character records plus CRLF.  An index of record
+    numbers sorted by platform id and date answers range queries with a
+    binary search, after which each record is read at its own offset.
+    """
+
+    RECORD_LENGTH = 31
+
+    # field name, offset, width of a master file record
+    FIELDS = (
+        ('platform', 0, 3),
+        ('year', 3, 4),
+        ('month', 7, 2),
+        ('day', 9, 2),
+        ('utc_begin', 11, 2),
+        ('utc_end', 13, 2),
+        ('wlcode', 15, 1),
+        ('obscode', 16, 1),
+        ('columno3', 17, 3),
+        ('ozone_std_error', 20, 3),
+        ('instrument_type', 23, 2),
+        ('instrument_number', 25, 4)
+    )
+
+    # fields decoded as integers, blanks become -1
+    INTEGER_FIELDS = ('year', 'month', 'day', 'columno3',
+                      'instrument_number')
+
+    # record bytes and sort key (platform id and YYYYMMDD)
+    DTYPE = np.dtype({
+        'names': ['record', 'key'] + [field[0] for field in FIELDS],
+        'formats': ['S29', 'S11'] + ['S%d' % field[2] for field in FIELDS],
+        'offsets': [0, 0] + [field[1] for field in FIELDS],
+        'itemsize': RECORD_LENGTH
+    })
+
+    def __init__(self, filepath, member='o3tot.dat'):
+        """
+        Open a master file
+
+        :param filepath: path to o3tot.dat, or to o3tot.zip
+        :param member: name of the data file in a zip file
+        """
+
+        self.filepath = filepath
+        self.mmap = None
+        if zipfile.is_zipfile(filepath):
+            with zipfile.ZipFile(filepath) as archive:
+                buffer = archive.read(member)
+        else:
+            with open(filepath, 'rb') as ff:
+                if os.fstat(ff.fileno()).st_size == 0:
+                    buffer = b''
+                else:
+                    self.mmap = mmap.mmap(ff.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+                    buffer = self.mmap
+        if len(buffer) % self.RECORD_LENGTH != 0:
+            self.close()
+            raise ValueError('{} is not a fixed-width master file'.format(filepath))  # noqa
+        self.records = np.frombuffer(buffer, dtype=self.DTYPE)
+        self._order = None
+        self._keys = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    def close(self):
+        """Release the memory map"""
+
+        self.records = None
+        self._order = self._keys = None
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+    def index(self):
+        """
+        Build (once) the index of record numbers by platform id and date
+
+        :returns: tuple of (record numbers, sorted keys)
+        """
+
+        if self._order is None:
+            keys = self.records['key']
+            self._order = np.argsort(keys, kind='stable')
+            self._keys = keys[self._order]
+        return self._order, self._keys
+
+    @staticmethod
+    def key(platform, date):
+        """
+        :param platform: platform id
+        :param date: date (YYYY-MM-DD)
+        :returns: index key of platform and date
+        """
+
+        return ('%s%s' % (str(platform).strip().zfill(3),
+                          date.replace('-', ''))).encode('ascii')
+
+    def platforms(self):
+        """
+        :returns: sorted list of platform ids in the master file
+        """
+
+        _, keys = self.index()
+        return [platform.decode('latin-1')
+                for platform in np.unique(keys.astype('S3'))]
+
+    def positions(self, platform, start_date=None, end_date=None):
+        """
+        Find the records of a platform within a date range
+
+        :param platform: platform id (e.g. '065')
+        :param start_date: first date (YYYY-MM-DD), default unbounded
+        :param end_date: last date (YYYY-MM-DD), default unbounded
+        :returns: array of record numbers in date order (records of a
+                  date in master file order)
+        """
+
+        order, keys = self.index()
+        first = self.key(platform, start_date or '0000-00-00')
+        last = self.key(platform, end_date or '9999-99-99')
+        start = np.searchsorted(keys, first, side='left')
+        end = np.searchsorted(keys, last, side='right')
+        return order[start:end]
+
+    def query(self, platform, start_date=None, end_date=None):
+        """
+        Read the records of a platform within a date range
+
+        :param platform: platform id (e.g. '065')
+        :param start_date: first date (YYYY-MM-DD), default unbounded
+        :param end_date: last date (YYYY-MM-DD), default unbounded
+        :returns: dict of field name to array of decoded values (see
+                  FIELDS), plus 'record' numbers, in date order
+        """
+
+        return self.decode(self.positions(platform, start_date, end_date))
+
+    def decode(self, positions):
+        """
+        Decode records
+
+        :param positions: record numbers
+        :returns: dict of field name to array of decoded values, plus
+                  the 'record' numbers
+        """
+
+        records = self.records[positions]
+        fields = {'record': np.asarray(positions, dtype=np.int64)}
+        for name, _, width in self.FIELDS:
+            values = np.char.decode(records[name], 'latin-1')
+            if name in self.INTEGER_FIELDS:
+                values = np.char.strip(values)
+                values = np.where(values == '', '-1', values).astype(np.int64)  # noqa
+            fields[name] = values
+        return fields
+
+    def lines(self, positions):
+        """
+        :param positions: record numbers
+        :returns: list of master file lines (with CRLF)
+        """
+
+        return ['%s\r\n' % record.decode('latin-1')
+                for record in self.records['record'][positions]]
+
+
+def source_dates(filepath):
+    """
+    Date range of the master file records of an ext-CSV file
+
+    Files of an instrument are named after their first date (see
+    EXTCSV_FILENAME) and walked in name order, so in a master file the
+    records of a file run from its date up to the date of the next file
+    of the same instrument in its directory.
+
+    :param filepath: path to ext-CSV file
+    :returns: tuple of (first date, date of the next file or None) as
+              YYYYMMDD, or (None, None) when the name carries no date
+    """
+
+    directory, filename = os.path.split(filepath)
+    if EXTCSV_FILENAME.match(filename) is None:
+        return None, None
+    later = []
+    for sibling in os.listdir(directory or os.curdir):
+        if EXTCSV_FILENAME.match(sibling) is None:
+            continue
+        if sibling[8:].lower() == filename[8:].lower() \
+                and sibling[:8] > filename[:8]:
+            later.append(sibling[:8])
+    return filename[:8], min(later, default=None)
+
+
+def upsert_records(filepath, lines, start=None, end=None):
+    """
+    Replace the block of records of one file in a fixed-width master file
+
+    The block of the file is every record of its platform and instrument
+    dated from start up to (excluding) end, which removes records the
+    new lines drop or re-key.  The new lines are written in its place,
+    or, without a block, after the records of the same instrument dated
+    before start (before those dated from end, else appended).  The
+    index of MasterFileReader locates the records, and only the region
+    of the block is rewritten (with the rest of the file shifted when
+    the number of records changes).
+
+    :param filepath: path to o3tot.dat
+    :param lines: master file lines of one re-processed file
+    :param start: first date of the file's records (YYYYMMDD), default
+                  the first date of lines
+    :param end: date following the file's records (YYYYMMDD), default
+                the day after the last date of lines, see source_dates
+    :returns: tuple of (number of records removed, number written)
+    """
+
+    groups = {}
+    for line in lines:
+        line = line.encode('latin-1')
+        groups.setdefault(line[:3] + line[23:29], []).append(line)
+
+    removed = 0
+    for source, group in groups.items():
+        platform, instrument = source[:3], source[3:]
+        dates = sorted(line[3:11] for line in group)
+        low = platform + (dates[0] if start is None
+                          else min(dates[0], start.encode('ascii')))
+        with MasterFileReader(filepath) as reader:
+            size = len(reader)
+            candidates = reader.positions(platform.decode('latin-1'))
+            records = reader.records[candidates]
+            same = np.char.add(records['instrument_type'],
+                               records['instrument_number']) == instrument
+            candidates = candidates[same]
+            keys = records['key'][same]
+            if end is None:
+                inside = (keys >= low) & (keys <= platform + dates[-1])
+            else:
+                inside = (keys >= low) & (keys < platform + end.encode('ascii'))  # noqa
+            block = np.sort(candidates[inside])
+            kept = []
+            if len(block) > 0:
+                first, last = block[0], block[-1] + 1
+                region = np.arange(first, last)
+                others = region[~np.isin(region, block)]
+                if len(others) > 0:
+                    LOGGER.warning('{} records of other files within the block of {}'.format(len(others), source.decode('latin-1')))  # noqa
+                    kept = reader.lines(others)
+            elif np.any(keys < low):
+                first = last = candidates[keys < low].max() + 1
+            elif len(candidates) > 0:
+                first = last = candidates.min()
+            else:
+                first = last = size
+        removed += len(block)
+        data = b''.join(group) + ''.join(kept).encode('latin-1')
+        replace_region(filepath, first * MasterFileReader.RECORD_LENGTH,
+                       last * MasterFileReader.RECORD_LENGTH, data)
+    return removed, len(lines)
+
+
+def replace_region(filepath, start, end, data, blocksize=1048576):
+    """
+    Replace a byte range of a file, shifting what follows it in blocks
+
+    :param filepath: path to file
+    :param start: offset of the first byte replaced
+    :param end: offset following the last byte replaced
+    :param data: replacement bytes
+    :param blocksize: number of bytes moved at a time
+    """
+
+    with open(filepath, 'r+b') as ff:
+        size = os.fstat(ff.fileno()).st_size
+        shift = len(data) - (end - start)
+        if shift > 0:
+            # move the tail right, last block first
+            position = size
+            while position > end:
+                block_start = max(end, position - blocksize)
+                ff.seek(block_start)
+                block = ff.read(position - block_start)
+                ff.seek(block_start + shift)
+                ff.write(block)
+                position = block_start
+        elif shift < 0:
+            # move the tail left, first block first
+            position = end
+            while position < size:
+                ff.seek(position)
+                block = ff.read(min(blocksize, size - position))
+                ff.seek(position + shift)
+                ff.write(block)
+                position += len(block)
+            ff.truncate(size + shift)
+        ff.seek(start)
+        ff.write(data)
+
+
+def diff_key(record):
+    """
+    Join key of a master file record in the diff: platform id, date,
+    UTC_Begin hour, wavelength code, instrument type and number
+
+    :param record: fixed-width record (bytes, without CRLF)
+    :returns: key (bytes)
+    """
+
+    return record[0:13] + record[15:16] + record[23:29]
+
+
+def master_file_records(filepath, member='o3tot.dat'):
+    """
+    Streams the records of a fixed-width master file
+
+    :param filepath: path to o3tot.dat, or to o3tot.zip
+    :param member: name of the data file in a zip file
+    :returns: generator of records (bytes, without CRLF)
+    """
+
+    if zipfile.is_zipfile(filepath):
+        with zipfile.ZipFile(filepath) as archive, archive.open(member) as stream:  # noqa
+            yield from read_records(stream, filepath)
+    else:
+        with open(filepath, 'rb') as stream:
+            yield from read_records(stream, filepath)
+
+
+def read_records(stream, filepath):
+    """
+    :param stream: binary stream of master file lines
+    :param filepath: name of the stream in errors
+    :returns: generator of records (bytes, without CRLF)
+    """
+
+    for number, line in enumerate(stream, 1):
+        record = line.rstrip(b'\r\n')
+        if len(record) != MasterFileReader.RECORD_LENGTH - 2:
+            raise ValueError('{} line {} is not a fixed-width master file record'.format(filepath, number))  # noqa
+        yield record
+
+
+def sorted_records(filepath, run_size=1000000):
+    """
+    Streams the records of a master file in diff key order
+
+    Records are sorted in runs of run_size records; runs beyond the
+    first are spilled to temporary files and merged, so memory use is
+    bounded by run_size.  Master files already in key order cost one
+    linear pass.
+
+    :param filepath: path to o3tot.dat, or to o3tot.zip
+    :param run_size: number of records sorted in memory at a time
+    :returns: generator of records (bytes, without CRLF)
+    """
+
+    def sort_key(record):
+        return diff_key(record) + record
+
+    runs = []
+    try:
+        records = master_file_records(filepath)
+        while True:
+            run = sorted(islice(records, run_size), key=sort_key)
+            if not runs and len(run) < run_size:
+                yield from run
+                return
+            if not run:
+                break
+            spill = tempfile.TemporaryFile()
+            spill.write(b''.join(record + b'\n' for record in run))
+            spill.seek(0)
+            runs.append(spill)
+        yield from heapq.merge(
+            *[(line.rstrip(b'\n') for line in run) for run in runs],
+            key=sort_key)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def diff_master_files(old_filepath, new_filepath, delta_filepath,
+                      run_size=1000000):
+    """
+    Compares two versions of a fixed-width master file
+
+    Both files are streamed in diff key order (see diff_key and
+    sorted_records) and merge-joined.  Records present in both versions
+    cancel out; of the records left under a key, pairs are reported as
+    changed and the rest as removed or added.  Each line of the delta
+    file is an operation code and the record(s):
+
+    - '+' new record (added)
+    - '-' old record (removed)
+    - '~' old record followed by new record (changed)
+
+    :param old_filepath: previous o3tot.dat or o3tot.zip
+    :param new_filepath: current o3tot.dat or o3tot.zip
+    :param delta_filepath: path to delta file written
+    :param run_size: number of records sorted in memory at a time
+    :returns: dict of the number of records 'added', 'removed' and
+              'changed'
+    """
+
+    counts = {'added': 0, 'removed': 0, 'changed': 0}
+    old_groups = groupby(sorted_records(old_filepath, run_size), diff_key)
+    new_groups = groupby(sorted_records(new_filepath, run_size), diff_key)
+
+    with open(delta_filepath, 'wb') as delta:
+        def write(op, records):
+            counts[op] += 1
+            delta.write(b'%s%s\r\n' % (DIFF_OPS[op], b''.join(records)))
+
+        old_group = next(old_groups, None)
+        new_group = next(new_groups, None)
+        while old_group is not None or new_group is not None:
+            removed = []
+            added = []
+            old_first = new_group is None or (
+                old_group is not None and old_group[0] < new_group[0])
+            if old_first:
+                removed = list(old_group[1])
+                old_group = next(old_groups, None)
+            elif old_group is None or new_group[0] < old_group[0]:
+                added = list(new_group[1])
+                new_group = next(new_groups, None)
+            else:
+                removed = list(old_group[1])
+                for record in new_group[1]:
+                    if record in removed:
+                        removed.remove(record)
+                    else:
+                        added.append(record)
+                old_group = next(old_groups, None)
+                new_group = next(new_groups, None)
+            changed = min(len(removed), len(added))
+            for old_record, new_record in zip(removed, added):
+                write('changed', (old_record, new_record))
+            for record in removed[changed:]:
+                write('removed', (record,))
+            for record in added[changed:]:
+                write('added', (record,))
+
+    LOGGER.info('Master file diff: {added} added, {removed} removed, {changed} changed'.format(**counts))  # noqa
+    return counts
@@ -45,65 +45,663 @@
 # =================================================================
 """Utility module to support fetching data from WOUDC WAF or WFS"""
 
-import errno
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
 import logging
+import random
+import threading
 import time
 from time import strptime
 import operator
+import re
 import zipfile
+import numpy as np
 import requests
-from configparser import ConfigParser
+from configparser import ConfigParser, NoOptionError, NoSectionError
 import os
 import csv
 from woudc_extcsv import loads
+from pywoudc import WoudcClient
 from io import StringIO
-from socket import error as SocketError
-from urllib.parse import quote
-from urllib.request import urlopen
-from urllib.error import URLError
+from urllib.parse import quote, urlparse
 
 LOGGER = logging.getLogger(__name__)
 
 __DIRPATH = os.path.dirname(os.path.realpath(__file__))
 
+# encodings tried, in order, when reading Extended CSVs
+ENCODINGS = ('utf-8', 'iso-8859-1', 'windows-1252')
+
+# HTTP statuses worth retrying
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# threads listing directory trees, see scan_directory
+SCAN_WORKERS = 8
+
+
+def get_config_filepath():
+    """path to package resource.cfg"""
+    return os.path.join(__DIRPATH, 'resource.cfg')
+
+
+class ConfigIndex(object):
+    """
+    Parsed-once, in-memory index of a configuration file
+
+    Lookups behave like ConfigParser.get (case-insensitive keys,
+    NoSectionError/NoOptionError on misses) without touching the file.
+    """
+
+    def __init__(self, filepath, check_mtime=False):
+        """
+        Initialize index, parsing is deferred to the first lookup
+
+        :param filepath: path to configuration file
+        :param check_mtime: re-parse the file on lookup when its
+                            modification time changed
+        """
+        self.filepath = filepath
+        self.check_mtime = check_mtime
+        self.sections = None
+        self.mtime = None
+        self.optionxform = str.lower
+
+    def reload(self):
+        """(Re-)parse configuration file"""
+        config = ConfigParser()
+        config.read(self.filepath)
+        self.optionxform = config.optionxform
+        self.sections = {
+            section: dict(config.items(section))
+            for section in config.sections()
+        }
+        self.sections[config.default_section] = dict(config.defaults())
+        try:
+            self.mtime = os.path.getmtime(self.filepath)
+        except OSError:
+            self.mtime = None
+
+    def get(self, section, key):
+        """
+        Get configuration value
+
+        :param section: section name (case-sensitive)
+        :param key: key name
+        :returns: configuration value
+        """
+        if self.sections is None:
+            self.reload()
+        elif self.check_mtime:
+            try:
+                mtime = os.path.getmtime(self.filepath)
+            except OSError:
+                mtime = None
+            if mtime != self.mtime:
+                self.reload()
+
+        try:
+            options = self.sections[section]
+        except KeyError:
+            raise NoSectionError(section)
+        option = self.optionxform(key)
+        try:
+            return options[option]
+        except KeyError:
+            raise NoOptionError(option, section)
+
+
+CONFIG = ConfigIndex(get_config_filepath())
+
 
 def get_config_value(section, key, where='config_file'):
     if where == 'config_file':
-        filepath = os.path.join(__DIRPATH, 'resource.cfg')
-        config = ConfigParser()
-        config.read(filepath)
-        return config.get(section, key)
+        return CONFIG.get(section, key)
+
+
+def reload_config():
+    """Re-read resource.cfg into the configuration index"""
+    CONFIG.reload()
+
+
+def normalize_name(name):
+    """
+    Normalise a PI or station name for lookups
+
+    Folds case and drops dots and whitespace, so that e.g.
+    'Addis Ababa', 'ADDIS.ABABA' and 'addis ababa' share a key.
+
+    :param name: PI or station name
+    :returns: normalised name
+    """
+    return ''.join(name.replace('.', ' ').split()).upper()
+
+
+class NDACCIndex(object):
+    """
+    Parsed-once index of an NDACC metadata list (PI_list.txt,
+    Stations_list.txt), keyed on the exact and the normalised first
+    column
+    """
+
+    def __init__(self, filepath):
+        """
+        Initialize index, parsing is deferred to the first lookup
+
+        :param filepath: path to comma-separated list with a two line
+                         heading
+        """
+        self.filepath = filepath
+        self.exact = None
+        self.normalized = None
+
+    def reload(self):
+        """(Re-)parse list file"""
+        exact = {}
+        normalized = {}
+        with open(self.filepath, encoding='utf-8') as ff:
+            for line in ff.readlines()[2:]:
+                fields = [field.strip() for field in line.split(',')]
+                if len(fields) < 2 or not fields[0]:
+                    continue
+                values = tuple(fields[1:])
+                exact.setdefault(fields[0], values)
+                normalized.setdefault(normalize_name(fields[0]), values)
+        self.exact = exact
+        self.normalized = normalized
+
+    def get(self, name):
+        """
+        Get the remaining columns of the row for a name
+
+        :param name: PI or station name, exact or in any spelling that
+                     normalises to the same key
+        :returns: tuple of column values, or None if not listed
+        """
+        if self.exact is None:
+            self.reload()
+        values = self.exact.get(name.strip())
+        if values is None:
+            values = self.normalized.get(normalize_name(name))
+        return values
+
+
+PI_INDEX = NDACCIndex(os.path.join(__DIRPATH, 'PI_list.txt'))
+STATION_INDEX = NDACCIndex(os.path.join(__DIRPATH, 'Stations_list.txt'))
 
 
 def get_NDACC_agency(PI):
-    with open(os.path.join(__DIRPATH, 'PI_list.txt')) as ff:
-        for line in ff.readlines():
-            if PI in line:
-                return line.split(',')[1].strip()
+    """
+    Get the agency of an NDACC PI
+
+    :param PI: PI name as listed in PI_list.txt
+    :returns: agency name, or None if not listed
+    """
+    values = PI_INDEX.get(PI)
+    if values is not None:
+        return values[0]
+
+
+def get_NDACC_agencies(PIs):
+    """
+    Resolve the agencies of many NDACC PIs in one call
+
+    :param PIs: iterable of PI names
+    :returns: dict of PI name to agency name (None if not listed)
+    """
+    return {PI: get_NDACC_agency(PI) for PI in PIs}
 
 
 def get_NDACC_station(station):
-    with open(os.path.join(__DIRPATH, 'Stations_list.txt')) as ff:
-        for line in ff.readlines():
-            if station in line:
-                return line.split(',')[1], line.split(',')[2]
+    """
+    Get the location of an NDACC station
+
+    :param station: station name as listed in Stations_list.txt
+    :returns: tuple of latitude, longitude strings, or None if not
+              listed
+    """
+    values = STATION_INDEX.get(station)
+    if values is not None:
+        return values[0], values[1]
+
+
+def get_NDACC_stations(stations):
+    """
+    Resolve the locations of many NDACC stations in one call
+
+    :param stations: iterable of station names
+    :returns: dict of station name to (latitude, longitude) tuple
+              (None if not listed)
+    """
+    return {station: get_NDACC_station(station) for station in stations}
+
+
+class StationMetadataError(Exception):
+    """Station metadata unavailable"""
+    pass
+
+
+class StationRegistry(object):
+    """
+    Dictionary indexes over the features of a station metadata snapshot
+    """
+
+    def __init__(self, metadata):
+        """
+        Build indexes, feature order decides between duplicates as the
+        linear scans did
+
+        :param metadata: station metadata GeoJSON dict
+        """
+        self.metadata = metadata
+        self.by_name = {}
+        self.by_name_acronym = {}
+        self.by_name_agency = {}
+        self.by_contributor = {}
+        self.by_id = {}
+
+        for row in metadata['features']:
+            properties = row['properties']
+            name = properties['platform_name']
+            acronym = properties.get('acronym')
+            contributor = properties.get('contributor_name')
+
+            # SHADOZ files may carry UTF-8 names read as Latin-1
+            for spelling in set([name, self.latin1_spelling(name)]):
+                if spelling is not None:
+                    self.by_name_acronym.setdefault((spelling, acronym),
+                                                    properties)
+
+            name_key = name.lower()
+            self.by_name.setdefault(name_key, []).append(properties)
+            for agency in (acronym, contributor):
+                if agency:
+                    self.by_name_agency[(name_key, agency.lower())] = \
+                        properties
+            if contributor:
+                self.by_contributor.setdefault(
+                    contributor.lower(), []).append(properties)
+            self.by_id.setdefault(
+                str(properties.get('platform_id')), []).append(properties)
+
+    @staticmethod
+    def latin1_spelling(name):
+        """
+        :param name: platform name
+        :returns: name as UTF-8 bytes misread as Latin-1, or None
+        """
+        try:
+            return name.encode('utf-8').decode('latin1')
+        except UnicodeError:
+            return None
+
+    def find(self, name, acronym):
+        """
+        :param name: platform name (exact, or its Latin-1 misreading)
+        :param acronym: agency acronym (exact)
+        :returns: station properties, or None
+        """
+        return self.by_name_acronym.get((name, acronym))
+
+    def find_all(self, name):
+        """
+        :param name: platform name (case-insensitive)
+        :returns: list of station properties under any agency
+        """
+        return self.by_name.get(name.lower(), [])
+
+    def find_by_agency(self, name, agency):
+        """
+        :param name: platform name (case-insensitive)
+        :param agency: agency acronym or contributor name
+                       (case-insensitive)
+        :returns: station properties, or None
+        """
+        return self.by_name_agency.get((name.lower(), agency.lower()))
+
+    def find_by_contributor(self, contributor):
+        """
+        :param contributor: contributor name (case-insensitive)
+        :returns: list of station properties
+        """
+        return self.by_contributor.get(contributor.lower(), [])
+
+    def find_by_id(self, platform_id):
+        """
+        :param platform_id: WOUDC platform ID
+        :returns: list of station properties
+        """
+        return self.by_id.get(str(platform_id), [])
+
+
+class StationMetadataProvider(object):
+    """
+    WOUDC station metadata (pywoudc GeoJSON) with an in-memory copy and
+    an on-disk snapshot, so that many conversions share one fetch
+    """
+
+    def __init__(self, cache_file=None, ttl=86400, offline=False):
+        """
+        Initialize provider, nothing is fetched until the first lookup
+
+        :param cache_file: path to on-disk snapshot (None: memory only)
+        :param ttl: seconds a snapshot is used before refetching
+                    (None: never expires)
+        :param offline: never contact the network, only use the snapshot
+        """
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.offline = offline
+        self.metadata = None
+        self.timestamp = None
+        self.fetches = 0
+        self._registry = None
+
+    def configure(self, cache_file=None, ttl=None, offline=None):
+        """
+        Change provider settings, dropping the in-memory copy
+
+        :param cache_file: path to on-disk snapshot
+        :param ttl: seconds a snapshot is used before refetching
+        :param offline: never contact the network
+        """
+        if cache_file is not None:
+            self.cache_file = cache_file
+        if ttl is not None:
+            self.ttl = ttl
+        if offline is not None:
+            self.offline = offline
+        self.metadata = None
+        self.timestamp = None
+
+    def expired(self, timestamp):
+        """
+        :param timestamp: time the metadata was fetched
+        :returns: True if metadata of that age must be refetched
+        """
+        if self.ttl is None:
+            return False
+        return time.time() - timestamp > self.ttl
+
+    def read_snapshot(self):
+        """
+        :returns: tuple of fetch time, metadata from the on-disk
+                  snapshot, or None if there is no usable snapshot
+        """
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return None
+        try:
+            with open(self.cache_file, encoding='utf-8') as ff:
+                snapshot = json.load(ff)
+            return float(snapshot['timestamp']), snapshot['metadata']
+        except Exception as err:
+            LOGGER.warning('Ignoring unreadable station metadata snapshot %s: %s',  # noqa
+                           self.cache_file, err)
+            return None
+
+    def write_snapshot(self):
+        """Write in-memory metadata to the on-disk snapshot"""
+        if self.cache_file is None:
+            return
+        try:
+            dirname = os.path.dirname(os.path.abspath(self.cache_file))
+            os.makedirs(dirname, exist_ok=True)
+            tmp_file = '%s.tmp' % self.cache_file
+            with open(tmp_file, 'w', encoding='utf-8') as ff:
+                json.dump({'timestamp': self.timestamp,
+                           'metadata': self.metadata}, ff)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as err:
+            LOGGER.warning('Unable to write station metadata snapshot %s: %s',  # noqa
+                           self.cache_file, err)
+
+    def fetch(self):
+        """
+        :returns: station metadata from the WOUDC web service
+        """
+        LOGGER.info('Fetching station metadata from pywoudc.')
+        self.fetches += 1
+        return WoudcClient().get_station_metadata(raw=False)
+
+    def get(self):
+        """
+        Get station metadata, from memory, the snapshot or the network
+        in that order
+
+        A failed fetch falls back to an expired snapshot.
+
+        :returns: station metadata GeoJSON dict
+        """
+        if self.metadata is not None and not self.expired(self.timestamp):
+            return self.metadata
+
+        snapshot = self.read_snapshot()
+        if snapshot is not None and \
+                (self.offline or not self.expired(snapshot[0])):
+            self.timestamp, self.metadata = snapshot
+            return self.metadata
+        if self.offline:
+            raise StationMetadataError(
+                'Offline and no station metadata snapshot at %s'
+                % self.cache_file)
+
+        try:
+            metadata = self.fetch()
+        except Exception as err:
+            if snapshot is None:
+                raise
+            LOGGER.warning('Unable to fetch station metadata (%s), using expired snapshot %s',  # noqa
+                           err, self.cache_file)
+            self.timestamp, self.metadata = snapshot
+            return self.metadata
+
+        self.timestamp = time.time()
+        self.metadata = metadata
+        self.write_snapshot()
+        return self.metadata
+
+    def registry(self):
+        """
+        :returns: StationRegistry of the current metadata, built once per
+                  snapshot
+        """
+        metadata = self.get()
+        if self._registry is None or self._registry.metadata is not metadata:  # noqa
+            self._registry = StationRegistry(metadata)
+        return self._registry
+
+
+METADATA = StationMetadataProvider()
+
+
+def configure_metadata(cache_file=None, ttl=None, offline=None):
+    """
+    Configure the shared station metadata provider
+
+    :param cache_file: path to on-disk snapshot
+    :param ttl: seconds a snapshot is used before refetching
+    :param offline: never contact the network, only use the snapshot
+    """
+    METADATA.configure(cache_file, ttl, offline)
+
+
+def get_station_metadata():
+    """
+    :returns: WOUDC station metadata GeoJSON dict, fetched at most once
+              per TTL
+    """
+    return METADATA.get()
+
+
+def get_station_registry():
+    """
+    :returns: StationRegistry over the WOUDC station metadata
+    """
+    return METADATA.registry()
 
 
 def get_extcsv(url):
     """Get an Extended CSV from WOUDC WAF."""
-    url = quote(url, "%/:=&?~#+!$,;'@()*[]|")
+    extcsv, error = get_extcsvs([url], workers=1)[url]
+    if error is not None:
+        LOGGER.warning(error)
+    return extcsv
+
+
+def decode_content(content):
+    """
+    Decode downloaded bytes with the first encoding that fits
+
+    :param content: bytes
+    :returns: str
+    """
+    for encoding in ENCODINGS[:-1]:
+        try:
+            return content.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return content.decode(ENCODINGS[-1], 'replace')
+
+
+class ExtCSVFetcher(object):
+    """
+    Concurrent download of Extended CSVs from WOUDC WAF over pooled
+    keep-alive connections
+    """
+
+    def __init__(self, workers=8, per_host=4, retries=5, backoff=0.5,
+                 max_backoff=30, timeout=30):
+        """
+        Initialize fetcher
+
+        :param workers: number of concurrent downloads
+        :param per_host: maximum concurrent downloads from one host
+        :param retries: retries per URL on connection errors, timeouts
+                        and HTTP 429/5xx
+        :param backoff: base delay in seconds, doubled on every retry
+        :param max_backoff: upper bound of the delay in seconds
+        :param timeout: connect/read timeout in seconds
+        """
+        self.workers = workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._sessions = []
+
+    def session(self):
+        """
+        :returns: this thread's requests.Session
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=self.per_host)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def host_slot(self, url):
+        """
+        :param url: URL to download
+        :returns: semaphore bounding concurrent downloads from its host
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def delay(self, attempt):
+        """
+        :param attempt: number of the failed attempt, starting at 0
+        :returns: seconds to wait, exponential with full jitter
+        """
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def fetch(self, url):
+        """
+        Download and parse one Extended CSV
+
+        :param url: URL of the file
+        :returns: tuple of Extended CSV object, error message (one of
+                  them None)
+        """
+        url = quote(url, "%/:=&?~#+!$,;'@()*[]|")
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.delay(attempt - 1))
+                LOGGER.info('Retrying %s (%d/%d)', url, attempt,
+                            self.retries)
+            try:
+                with self.host_slot(url):
+                    response = self.session().get(url, timeout=self.timeout)
+                    content = response.content
+            except (requests.ConnectionError, requests.Timeout) as err:
+                error = 'Unable to fetch %s: %s' % (url, err)
+                continue
+            except requests.RequestException as err:
+                return None, 'Unable to fetch %s: %s' % (url, err)
+
+            if response.status_code in RETRY_STATUS:
+                error = 'Unable to fetch %s: HTTP %d' % (
+                    url, response.status_code)
+                continue
+            if response.status_code != 200:
+                return None, 'Unable to fetch %s: HTTP %d' % (
+                    url, response.status_code)
+            try:
+                return loads(decode_content(content)), None
+            except Exception as err:
+                return None, 'Unable to parse %s: %s' % (url, err)
+        return None, error
+
+    def fetch_all(self, urls):
+        """
+        Download and parse many Extended CSVs concurrently
+
+        :param urls: list of URLs
+        :returns: dict of URL to (Extended CSV object, error message)
+                  tuple, in input order
+        """
+        urls = list(urls)
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for index, result in enumerate(executor.map(self.fetch, urls)):
+                results[urls[index]] = result
+        return results
+
+    def close(self):
+        """Close pooled connections"""
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+
+
+def get_extcsvs(urls, **kwargs):
+    """
+    Get many Extended CSVs from WOUDC WAF concurrently
+
+    :param urls: list of URLs
+    :param kwargs: ExtCSVFetcher options (workers, per_host, retries,
+                   backoff, max_backoff, timeout)
+    :returns: dict of URL to (Extended CSV object, error message) tuple
+    """
+    fetcher = ExtCSVFetcher(**kwargs)
     try:
-        content = urlopen(url).read()
-        return loads(content)
-    except (SocketError, URLError) as err:
-        LOGGER.warning(str(err))
-        if err.errno in (
-                errno.ECONNRESET, errno.ECONNREFUSED, errno.ETIMEDOUT):
-            time.sleep(5)
-            LOGGER.info('Retrying...')
-            return get_extcsv(url)
-        else:
-            return
+        return fetcher.fetch_all(urls)
+    finally:
+        fetcher.close()
 
 
 def download_zip(path, filename):
@@ -140,6 +738,101 @@ def zip_file(output, outpath, zipfilename):
     output.close()
 
 
+class PayloadColumns(object):
+    """
+    Columnar view of an ext-CSV payload table, parsed once
+    """
+
+    def __init__(self, raw):
+        """
+        Parse payload rows into one list per field
+
+        :param raw: payload table text, field names on the first row
+        """
+        self.raw = raw
+        data_rows = csv.reader(StringIO(raw))
+        self.fields = next(data_rows, [])
+        width = len(self.fields)
+        # number of rows too short to hold each field
+        self.missing = [0] * width
+        rows = list(data_rows)
+        for n, row in enumerate(rows):
+            if len(row) < width:
+                for i in range(len(row), width):
+                    self.missing[i] += 1
+                rows[n] = row + [''] * (width - len(row))
+        self.columns = [[row[i] for row in rows] for i in range(width)]
+        self.index = {}
+        for i, field in enumerate(self.fields):
+            self.index.setdefault(field, i)
+
+    def get(self, field):
+        """
+        :param field: field name
+        :returns: list of the field's values, blank where rows are short,
+                  or an empty list if there is no such field
+        """
+        i = self.index.get(field)
+        if i is None:
+            return []
+        if self.missing[i]:
+            LOGGER.warning('Empty column for field %s in %d rows. '
+                           'Putting in blank', field, self.missing[i])
+        return list(self.columns[i])
+
+
+def get_payload_columns(extcsv, table):
+    """
+    Get the columnar view of a payload table, cached on the extCSV
+    object until the table's text changes
+
+    :param extcsv: extCSV object
+    :param table: payload table name
+    :returns: PayloadColumns
+    """
+    raw = extcsv.sections[table]['_raw']
+    cache = getattr(extcsv, '_payload_columns', None)
+    if cache is None:
+        cache = {}
+        extcsv._payload_columns = cache
+    columns = cache.get(table)
+    if columns is None or columns.raw is not raw:
+        columns = PayloadColumns(raw)
+        cache[table] = columns
+    return columns
+
+
+def add_payload(ecsv, table, fields, columns=None, index=1):
+    """
+    Add a payload block to an ext-CSV table in one call per field,
+    instead of one add_data call per row
+
+    :param ecsv: `woudc_extcsv.Writer` object
+    :param table: payload table name
+    :param fields: list of field names
+    :param columns: list of columns (lists of text values), one per field
+                    (default None, only the fields are added)
+    :param index: table index or grouping
+    """
+    if columns is None:
+        for field in fields:
+            ecsv.add_data(table, [], field=field, index=index)
+        return
+    if len(columns) != len(fields):
+        raise ValueError('%d columns for %d fields' %
+                         (len(columns), len(fields)))
+    sizes = set(len(column) for column in columns)
+    if len(sizes) > 1:
+        raise ValueError('Columns of unequal length')
+    if not columns or sizes == {0}:
+        raise ValueError('No payload rows for table %s' % table)
+    for i, field in enumerate(fields):
+        column = columns[i]
+        if not isinstance(column, list):
+            column = list(column)
+        ecsv.add_data(table, column, field=field, index=index)
+
+
 def get_extcsv_value(extcsv, table, field, payload=False):
     """helper for getting value from extCSV object"""
     if payload is False:
@@ -158,27 +851,30 @@ def get_extcsv_value(extcsv, table, field, payload=False):
     if payload:
         value = None
         if table in extcsv.sections.keys():
-            body = StringIO(extcsv.sections[table]['_raw'])
-            data_rows = csv.reader(body)
-            fields = next(data_rows)
-            value = []
-            for row in data_rows:
-                if field in fields:
-                    try:
-                        value.append(row[fields.index(field)])
-                    except IndexError as err:
-                        msg = 'Empty column for table %s, field %s.\
-                        Putting in blank due to %s' % (table, field, str(err))
-                        LOGGER.warning(msg)
-                        value.append('')
-                    except Exception as err:
-                        msg = 'Unable to get value for table: %s, field: %s.\
-                            Due to: %s' % (table, field, str(err))
-                        LOGGER.error(msg)
-                        raise BPSExtCSVValueRetrievalError(msg)
+            try:
+                value = get_payload_columns(extcsv, table).get(field)
+            except Exception as err:
+                msg = 'Unable to get value for table: %s, field: %s.\
+                    Due to: %s' % (table, field, str(err))
+                LOGGER.error(msg)
+                raise BPSExtCSVValueRetrievalError(msg)
         return value
 
 
+def get_extcsv_values(extcsv, table, fields, payload=False):
+    """
+    helper for getting several values of one table from extCSV object
+
+    :param extcsv: extCSV object
+    :param table: table name
+    :param fields: list of field names
+    :param payload: True for payload tables (list of values per field)
+    :returns: list of values, in the order of fields
+    """
+    return [get_extcsv_value(extcsv, table, field, payload)
+            for field in fields]
+
+
 def setup_logger(logfile, loglevel):
     """
     Setup logging mechanism
@@ -219,6 +915,133 @@ def BPSExtCSVValueRetrievalError(Exception):
     pass
 
 
+class FixedWidthVariant(object):
+    """
+    Data section of a fixed-width text format variant: the header line
+    starting it and the column positions of its rows
+    """
+
+    def __init__(self, name, signature, columns):
+        """
+        Initialize a fixed-width variant
+
+        :param name: variant name
+        :param signature: text of the header line starting the data
+        :param columns: list of (field, start, stop) column positions
+        """
+        self.name = name
+        self.signature = signature
+        self.columns = list(columns)
+        self.fields = [field for field, start, stop in self.columns]
+        self.width = max([1] + [stop for field, start, stop in self.columns])
+
+    def extract(self, lines):
+        """
+        Cut the columns out of data lines in bulk, as line[start:stop]
+        stripped of whitespace
+
+        :param lines: list of data lines
+        :returns: dict of field name to array of text values
+        """
+        block = np.array(lines, dtype='U%d' % self.width)
+        chars = block.view(np.uint32).reshape(len(lines), self.width)
+        columns = {}
+        for field, start, stop in self.columns:
+            column = np.ascontiguousarray(chars[:, start:stop])
+            column = column.view('U%d' % max(stop - start, 1))
+            columns[field] = np.char.strip(column.reshape(len(lines)))
+        return columns
+
+
+class FixedWidthFormat(object):
+    """
+    Line classifier of a fixed-width text format
+
+    Lines holding a metadata label or a variant signature are found
+    with one compiled pattern.  Other lines are skipped until a variant
+    signature starts a data section, and are then data rows of that
+    variant.
+    """
+
+    def __init__(self, variants, rules=(), exclusive=True,
+                 blank_rows=False):
+        """
+        Initialize a fixed-width format
+
+        :param variants: list of `FixedWidthVariant` objects, all with
+                         the same fields
+        :param rules: list of (label, key, getter) metadata rules: a line
+                      holding label gives metadata[key] = getter(line)
+        :param exclusive: a line matching a rule is read by the first
+                          such rule only (default True); otherwise by
+                          every matching rule, and as a data row as well
+        :param blank_rows: whitespace-only lines in data sections are
+                           data rows (default False, skipped)
+        """
+        self.variants = list(variants)
+        self.rules = list(rules)
+        self.exclusive = exclusive
+        self.blank_rows = blank_rows
+        self.fields = self.variants[0].fields
+        labels = [label for label, key, getter in self.rules]
+        labels += [variant.signature for variant in self.variants]
+        self.pattern = re.compile('|'.join(re.escape(label)
+                                           for label in labels))
+
+    def read(self, lines):
+        """
+        Classify text lines
+
+        :param lines: iterable of text lines
+        :returns: tuple of (metadata dict, list of (variant, data lines)
+                  data sections, in order)
+        """
+        metadata = {}
+        sections = []
+        data = None
+        for line in lines:
+            if line == '' or (not self.blank_rows and line.strip() == ''):
+                continue
+            if self.pattern.search(line) is not None:
+                matched = False
+                for label, key, getter in self.rules:
+                    if label in line:
+                        metadata[key] = getter(line)
+                        matched = True
+                        if self.exclusive:
+                            break
+                if matched and self.exclusive:
+                    continue
+                variant = None
+                for candidate in self.variants:
+                    if candidate.signature in line:
+                        variant = candidate
+                        break
+                if variant is not None:
+                    data = []
+                    sections.append((variant, data))
+                    continue
+            if data is not None:
+                data.append(line)
+        return metadata, sections
+
+    def extract(self, sections):
+        """
+        Cut the columns out of all data sections
+
+        :param sections: list of (variant, data lines) data sections
+        :returns: dict of field name to array of text values
+        """
+        parts = [variant.extract(lines) for variant, lines in sections]
+        columns = {}
+        for field in self.fields:
+            values = [part[field] for part in parts]
+            if not values:
+                values = [np.array([], dtype=str)]
+            columns[field] = np.concatenate(values)
+        return columns
+
+
 def is_number(s):
     try:
         float(s)
@@ -281,18 +1104,121 @@ def date_YYYYMMDD(date):
 
 
 # returns total size of directory and number of files
-def get_dir_stat(dir_path, ignore=None):
+def get_dir_stat(dir_path, ignore=None, workers=SCAN_WORKERS):
     dir_size = 0
     num_of_files = 0
-    for dirname, dirnames, filenames in os.walk(dir_path):
-        if ignore is not None and ignore in dirnames:
-            dirnames = dirnames.remove(ignore)
-        for filename in filenames:
-            dir_size += os.path.getsize(os.path.join(dirname, filename))
-            num_of_files += 1
+
+    def accept_directory(relpath):
+        return ignore is None or os.path.basename(relpath) != ignore
+
+    for filepath, size, mtime, error in scan_directory(
+            dir_path, workers, accept_directory):
+        if error is not None:
+            raise error
+        dir_size += size
+        num_of_files += 1
     return [int(dir_size), num_of_files]
 
 
+def scan_entries(dirpath):
+    """
+    Lists one directory with os.scandir, reusing each entry's stat
+
+    :param dirpath: directory path
+    :returns: tuple of (list of (name, size, mtime, error) file tuples,
+              list of (name, descend) subdirectory tuples, where descend
+              is False for symbolic links, which os.walk does not follow)
+    """
+
+    files = []
+    dirs = []
+    try:
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    try:
+                        descend = not entry.is_symlink()
+                    except OSError:
+                        descend = False
+                    dirs.append((entry.name, descend))
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError as err:
+                    files.append((entry.name, None, None, err))
+                    continue
+                files.append((entry.name, stat.st_size, stat.st_mtime, None))
+    except OSError as err:
+        LOGGER.warning('Unable to list directory {}: {}'.format(dirpath, err))  # noqa
+    files.sort()
+    dirs.sort()
+    return files, dirs
+
+
+def scan_directory(path, workers=SCAN_WORKERS, accept_directory=None):
+    """
+    Lists the files of a directory tree in sorted os.walk order, taking
+    sizes and mtimes from os.scandir entries instead of one stat call
+    per path
+
+    Directories are listed by a pool of threads, which keeps many
+    listings in flight on network mounted archives; the order of the
+    result does not depend on the number of workers.
+
+    :param path: top directory
+    :param workers: number of listing threads (1 lists serially)
+    :param accept_directory: callable taking a directory path relative
+                             to path, returning False for directories
+                             not to descend into
+    :returns: generator of (filepath, size, mtime, error) tuples, where
+              error is the OSError raised by stat (size and mtime None)
+    """
+
+    listings = {}
+
+    def record(dirpath, relpath, listing):
+        files, dirs = listing
+        kept = []
+        for name, descend in dirs:
+            subpath = os.path.join(relpath, name)
+            if accept_directory is None or accept_directory(subpath):
+                kept.append((name, descend))
+        listings[dirpath] = (files, kept)
+        return [(os.path.join(dirpath, name), os.path.join(relpath, name))
+                for name, descend in kept if descend]
+
+    if workers is None or workers <= 1:
+        queue = [(path, '')]
+        while queue:
+            dirpath, relpath = queue.pop()
+            queue.extend(record(dirpath, relpath, scan_entries(dirpath)))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(scan_entries, path): (path, '')}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dirpath, relpath = futures.pop(future)
+                    for subdir in record(dirpath, relpath, future.result()):
+                        futures[executor.submit(scan_entries, subdir[0])] = subdir  # noqa
+
+    # files of a directory first, then its subdirectories in name order
+    stack = [path]
+    while stack:
+        dirpath = stack.pop()
+        if dirpath not in listings:
+            continue
+        files, dirs = listings.pop(dirpath)
+        for name, size, mtime, error in files:
+            yield os.path.join(dirpath, name), size, mtime, error
+        stack.extend(os.path.join(dirpath, name)
+                     for name, descend in reversed(dirs) if descend)
+
+
 # print WOUDC extCSV standard format of TotalOzone data
 def print_extCSV(extCSVObj, filepath):
     filename = '%s.%s.%s.%s.%s.csv' % (extCSVObj.timestamp['date'].replace('-','')[:6]+'01', extCSVObj.instrument['name'], extCSVObj.instrument['model'], extCSVObj.instrument['number'], extCSVObj.data_generation['agency'])  # noqa
@@ -433,77 +1359,199 @@ def average(data_list):
     return float(sum(data_list)) / len(data_list)
 
 
+# ext-CSV tables holding payload rows rather than one row of values
+PAYLOAD_TABLES = ('DAILY',)
+
+
+def format_payload(block):
+    """
+    Normalise the rows of a payload section
+
+    :param block: stripped section text, table name on the first line
+    :returns: CSV text of the non-blank rows following the table name
+    """
+    lines = [line for line in block.split('\n')[1:] if line.strip()]
+    buf = StringIO()
+    w = csv.writer(buf)
+    w.writerows(row for row in csv.reader(lines) if row)
+    return buf.getvalue()
+
+
+class LazyPayload(dict):
+    """
+    Payload section that keeps its blocks as unparsed text until '_raw'
+    is first accessed
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.blocks = []
+
+    def __missing__(self, key):
+        if key != '_raw':
+            raise KeyError(key)
+        parts = [format_payload(self.blocks[0])]
+        parts.extend(format_payload(b)[80:] for b in self.blocks[1:])
+        raw = ''.join(parts)
+        self['_raw'] = raw
+        self.blocks = []
+        return raw
+
+    def __contains__(self, key):
+        return key == '_raw' or dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
 class WOUDCextCSVReader(object):
-    def __init__(self, filepath):
+    def __init__(self, filepath, stream=None, tables=None,
+                 early_exit=False):
         """
         Read WOUDC extCSV file and objectify
+
+        :param filepath: path to file (or name of stream when given)
+        :param stream: binary file-like object to read instead of filepath
+        :param tables: names of the tables to keep (default all); other
+                       tables are skipped and payload tables are parsed
+                       on first access of their '_raw' text
+        :param early_exit: stop reading once every table in tables was
+                           seen (first occurrence wins); has no effect
+                           when tables include a payload table
         """
         self.sections = {}
         self.filepath = filepath
-        self.read_file(filepath)
+        self.tables = None if tables is None else frozenset(tables)
+        self.early_exit = early_exit
+        if stream is not None:
+            self.read_stream(stream)
+        else:
+            self.read_file(filepath)
+
+    def complete(self):
+        """
+        :returns: True if reading can stop before the end of the file
+        """
+        if not self.early_exit or self.tables is None:
+            return False
+        if self.tables.intersection(PAYLOAD_TABLES):
+            return False
+        return all(table in self.sections for table in self.tables)
 
     def read_file(self, filepath):
         """
-        Attempts to read a file with various encodings to handle different
-        character sets.
+        Reads a file in a single pass, see read_stream.
         """
-        encodings_to_try = ['utf-8', 'iso-8859-1', 'windows-1252']
-        for encoding in encodings_to_try:
+        try:
+            with open(filepath, 'rb') as f:
+                self.read_stream(f)
+        except FileNotFoundError as err:
+            LOGGER.error(
+                f"ERROR: Unable to process file: {filepath}: {err}"
+            )
+
+    def read_stream(self, stream, chunk_size=1048576):
+        """
+        Reads a binary stream (file, zip archive member) in a single
+        pass of line-aligned chunks, building each section as soon as
+        its last line arrives.
+
+        The whole stream is decoded in a single encoding: as UTF-8, or,
+        when any chunk fails to decode, re-read from its start position
+        as ISO-8859-1.
+
+        :param stream: binary file-like object (seekable)
+        :param chunk_size: approximate number of bytes per chunk
+        """
+        start = stream.tell()
+        for encoding in ENCODINGS[:2]:
             try:
-                with open(filepath, encoding=encoding) as f:
-                    blocks = f.read().split('#')
-                    # get rid of the first element of cruft
-                    blocks.pop(0)
-                    self.process_blocks(blocks)
-                break
-            except (UnicodeDecodeError, FileNotFoundError) as err:
+                self._read_chunks(stream, chunk_size, encoding)
+                return
+            except UnicodeDecodeError as err:
                 LOGGER.warning(
-                    f"Failed to read file {filepath} with "
+                    f"Failed to read file {self.filepath} with "
                     f"encoding {encoding}: {err}"
                 )
-        else:
-            LOGGER.error(
-                f"ERROR: Unable to process file: {filepath}. "
-                "All encoding attempts failed."
-            )
+                stream.seek(start)
+                self.sections = {}
+
+    def _read_chunks(self, stream, chunk_size, encoding):
+        """
+        Reads and processes stream chunks decoded with encoding
+
+        :param stream: binary file-like object
+        :param chunk_size: approximate number of bytes per chunk
+        :param encoding: text encoding of the whole stream
+        """
+        section = None
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            if not chunk.endswith(b'\n'):
+                chunk += stream.readline()
+            text = chunk.decode(encoding)
+
+            # universal newlines, as in text mode
+            if '\r' in text:
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+            # '#' starts a section wherever it appears
+            parts = text.split('#')
+            if section is not None:
+                section.append(parts[0])
+            for part in parts[1:]:
+                if section is not None:
+                    self.process_section(''.join(section))
+                    if self.complete():
+                        return
+                section = [part]
+        if section is not None:
+            self.process_section(''.join(section))
+
+    def process_section(self, block):
+        """
+        Process one section, the text following a '#'
+
+        :param block: section text, lines terminated by newlines
+        """
+        block = block.strip()
+        if not block:
+            return
+        header = next(csv.reader([block.split('\n', 1)[0]]))[0]
+        if self.tables is not None and header not in self.tables:
+            return
+
+        if header in PAYLOAD_TABLES:
+            if self.tables is not None:
+                self.sections.setdefault(header, LazyPayload())
+                self.sections[header].blocks.append(block)
+            elif header not in self.sections:
+                self.sections[header] = {'_raw': format_payload(block)}
+            else:
+                self.sections[header]['_raw'] += format_payload(block)[80:]  # noqa
+            return
+
+        # metadata, remove blank lines
+        lines = [line for line in block.split('\n') if line.strip()]
+        self.sections[header] = {}
+        self.sections[header]['_raw'] = '\n'.join(lines)
+        rows = csv.reader(lines[1:])
+        fields = next(rows, [])
+        values = next(rows, [])
+        for i, field in enumerate(fields):
+            try:
+                self.sections[header][field] = values[i]
+            except IndexError as err:
+                self.sections[header][field] = None
+                LOGGER.warning('Corrupt format in {}, section {}: {}'.format(self.filepath, header, err))  # noqa
 
     def process_blocks(self, blocks):
         """ Process the blocks of the file after splitting. """
         for b in blocks:
-            # Remove blank lines before processing
-            lines = [line for line in b.strip().split('\n') if line.strip()]
-            cleaned_block = '\n'.join(lines)
-
-            s = StringIO(cleaned_block)
-            c = csv.reader(s)
-            header = next(c)[0]
-
-            if header != 'DAILY':  # metadata
-                self.sections[header] = {}
-                self.sections[header]['_raw'] = cleaned_block
-                try:
-                    fields = next(c)
-                    values = next(c)
-                except StopIteration:
-                    pass
-                i = 0
-                for field in fields:
-                    try:
-                        self.sections[header][field] = values[i]
-                        i += 1
-                    except Exception as err:
-                        self.sections[header][field] = None
-                        LOGGER.warning('Corrupt format in {}, section {}: {}'.format(self.filepath, header, err))  # noqa
-            else:  # payload
-                buf = StringIO()
-                w = csv.writer(buf)
-                for row in c:
-                    if row:  # Skip empty rows
-                        w.writerow(row)
-                if header not in self.sections:
-                    self.sections[header] = {'_raw': buf.getvalue()}
-                else:
-                    self.sections[header]['_raw'] += buf.getvalue()[80:]  # noqa
+            self.process_section(b)
 
 
 class CSX (object):